@@ -0,0 +1,34 @@
+# ======================================
+# INFORME D'AVALUACIÓ DEL MODEL DE SERVEI
+# ======================================
+#
+# python avaluar_model.py                     -> model/evaluacion/
+# python avaluar_model.py --sortida informes/  -> una altra carpeta
+# python avaluar_model.py --versio V           -> el paquet V (per defecte, l'actiu)
+#
+# No entrena ni obre cap finestra: carrega el model que serveix l'API i
+# l'almacén de features, prediu una sola vegada les files de prova i escriu
+# la matriu de confusió, el classification report i les importàncies
+# (impuresa i permutació) en PNG, HTML i JSON.
+
+import argparse
+
+from ml_service import EVALUACION_PATH, cargar_paquete, evaluar_modelo, obtener_almacen
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Genera l'informe d'avaluació del model entrenat.")
+    parser.add_argument("--sortida", default=EVALUACION_PATH, help="carpeta de l'informe (per defecte %(default)s)")
+    parser.add_argument("--versio", default=None, help="paquet de model (per defecte, l'actiu: el que serveix l'API)")
+    args = parser.parse_args()
+
+    paquet = cargar_paquete(args.versio)
+    model, pipeline = paquet.model, paquet.pipeline
+    almacen = obtener_almacen()
+    if list(pipeline.etiquetas) != list(almacen.pipeline.etiquetas) or pipeline.columnas != almacen.columnas:
+        raise SystemExit("El model no s'ha entrenat amb l'almacén actual: torna a executar entrenar_modelo.py")
+
+    print(f"📊 Avaluant el paquet {paquet.version} ({paquet.nombre})... (sense pantalla)")
+    informe = evaluar_modelo(model, almacen, args.sortida, paquet.nombre)
+    print(f"Precisió: {informe['precision']:.3f}  (predicció {informe['prediccion_s']} s, "
+          f"permutació {informe['permutacion_s']} s)")
+    print(f"✔ Informe guardat a {args.sortida}")
@@ -0,0 +1,133 @@
+# ======================================
+# BENCHMARK: REPOSITORI PANDAS VS SQLITE
+# ======================================
+#
+# python benchmark_repositori.py                  -> factors 1, 10 i 100
+# python benchmark_repositori.py --factors 1 10
+#
+# Replica les dades reals normalitzades `factor` vegades (expedients nous) i
+# mesura, per a cada backend en un procés propi:
+#   - preparar: pandas construeix la taula columnar; SQLite construeix el
+#     fitxer amb els índexs (es mesura a part, en un altre procés) i l'obre,
+#   - latència de les consultes declaratives sense cache (mediana de 3),
+#   - latència de la cerca de files d'un carrer (files_carrer),
+#   - pic de memòria (RSS) del procés que respon.
+# Només es repliquen les columnes que fan servir les consultes perquè el
+# dataframe sencer a 100x no cap a la memòria d'una màquina normal; els
+# textos de les còpies comparteixen objectes, com passaria amb pandas real.
+
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from data_service import DIMENSIONS_CONSULTA, Dataset, obtenir_dataset
+
+INFORME_PATH = Path("model/informe_repositori.json")
+COLUMNES_BENCH = ["Numero_expedient", *DIMENSIONS_CONSULTA.values(), "Latitud", "Longitud"]
+CONSULTES = {
+    "any_per_districte": {"filtres": {"any": [2019]}, "agrupar": ["districte"]},
+    "carrer_per_causa": {"filtres": {"carrer": ["Balmes"]}, "agrupar": ["causa"]},
+    "causa_x_hora": {"agrupar": ["causa", "hora"], "comptar": "expedients"},
+    "top_carrers_eixample": {"filtres": {"districte": ["Eixample"], "hora": [8, 9]}, "agrupar": ["carrer"], "top": 10},
+}
+CARRER_BENCH = "balmes"
+REPETICIONES = 3
+
+
+def replicar(factor):
+    """Dades reals (columnes de consulta) repetides `factor` vegades amb expedients únics."""
+    df = obtenir_dataset().df.reindex(columns=COLUMNES_BENCH)
+    df["Numero_expedient"] = pd.factorize(df["Numero_expedient"])[0].astype(np.int64)
+    n = df["Numero_expedient"].max() + 1
+    return pd.concat([df.assign(Numero_expedient=df["Numero_expedient"] + i * n) for i in range(factor)],
+                     ignore_index=True)
+
+
+def _mediana_ms(funcio):
+    temps = []
+    for _ in range(REPETICIONES):
+        inici = time.perf_counter()
+        funcio()
+        temps.append((time.perf_counter() - inici) * 1000)
+    return round(float(np.median(temps)), 2)
+
+
+def mode_construir(factor, path):
+    from repositori_service import construir_bd
+
+    df = replicar(factor)
+    inici = time.perf_counter()
+    construir_bd(df, path, versio=f"bench-{factor}")
+    return {"files": len(df), "construir_s": round(time.perf_counter() - inici, 2),
+            "mida_mb": round(Path(path).stat().st_size / 1e6, 1)}
+
+
+def mode_consultar(backend, factor, path):
+    from repositori_service import RepositoriPandas, RepositoriSQLite
+
+    inici = time.perf_counter()
+    if backend == "pandas":
+        df = replicar(factor)
+        inici = time.perf_counter()      # llegir els CSV no compta: es compara el camí de consulta
+        repositori = RepositoriPandas(Dataset(versio=f"bench-{factor}", particions=(), df=df, gazetteer={}))
+        repositori.executar({})          # construeix la taula columnar
+    else:
+        repositori = RepositoriSQLite(path)
+    resultat = {"preparar_s": round(time.perf_counter() - inici, 2)}
+    for nom, consulta in CONSULTES.items():
+        resultat[f"{nom}_ms"] = _mediana_ms(lambda: repositori.executar(consulta))
+    resultat["files_carrer_ms"] = _mediana_ms(lambda: repositori.files_carrer(CARRER_BENCH))
+    resultat["total"] = repositori.executar({})[0]
+    return resultat
+
+
+def _fill(*args):
+    sortida = subprocess.run([sys.executable, __file__, *args], capture_output=True, text=True, check=True)
+    return json.loads(sortida.stdout.strip().splitlines()[-1])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compara el repositori pandas amb el SQLite.")
+    parser.add_argument("--factors", type=int, nargs="+", default=[1, 10, 100], help="mides relatives a provar")
+    parser.add_argument("--mode", help=argparse.SUPPRESS)
+    parser.add_argument("--backend", help=argparse.SUPPRESS)
+    parser.add_argument("--bd", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        # Procés fill: resultat en JSON per stdout
+        factor = args.factors[0]
+        resultat = mode_construir(factor, args.bd) if args.mode == "construir" \
+            else mode_consultar(args.backend, factor, args.bd)
+        # ru_maxrss és en KB a Linux
+        resultat["pic_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024
+        print(json.dumps(resultat))
+        sys.exit()
+
+    resultats = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for factor in args.factors:
+            bd = str(Path(tmp) / f"accidents_{factor}.sqlite")
+            construccio = _fill("--mode", "construir", "--factors", str(factor), "--bd", bd)
+            for backend in ("pandas", "sqlite"):
+                resultat = {"backend": backend, "factor": factor,
+                            **_fill("--mode", "consultar", "--backend", backend, "--factors", str(factor), "--bd", bd)}
+                if backend == "sqlite":
+                    resultat.update({"construir_s": construccio["construir_s"], "mida_mb": construccio["mida_mb"],
+                                     "pic_rss_construir_mb": construccio["pic_rss_mb"]})
+                resultats.append(resultat)
+                print(resultat)
+            Path(bd).unlink()
+
+    INFORME_PATH.parent.mkdir(exist_ok=True)
+    INFORME_PATH.write_text(json.dumps({"resultats": resultats}, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(pd.DataFrame(resultats).set_index(["factor", "backend"]).T.to_string())
+    print(f"✔ Informe guardat a {INFORME_PATH}")
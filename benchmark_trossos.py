@@ -0,0 +1,152 @@
+# ======================================
+# BENCHMARK: ENTRENAMENT EN MEMÒRIA
+# VS ENTRENAMENT PER TROSSOS
+# ======================================
+#
+# python benchmark_trossos.py                          -> els tres escenaris
+# python benchmark_trossos.py --escenaris real agrupat  -> només aquests
+#
+# Escenaris (cada mode s'executa en un procés propi per mesurar-ne el pic de
+# memòria (RSS), el temps i la precisió amb la mateixa partició per hash):
+#   real     les dades reals, sense cap fila repetida;
+#   sintetic cada CSV repetit `factor` vegades amb expedients nous i
+#            coordenades desplaçades. La precisió en memòria surt inflada:
+#            les còpies d'un accident queden a entrenament i a prova i el
+#            bosc sencer les memoritza;
+#   agrupat  el mateix volum, però els expedients de les còpies es trien
+#            perquè caiguin al mateix costat de la partició que l'original:
+#            cap accident de prova té còpies a entrenament.
+
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from data_service import DATA_FOLDER, detectar_codificacio
+
+ESCENARIS = ("real", "sintetic", "agrupat")
+
+INFORME_PATH = Path("model/informe_trossos.json")
+
+
+def _es_prova(expedients):
+    from ml_service import COLUMNA_EXPEDIENTE, particion_hash
+
+    return particion_hash(pd.DataFrame({COLUMNA_EXPEDIENTE: expedients}))[0]
+
+
+def _expedients_agrupats(base, copia):
+    """Expedients nous per a la còpia `copia` al mateix costat de la partició que `base`."""
+    objectiu = _es_prova(base)
+    nous = base + f"-{copia}"
+    pendents = _es_prova(nous) != objectiu
+    intent = 0
+    while pendents.any():
+        candidats = base[pendents] + f"-{copia}.{intent}"
+        encerts = _es_prova(candidats) == objectiu[pendents]
+        nous.loc[candidats.index[encerts]] = candidats[encerts]
+        pendents[np.flatnonzero(pendents)[encerts]] = False
+        intent += 1
+    return nous
+
+
+def generar_sintetic(desti, factor, agrupat=False):
+    """Escriu `factor` còpies de cada CSV amb expedients únics i soroll a les coordenades."""
+    rng = np.random.default_rng(42)
+    for ruta in sorted(DATA_FOLDER.glob("*.csv")):
+        df = pd.read_csv(ruta, encoding=detectar_codificacio(ruta), dtype=str)
+        expedient = next(c for c in df.columns if "expedient" in c.lower())
+        coordenades = [c for c in df.columns if c.strip().lower() in ("latitud", "longitud")]
+        for i in range(factor):
+            copia = df.copy()
+            base = copia[expedient].str.strip().fillna("")
+            copia[expedient] = _expedients_agrupats(base, i) if agrupat else base + f"-{i}"
+            for col in coordenades:
+                valors = pd.to_numeric(copia[col], errors="coerce")
+                copia[col] = valors + rng.normal(0, 1e-4, len(copia))
+            copia.to_csv(desti / f"{ruta.stem}_{i}.csv", index=False, encoding="utf-8")
+
+
+def mode_memoria(carpeta):
+    from sklearn.ensemble import RandomForestClassifier
+
+    from data_service import construir_dataset
+    from ml_service import TARGET, particion_hash, preparar_dataset
+
+    df = construir_dataset(carpeta).df
+    df = df[df[TARGET].notna()].reset_index(drop=True)
+    es_prueba = particion_hash(df)[0]
+    X, y, pipeline = preparar_dataset(df[~es_prueba])
+    model = RandomForestClassifier(n_estimators=100, max_depth=16, min_samples_leaf=20, random_state=42)
+    model.fit(X, y)
+    prueba = df[es_prueba]
+    precisio = float((model.predict(pipeline.transformar(prueba)) == pipeline.codificar_objetivo(prueba[TARGET])).mean())
+    return {"filas": len(df), "precision": round(precisio, 4)}
+
+
+def mode_trossos(carpeta, tros):
+    from ml_service import entrenar_por_trozos
+
+    return entrenar_por_trozos(carpeta, tros)[2]
+
+
+def executar(mode, carpeta, tros):
+    """Executa un mode en aquest procés i retorna el resultat amb temps i pic de RSS."""
+    import time
+
+    inici = time.perf_counter()
+    resultat = mode_memoria(carpeta) if mode == "memoria" else mode_trossos(carpeta, tros)
+    resultat.pop("segundos", None)
+    resultat.update({
+        "mode": mode if mode == "memoria" else f"trossos ({tros} files)",
+        "segons": round(time.perf_counter() - inici, 1),
+        # ru_maxrss és en KB a Linux
+        "pic_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024,
+    })
+    return resultat
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compara l'entrenament en memòria amb el per trossos.")
+    parser.add_argument("--factor", type=int, default=10, help="vegades que es repeteixen les dades reals")
+    parser.add_argument("--escenaris", nargs="+", choices=ESCENARIS, default=list(ESCENARIS))
+    parser.add_argument("--trossos", type=int, nargs="+", default=[20000, 50000], help="mides de tros a provar")
+    parser.add_argument("--mode", help=argparse.SUPPRESS)
+    parser.add_argument("--carpeta", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        # Procés fill: un sol mode, resultat en JSON per stdout
+        print(json.dumps(executar(args.mode, Path(args.carpeta), args.trossos[0])))
+        sys.exit()
+
+    informe = {"factor": args.factor, "escenaris": {}}
+    for escenari in args.escenaris:
+        with tempfile.TemporaryDirectory() as tmp:
+            carpeta = Path(tmp)
+            if escenari == "real":
+                carpeta = DATA_FOLDER
+            else:
+                print(f"🧪 Generant dataset sintètic {args.factor}x ({escenari}) a {carpeta}...")
+                generar_sintetic(carpeta, args.factor, agrupat=escenari == "agrupat")
+
+            resultats = []
+            for mode, tros in [("memoria", 0)] + [("trossos", t) for t in args.trossos]:
+                sortida = subprocess.run(
+                    [sys.executable, __file__, "--mode", mode, "--carpeta", str(carpeta), "--trossos", str(tros)],
+                    capture_output=True, text=True, check=True,
+                )
+                resultats.append(json.loads(sortida.stdout.strip().splitlines()[-1]))
+                print(escenari, resultats[-1])
+        informe["escenaris"][escenari] = resultats
+        print(pd.DataFrame(resultats).set_index("mode").to_string())
+
+    INFORME_PATH.parent.mkdir(exist_ok=True)
+    INFORME_PATH.write_text(json.dumps(informe, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"✔ Informe guardat a {INFORME_PATH}")
@@ -0,0 +1,129 @@
+# cache_service.py
+# =======================================================
+# Cache LRU/TTL acotada per memòria amb "single-flight"
+# =======================================================
+#
+# Per a càlculs cars i repetits (p. ex. /predict_calle dels carrers més
+# consultats). La clau ha d'incloure tot allò de què depèn el resultat
+# (versió del model, de les dades...), així que una versió nova simplement
+# deixa de trobar les entrades velles, que acaben expulsades per LRU.
+#
+# - Límits: nombre d'entrades, bytes (mida estimada de cada valor en JSON)
+#   i temps de vida (TTL).
+# - Single-flight: si N fils demanen la mateixa clau absent alhora, només
+#   el primer calcula; la resta l'espera i rep el mateix resultat (o la
+#   mateixa excepció).
+# - Mètriques: encerts, fallades, peticions agrupades, expulsions i
+#   caducades.
+
+import threading
+import time
+from collections import OrderedDict
+
+from resposta_service import serialitzar
+
+
+def mida_json(valor):
+    """Mida aproximada en memòria d'un resultat: els bytes del seu JSON."""
+    return len(serialitzar(valor))
+
+
+class _Vol:
+    """Càlcul en curs d'una clau (els fils que arriben després l'esperen)."""
+    __slots__ = ("fet", "valor", "error")
+
+    def __init__(self):
+        self.fet = threading.Event()
+        self.valor = None
+        self.error = None
+
+
+class CacheLRU:
+    def __init__(self, max_entrades=4096, max_bytes=16 * 1024 * 1024, ttl_s=600, mida=mida_json):
+        self.max_entrades = max_entrades
+        self.max_bytes = max_bytes
+        self.ttl_s = ttl_s
+        self.mida = mida
+        self._entrades = OrderedDict()      # clau -> (valor, bytes, caduca)
+        self._en_curs = {}                  # clau -> _Vol
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.encerts = self.fallades = self.agrupades = self.expulsions = self.caducades = 0
+
+    def obtenir(self, clau, calcular):
+        """Valor de `clau`; si no hi és (o ha caducat) el calcula un sol fil amb `calcular()`."""
+        with self._lock:
+            entrada = self._entrades.get(clau)
+            if entrada is not None:
+                if entrada[2] > time.monotonic():
+                    self._entrades.move_to_end(clau)
+                    self.encerts += 1
+                    return entrada[0]
+                self._treure(clau)
+                self.caducades += 1
+            vol = self._en_curs.get(clau)
+            lider = vol is None
+            if lider:
+                vol = self._en_curs[clau] = _Vol()
+                self.fallades += 1
+            else:
+                self.agrupades += 1
+
+        if not lider:
+            vol.fet.wait()
+            if vol.error is not None:
+                raise vol.error
+            return vol.valor
+
+        try:
+            vol.valor = calcular()
+            self._guardar(clau, vol.valor)
+            return vol.valor
+        except BaseException as e:
+            vol.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._en_curs[clau]
+            vol.fet.set()
+
+    def _guardar(self, clau, valor):
+        mida = self.mida(valor)
+        if mida > self.max_bytes // 4:      # un sol valor no pot buidar la cache
+            return
+        with self._lock:
+            if clau in self._entrades:
+                self._treure(clau)
+            self._entrades[clau] = (valor, mida, time.monotonic() + self.ttl_s)
+            self._bytes += mida
+            while len(self._entrades) > self.max_entrades or self._bytes > self.max_bytes:
+                self._treure(next(iter(self._entrades)))
+                self.expulsions += 1
+
+    def _treure(self, clau):
+        _, mida, _ = self._entrades.pop(clau)
+        self._bytes -= mida
+
+    def buidar(self):
+        with self._lock:
+            self._entrades.clear()
+            self._bytes = 0
+
+    def metriques(self):
+        with self._lock:
+            consultes = self.encerts + self.fallades + self.agrupades
+            return {
+                "entrades": len(self._entrades),
+                "bytes": self._bytes,
+                "max_entrades": self.max_entrades,
+                "max_bytes": self.max_bytes,
+                "ttl_s": self.ttl_s,
+                "encerts": self.encerts,
+                "fallades": self.fallades,
+                "agrupades": self.agrupades,          # peticions que han esperat un càlcul en curs
+                "expulsions": self.expulsions,
+                "caducades": self.caducades,
+                "en_curs": len(self._en_curs),
+                # les agrupades no han calculat res: compten com a encert
+                "taxa_encert": round((self.encerts + self.agrupades) / consultes, 4) if consultes else None,
+            }
@@ -0,0 +1,152 @@
+# ======================================
+# COMPARAR EL PIPELINE DE FEATURES ACTUAL
+# AMB L'ANTERIOR (TOTES LES COLUMNES)
+# ======================================
+#
+# python comparar_features.py
+#
+# Entrena el mateix RandomForest amb les dues codificacions sobre la mateixa
+# partició (per expedient) i desa l'informe a model/informe_features.json:
+# mida del model, temps d'entrenament, latència d'inferència i precisió.
+# La tercera fila és el bosc que es serveix (entrenar_modelo): el pipeline
+# declarat amb min_samples_leaf=5, que no fa créixer l'artefacte.
+
+import json
+import pickle
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.metrics import accuracy_score, f1_score
+
+from data_service import DATA_FOLDER, obtenir_dataset
+from ml_service import COLUMNA_CALLE, TARGET, dividir_por_expediente, preparar_dataset
+
+INFORME_PATH = Path("model/informe_features.json")
+REPETICIONS = 20
+
+
+def preparar_dataset_anterior(df):
+    """Codificació anterior: totes les columnes de text passen a codi de categoria."""
+    df = df.fillna("NA")
+    codificadores = {}
+    df_encoded = df.copy()
+
+    for col in df.columns:
+        if df[col].dtype == "object":
+            df_encoded[col] = df[col].astype("category")
+            codificadores[col] = df_encoded[col].cat.categories
+            df_encoded[col] = df_encoded[col].cat.codes
+
+    return df_encoded.drop(columns=[TARGET]), df_encoded[TARGET], codificadores
+
+
+def codificar_anterior(df, codificadores, columnes):
+    df = df.fillna("NA").copy()
+    for col in df.columns:
+        if col in codificadores:
+            df[col] = codificadores[col].get_indexer(df[col])
+    return df[columnes]
+
+
+def mesurar(nom, entrenar, predir, objectiu, df_prova, mostra_carrer):
+    """Entrena una configuració i en mesura mida, temps i precisió."""
+    inici = time.perf_counter()
+    model, codificacio = entrenar()
+    temps_entrenament = time.perf_counter() - inici
+
+    y_prova = objectiu(df_prova[TARGET], codificacio)
+    X_prova = df_prova.drop(columns=[TARGET])
+    mostra_carrer = mostra_carrer.drop(columns=[TARGET])
+
+    inici = time.perf_counter()
+    prediccio = model.predict(predir(X_prova, codificacio))
+    temps_lot = time.perf_counter() - inici
+
+    # Petició típica de /predict_calle: codificar + predict_proba d'un carrer
+    temps = []
+    for _ in range(REPETICIONS):
+        inici = time.perf_counter()
+        model.predict_proba(predir(mostra_carrer, codificacio))
+        temps.append(time.perf_counter() - inici)
+
+    return {
+        "configuracio": nom,
+        "features": int(model.n_features_in_),
+        "mida_model_mb": round(len(pickle.dumps(model)) / 1e6, 2),
+        "mida_codificacio_mb": round(len(pickle.dumps(codificacio)) / 1e6, 3),
+        "nodes": int(sum(a.tree_.node_count for a in model.estimators_)),
+        "entrenament_s": round(temps_entrenament, 1),
+        "inferencia_lot_ms_per_1000": round(temps_lot * 1000 / len(y_prova) * 1000, 2),
+        "inferencia_carrer_ms": round(float(np.median(temps)) * 1000, 1),
+        "files_carrer": len(mostra_carrer),
+        "precisio": round(accuracy_score(y_prova, prediccio), 4),
+        "f1_macro": round(f1_score(y_prova, prediccio, average="macro"), 4),
+    }
+
+
+HOJA_SERVIT = 5      # min_samples_leaf del bosc d'entrenar_modelo
+
+
+def nou_model(min_samples_leaf=1):
+    return RandomForestClassifier(n_estimators=300, max_depth=16, min_samples_leaf=min_samples_leaf,
+                                  random_state=42)
+
+
+if __name__ == "__main__":
+    dataset = obtenir_dataset()
+    valid = dataset.df[TARGET].notna().to_numpy()
+    df = dataset.df[valid].reset_index(drop=True)
+    # Les mateixes files tal com les llegia l'entrenament anterior (CSV sense normalitzar)
+    df_cru = pd.concat([pd.read_csv(DATA_FOLDER / p.nom) for p in dataset.particions], ignore_index=True)
+    df_cru = df_cru[valid].reset_index(drop=True)
+
+    entreno, prova = dividir_por_expediente(df)
+    carrer = df[COLUMNA_CALLE].iloc[prova].value_counts().index[0]
+    files_carrer = df.index[prova][df[COLUMNA_CALLE].iloc[prova] == carrer]
+
+    # Anterior: les codificacions s'aprenen amb totes les files, com abans
+    X_ant, y_ant, codificadors = preparar_dataset_anterior(df_cru)
+    columnes_ant = list(X_ant.columns)
+
+    def entrenar_anterior():
+        return nou_model().fit(X_ant.iloc[entreno], y_ant.iloc[entreno]), codificadors
+
+    anterior = mesurar(
+        "anterior (totes les columnes, label encoding)",
+        entrenar_anterior,
+        lambda d, c: codificar_anterior(d, c, columnes_ant),
+        lambda y, c: c[TARGET].get_indexer(y.fillna("NA")),
+        df_cru.iloc[prova], df_cru.iloc[files_carrer],
+    )
+
+    def mesurar_nou(nom, min_samples_leaf):
+        def entrenar_nou():
+            X, y, pipeline = preparar_dataset(df.iloc[entreno])
+            return nou_model(min_samples_leaf).fit(X, y), pipeline
+
+        return mesurar(
+            nom,
+            entrenar_nou,
+            lambda d, pipeline: pipeline.transformar(d),
+            lambda y, pipeline: pipeline.codificar_objetivo(y),
+            df.iloc[prova], df.iloc[files_carrer],
+        )
+
+    nou = mesurar_nou("pipeline declarat (sense identificadors, freqüència + target encoding)", 1)
+    servit = mesurar_nou(f"pipeline declarat + min_samples_leaf={HOJA_SERVIT} (model servit)", HOJA_SERVIT)
+
+    informe = {
+        "files_entrenament": int(len(entreno)),
+        "files_prova": int(len(prova)),
+        "particio": "GroupShuffleSplit per Numero_expedient (25 % prova)",
+        "carrer_latencia": carrer,
+        "resultats": [anterior, nou, servit],
+    }
+    INFORME_PATH.parent.mkdir(exist_ok=True)
+    INFORME_PATH.write_text(json.dumps(informe, ensure_ascii=False, indent=2), encoding="utf-8")
+
+    print(pd.DataFrame(informe["resultats"]).set_index("configuracio").T.to_string())
+    print(f"✔ Informe guardat a {INFORME_PATH}")
@@ -0,0 +1,17 @@
+# ======================================
+# COMPRIMIR EL MODEL DE SERVEI
+# ======================================
+#
+# python comprimir_modelo.py   (després d'entrenar_modelo.py)
+#
+# Avalua versions més petites del bosque (menys arbres, fulles limitades,
+# menys profunditat, HistGradientBoosting) i escriu model/informe_compresion.json
+# amb la corba mida / latència / precisió. L'API carrega el candidat marcat
+# com a "seleccionado".
+
+from ml_service import INFORME_COMPRESION_PATH, comprimir_modelo
+
+if __name__ == "__main__":
+    print("🗜️  Comprimint el model... (pot tardar uns minuts)")
+    informe = comprimir_modelo()
+    print(f"✔ Seleccionat: {informe['seleccionado']} (informe a {INFORME_COMPRESION_PATH})")
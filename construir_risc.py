@@ -0,0 +1,30 @@
+# ======================================
+# PRECALCULAR EL RISC PER TRAMS DE CARRER
+# I LA SUPERFÍCIE DE RISC DE LA CIUTAT
+# ======================================
+#
+# python construir_risc.py              -> taula de trams + ràster global
+# python construir_risc.py --per-hora   -> ràster amb franges dia x hora
+# python construir_risc.py --versio V   -> amb el paquet V (per defecte, l'actiu)
+
+import argparse
+
+from ml_service import cargar_csvs, cargar_paquete
+from risk_service import construir_raster_risc, construir_taula_risc
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Precalcula les taules de risc per a l'API.")
+    parser.add_argument("--per-hora", action="store_true", help="afegeix les 7 x 24 franges (dia, hora) al ràster")
+    parser.add_argument("--versio", default=None, help="paquet de model (per defecte, l'actiu: el que serveix l'API)")
+    args = parser.parse_args()
+
+    print("🗺️  Calculant el risc per cel·les de la ciutat... (cal el model entrenat)")
+    df = cargar_csvs()
+    paquet = cargar_paquete(args.versio)
+    model, pipeline = paquet.model, paquet.pipeline
+    print(f"Model: paquet {paquet.version} ({paquet.nombre})")
+    path = construir_taula_risc(df, model, pipeline)
+    print(f"✔ Taula de risc guardada a {path}")
+
+    path = construir_raster_risc(df, model, pipeline, per_hora=args.per_hora)
+    print(f"✔ Ràster de risc guardat a {path}.json")
@@ -0,0 +1,995 @@
+# data_service.py
+# =======================================================
+# Capa de dades compartida (Streamlit + FastAPI)
+# =======================================================
+#
+# Tots els consumidors (dashboard, pàgines i API) obtenen el mateix objecte
+# `Dataset` a través de `obtenir_dataset()`. El dataset es construeix una sola
+# vegada per procés i per versió de la carpeta de dades (empremta de noms,
+# mides i dates de modificació dels CSV), de manera que canviar de pàgina no
+# torna a llegir ni a copiar res.
+#
+# Cada CSV és una `Particio` amb els seus propis agregats. Pujar un CSV nou
+# (`afegir_particio`) només llegeix i agrega aquell fitxer: la resta de
+# particions, els seus agregats i el gazetteer de carrers es reutilitzen, i
+# les estructures derivades que es poden ampliar (comptes, taula geogràfica,
+# hotspots) passen al dataset nou en lloc de recalcular-se.
+
+import codecs
+import hashlib
+import io
+import json
+import itertools
+import os
+import threading
+import unicodedata
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from difflib import get_close_matches
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+DATA_FOLDER = Path(__file__).parent / "data"
+
+COL_ANY = "Nk_Any"
+COL_DISTRICTE = "Nom_districte"
+COL_CARRER = "Nom_carrer"
+COL_CAUSA = "Descripcio_causa_mediata"
+COL_DIA = "Descripcio_dia_setmana"
+COL_HORA = "Hora_dia"
+COL_DIA_CODI = "Dia_setmana_codi"   # 0 = Dilluns ... 6 = Diumenge, -1 = desconegut
+
+DIES_SETMANA = ['Dilluns', 'Dimarts', 'Dimecres', 'Dijous', 'Divendres', 'Dissabte', 'Diumenge']
+
+# Noms de columna que han canviat entre anys -> nom canònic
+RENOMBRES_COLUMNES = {
+    "Número_expedient": "Numero_expedient",
+    "Latitud_WGS84": "Latitud",
+    "Longitud_WGS84": "Longitud",
+}
+
+# Un CSV pujat ha de tenir, com a mínim, aquestes columnes
+COLUMNES_OBLIGATORIES = (COL_ANY, COL_DISTRICTE, COL_CARRER, COL_CAUSA)
+
+# Columnes amb comptes precalculats per (any, valor) a cada partició
+COLUMNES_AGREGADES = (COL_DISTRICTE, COL_CARRER, COL_CAUSA)
+
+# Canviar-la quan `normalitzar` produeixi dades diferents per als mateixos CSV:
+# entra a l'empremta i invalida els derivats (almacén de features, caches)
+VERSIO_NORMALITZACIO = 2
+
+# Coordenades UTM (ED50, fus 31N) que porten tots els anys
+COL_UTM_X = "Coordenada_UTM_X_ED50"
+COL_UTM_Y = "Coordenada_UTM_Y_ED50"
+
+
+# =======================================================
+# Normalització de text (noms de carrer)
+# =======================================================
+
+def normalize_text_advanced(text):
+    """
+    Normalitza i neteja el text d'entrada:
+    1. Minúscules i eliminació d'espais.
+    2. Eliminació d'accents (diacrítics).
+    3. Eliminació de signes de puntuació.
+    4. Eliminació de tipus de via i preposicions comunes.
+    """
+    if not isinstance(text, str):
+        return ""
+
+    text = text.lower().strip()
+
+    # 1. Normalització d'Unicode (treu accents i diacrítics: 'aragó' -> 'arago')
+    text = ''.join(c for c in unicodedata.normalize('NFD', text) if unicodedata.category(c) != 'Mn')
+
+    # 2. Neteja de caràcters i signes
+    text = text.replace('.', ' ').replace('-', ' ').replace("'", ' ')
+
+    # Llista de tokens de tipus de via i preposicions a ignorar
+    tokens_a_ignorar = [
+        "carrer", "c", "avinguda", "av", "passeig", "pg", "ronda", "placa", "pl",
+        "via", "rambla", "travessera", "ctra",
+        "de les", "del", "de la", "de l", "dels", "de", "la", "el", "els", "les", "i"
+    ]
+
+    # 3. Eliminació de tokens
+    return ' '.join(t for t in text.split() if t not in tokens_a_ignorar).strip()
+
+# Exemple: 'Prediu la causa per Av. Aragó' -> 'prediu causa arago'
+# Exemple: 'AVINGUDA DE SARRIÀ' -> 'sarria'
+
+
+# =======================================================
+# Coordenades: ED50 UTM 31N -> WGS84
+# =======================================================
+#
+# Tots els CSV porten les coordenades UTM ED50, però les WGS84 falten en
+# algunes files i en algun any estan desplaçades (~220 m: són les geogràfiques
+# ED50 sense canvi de datum). La transformació és vectoritzada amb NumPy:
+# UTM inversa sobre l'el·lipsoide Internacional 1924, pas a geocèntriques,
+# translació de 3 paràmetres (península) i tornada a geogràfiques WGS84.
+# Error respecte de les WGS84 publicades: ~1 m.
+
+ZONA_UTM = 31
+EL_ED50 = (6378388.0, 1 / 297)                 # semieix major (m), aplatament
+EL_WGS84 = (6378137.0, 1 / 298.257223563)
+DESPLACAMENT_ED50_WGS84 = (-131.0, -100.3, -163.4)   # dx, dy, dz (m)
+LIMITS_BCN = (41.30, 41.50, 2.04, 2.25)        # lat_min, lat_max, lon_min, lon_max
+TOLERANCIA_COORD_M = 50
+
+
+def _utm_a_geografiques(x, y, el, zona):
+    """UTM inversa (sèrie de Snyder) -> latitud, longitud en radians."""
+    a, f = el
+    e2 = f * (2 - f)
+    ep2 = e2 / (1 - e2)
+    k0 = 0.9996
+    x = x - 500000.0
+    mu = y / k0 / (a * (1 - e2 / 4 - 3 * e2 ** 2 / 64 - 5 * e2 ** 3 / 256))
+    e1 = (1 - np.sqrt(1 - e2)) / (1 + np.sqrt(1 - e2))
+    phi = (mu + (3 * e1 / 2 - 27 * e1 ** 3 / 32) * np.sin(2 * mu)
+           + (21 * e1 ** 2 / 16 - 55 * e1 ** 4 / 32) * np.sin(4 * mu)
+           + (151 * e1 ** 3 / 96) * np.sin(6 * mu) + (1097 * e1 ** 4 / 512) * np.sin(8 * mu))
+
+    # Potències com a productes: `**` amb arrays passa per pow i és molt més lent
+    sin, cos = np.sin(phi), np.cos(phi)
+    tan = sin / cos
+    w = 1 - e2 * sin * sin
+    n = a / np.sqrt(w)
+    r = a * (1 - e2) / (w * np.sqrt(w))
+    t, c = tan * tan, ep2 * cos * cos
+    d = x / (n * k0)
+    d2 = d * d
+    lat = phi - (n * tan / r) * d2 * (0.5 - (5 + 3 * t + 10 * c - 4 * c * c - 9 * ep2) * d2 / 24
+                                      + (61 + 90 * t + 298 * c + 45 * t * t - 252 * ep2 - 3 * c * c) * d2 * d2 / 720)
+    lon = d * (1 - (1 + 2 * t + c) * d2 / 6
+               + (5 - 2 * c + 28 * t - 3 * c * c + 8 * ep2 + 24 * t * t) * d2 * d2 / 120) / cos
+    return lat, lon + np.radians(6 * zona - 183)
+
+
+def utm_ed50_a_wgs84(x, y, zona=ZONA_UTM):
+    """Arrays UTM ED50 (m) -> (latitud, longitud) WGS84 en graus. NaN on no n'hi ha."""
+    lat, lon = _utm_a_geografiques(np.asarray(x, dtype=float), np.asarray(y, dtype=float), EL_ED50, zona)
+
+    # Geogràfiques ED50 -> geocèntriques, translació de datum
+    a, f = EL_ED50
+    e2 = f * (2 - f)
+    sin_lat, cos_lat = np.sin(lat), np.cos(lat)
+    n = a / np.sqrt(1 - e2 * sin_lat * sin_lat)
+    dx, dy, dz = DESPLACAMENT_ED50_WGS84
+    X = n * cos_lat * np.cos(lon) + dx
+    Y = n * cos_lat * np.sin(lon) + dy
+    Z = n * (1 - e2) * sin_lat + dz
+
+    # Geocèntriques -> geogràfiques WGS84 (Bowring, sense iterar)
+    a, f = EL_WGS84
+    e2 = f * (2 - f)
+    b = a * (1 - f)
+    p = np.hypot(X, Y)
+    theta = np.arctan2(Z * a, p * b)
+    sin_t, cos_t = np.sin(theta), np.cos(theta)
+    lat = np.arctan2(Z + e2 / (1 - e2) * b * sin_t * sin_t * sin_t, p - e2 * a * cos_t * cos_t * cos_t)
+    return np.degrees(lat), np.degrees(np.arctan2(Y, X))
+
+
+def _dins_bcn(lat, lon):
+    lat_min, lat_max, lon_min, lon_max = LIMITS_BCN
+    return (lat >= lat_min) & (lat <= lat_max) & (lon >= lon_min) & (lon <= lon_max)
+
+
+def reprojectar_coordenades(df):
+    """
+    Omple o valida Latitud/Longitud a partir de les columnes UTM ED50 (que
+    passen a float; els valors <= 0 es tracten com a buits). Modifica `df` i
+    retorna els comptes:
+    - recuperades: sense WGS84 vàlides (buides, a zero o fora de la ciutat)
+      i omplertes des de les UTM,
+    - corregides: el CSV té les WGS84 desplaçades en bloc (mediana de la
+      diferència > TOLERANCIA_COORD_M) i es substitueixen per les calculades,
+    - discrepants: files aïllades que no coincideixen (es deixen com estan),
+    - sense_coordenades: files que continuen sense una posició vàlida.
+    """
+    for col in ("Latitud", "Longitud"):
+        df[col] = pd.to_numeric(df[col], errors="coerce") if col in df.columns else np.nan
+    lat = df["Latitud"].to_numpy(dtype=float)
+    lon = df["Longitud"].to_numpy(dtype=float)
+    valides = _dins_bcn(lat, lon)
+    comptes = {"files": len(df), "recuperades": 0, "corregides": 0, "discrepants": 0}
+
+    if COL_UTM_X in df.columns and COL_UTM_Y in df.columns:
+        for col in (COL_UTM_X, COL_UTM_Y):
+            valors = pd.to_numeric(df[col], errors="coerce")
+            df[col] = valors.where(valors > 0)
+        lat_utm, lon_utm = utm_ed50_a_wgs84(df[COL_UTM_X].to_numpy(), df[COL_UTM_Y].to_numpy())
+        valides_utm = _dins_bcn(lat_utm, lon_utm)
+
+        # Distància aproximada (m) entre les dues posicions on totes dues són vàlides
+        dues = valides & valides_utm
+        dist = np.hypot(lat - lat_utm, (lon - lon_utm) * np.cos(np.radians(lat_utm))) * 111_320
+        if dues.any() and np.median(dist[dues]) > TOLERANCIA_COORD_M:
+            substituir = valides_utm
+            comptes["corregides"] = int(dues.sum())
+        else:
+            substituir = valides_utm & ~valides
+            comptes["discrepants"] = int((dist[dues] > TOLERANCIA_COORD_M).sum())
+        comptes["recuperades"] = int((valides_utm & ~valides).sum())
+
+        lat = np.where(substituir, lat_utm, lat)
+        lon = np.where(substituir, lon_utm, lon)
+        df["Latitud"], df["Longitud"] = lat, lon
+        valides = valides | valides_utm
+
+    comptes["sense_coordenades"] = int((~valides).sum())
+    return comptes
+
+
+# =======================================================
+# Lectura i normalització d'un CSV
+# =======================================================
+
+def llegir_csv(contingut):
+    """Llegeix un CSV (bytes) provant primer UTF-8 i després Latin-1."""
+    try:
+        return pd.read_csv(io.BytesIO(contingut), sep=",", encoding="utf-8-sig")
+    except UnicodeDecodeError:
+        return pd.read_csv(io.BytesIO(contingut), sep=",", encoding="latin-1")
+
+
+def detectar_codificacio(path, bloc=1 << 20):
+    """UTF-8 (amb o sense BOM) o Latin-1, llegint el fitxer per blocs."""
+    decodificador = codecs.getincrementaldecoder("utf-8")()
+    with open(path, "rb") as f:
+        try:
+            while dades := f.read(bloc):
+                decodificador.decode(dades)
+            decodificador.decode(b"", final=True)
+        except UnicodeDecodeError:
+            return "latin-1"
+    return "utf-8-sig"
+
+
+def llegir_csv_per_trossos(path, mida_tros):
+    """Itera un CSV en DataFrames normalitzats de com a molt `mida_tros` files."""
+    for tros in pd.read_csv(path, sep=",", encoding=detectar_codificacio(path), chunksize=mida_tros):
+        yield normalitzar(tros)
+
+
+def normalitzar(df, informe=None):
+    """
+    Deixa un CSV amb l'esquema comú:
+    - noms de columna sense espais ni BOM i unificats (WGS84, expedient),
+    - textos sense espais de farciment,
+    - any i hora com a enters i coordenades com a float,
+    - Latitud/Longitud omplertes o corregides des de les UTM ED50,
+    - dia de la setmana codificat com a enter petit (`Dia_setmana_codi`).
+
+    Si es passa `informe` (dict), s'hi afegeixen els comptes de coordenades.
+    """
+    df = df.rename(columns=lambda c: c.strip().lstrip("\ufeff"))
+    df = df.rename(columns={k: v for k, v in RENOMBRES_COLUMNES.items() if v not in df.columns})
+
+    for col in df.columns:
+        if df[col].dtype == "object":
+            df[col] = df[col].str.strip()
+
+    if COL_ANY in df.columns:
+        df[COL_ANY] = pd.to_numeric(df[COL_ANY], errors="coerce").astype("Int64")
+    if COL_HORA in df.columns:
+        hora = pd.to_numeric(df[COL_HORA], errors="coerce")
+        df[COL_HORA] = hora.where(hora.between(0, 23), -1).fillna(-1).astype("int8")
+    if COL_DIA in df.columns:
+        codis = {dia: i for i, dia in enumerate(DIES_SETMANA)}
+        df[COL_DIA_CODI] = df[COL_DIA].map(codis).fillna(-1).astype("int8")
+    comptes = reprojectar_coordenades(df)
+    if informe is not None:
+        informe.update(comptes)
+
+    return df
+
+
+def validar(df, nom):
+    """Llança ValueError si al CSV normalitzat li falten columnes obligatòries."""
+    falten = [c for c in COLUMNES_OBLIGATORIES if c not in df.columns]
+    if falten:
+        raise ValueError(f"L'arxiu '{nom}' no té les columnes obligatòries: {', '.join(falten)}")
+    if df.empty:
+        raise ValueError(f"L'arxiu '{nom}' no conté cap registre.")
+
+
+# =======================================================
+# Particions i dataset immutable
+# =======================================================
+
+@dataclass(frozen=True, eq=False)
+class Particio:
+    """Un CSV normalitzat amb els seus comptes per (any, valor)."""
+    nom: str
+    hash: str
+    df: pd.DataFrame
+    comptes: dict
+    coordenades: dict = field(default_factory=dict)   # comptes de reprojectar_coordenades
+
+
+def crear_particio(nom, contingut):
+    """Llegeix, normalitza i agrega un únic CSV (bytes)."""
+    coordenades = {}
+    df = normalitzar(llegir_csv(contingut), coordenades)
+    comptes = {
+        col: df.groupby([COL_ANY, col]).size()
+        for col in COLUMNES_AGREGADES
+        if COL_ANY in df.columns and col in df.columns
+    }
+    return Particio(nom=nom, hash=hashlib.sha1(contingut).hexdigest(), df=df, comptes=comptes,
+                    coordenades=coordenades)
+
+
+def _ampliar_gazetteer(gazetteer, particio):
+    """Retorna una còpia del gazetteer amb els carrers nous de la partició."""
+    nou = dict(gazetteer)
+    if COL_CARRER in particio.df.columns:
+        for carrer in particio.df[COL_CARRER].dropna().unique():
+            norm = normalize_text_advanced(carrer)
+            if norm:
+                nou.setdefault(norm, carrer)
+    return nou
+
+
+@dataclass(frozen=True, eq=False)
+class TaulaGeo:
+    """
+    Punts d'accident nets per al mapa (un per expedient, sense coordenades
+    buides o a zero) amb índexs de files per any i per districte.
+    """
+    df: pd.DataFrame        # Latitud/Longitud float32, districte/carrer category, Nk_Any int16
+    per_any: dict           # any -> np.ndarray de files (ordenat)
+    per_districte: dict     # districte -> np.ndarray de files (ordenat)
+
+    def filtrar(self, anys=None, districtes=None):
+        """Files que compleixen els filtres (intersecció d'índexs, sense copiar la taula)."""
+        files = np.arange(len(self.df), dtype=np.int32)
+        for index, valors in ((self.per_any, anys), (self.per_districte, districtes)):
+            if valors is None:
+                continue
+            seleccio = [index[v] for v in valors if v in index]
+            seleccio = np.sort(np.concatenate(seleccio)) if seleccio else np.empty(0, dtype=np.int32)
+            files = np.intersect1d(files, seleccio, assume_unique=True)
+        return files
+
+
+def _index_files(codis, categories):
+    """{categoria: files} a partir dels codis enters d'una columna."""
+    ordre = np.argsort(codis, kind="stable").astype(np.int32)
+    limits = np.searchsorted(codis[ordre], np.arange(len(categories) + 1))
+    return {cat: ordre[limits[i]:limits[i + 1]] for i, cat in enumerate(categories) if limits[i] < limits[i + 1]}
+
+
+def construir_taula_geo(df):
+    """Construeix la `TaulaGeo` a partir del dataframe normalitzat."""
+    columnes = [c for c in ("Numero_expedient", COL_ANY, COL_DISTRICTE, COL_CARRER, "Latitud", "Longitud") if c in df.columns]
+    if "Latitud" not in columnes or "Longitud" not in columnes:
+        return TaulaGeo(df=pd.DataFrame(columns=["Latitud", "Longitud"]), per_any={}, per_districte={})
+
+    geo = df[columnes]
+    geo = geo[geo["Latitud"].notna() & geo["Longitud"].notna() & (geo["Latitud"] != 0) & (geo["Longitud"] != 0)]
+    if "Numero_expedient" in geo.columns:
+        geo = geo.drop_duplicates("Numero_expedient").drop(columns="Numero_expedient")
+
+    geo = pd.DataFrame({
+        "Latitud": geo["Latitud"].to_numpy(np.float32),
+        "Longitud": geo["Longitud"].to_numpy(np.float32),
+        **{c: geo[c].astype("category") for c in (COL_DISTRICTE, COL_CARRER) if c in geo.columns},
+        **({COL_ANY: geo[COL_ANY].fillna(0).to_numpy(np.int16)} if COL_ANY in geo.columns else {}),
+    }).reset_index(drop=True)
+
+    per_any, per_districte = {}, {}
+    if COL_ANY in geo.columns:
+        anys, codis = np.unique(geo[COL_ANY].to_numpy(), return_inverse=True)
+        per_any = _index_files(codis, [int(a) for a in anys])
+    if COL_DISTRICTE in geo.columns:
+        cat = geo[COL_DISTRICTE].cat
+        per_districte = _index_files(cat.codes.to_numpy(), list(cat.categories))
+    return TaulaGeo(df=geo, per_any=per_any, per_districte=per_districte)
+
+
+def ampliar_taula_geo(geo, df, vistos):
+    """
+    `TaulaGeo` amb les files d'una partició nova afegides al final (sense les
+    dels expedients `vistos`): els índexs per any i per districte de les files
+    anteriors es conserven i s'hi afegeixen les noves. None si les columnes no
+    coincideixen (cal reconstruir-la).
+    """
+    nova = construir_taula_geo(df[~vistos])
+    if list(nova.df.columns) != list(geo.df.columns):
+        return None
+    desplacament = len(geo.df)
+    combinada = pd.DataFrame({
+        c: union_categoricals([geo.df[c], nova.df[c]], sort_categories=True)
+        if isinstance(geo.df[c].dtype, pd.CategoricalDtype) else np.concatenate([geo.df[c], nova.df[c]])
+        for c in geo.df.columns
+    })
+
+    def unir(index, nou):
+        buit = np.empty(0, dtype=np.int32)
+        return {k: np.concatenate([index.get(k, buit), nou.get(k, buit) + np.int32(desplacament)])
+                for k in {**index, **nou}}
+
+    return TaulaGeo(df=combinada, per_any=unir(geo.per_any, nova.per_any),
+                    per_districte=unir(geo.per_districte, nova.per_districte))
+
+
+QUANTIL_BBOX = 0.02
+
+
+def construir_geometria_carrers(geo):
+    """
+    Centroide, bbox i nombre d'accidents (amb coordenades, un per expedient)
+    de cada carrer, en un sol groupby sobre la taula geogràfica.
+    """
+    columnes = ["Latitud", "Longitud", "lat_min", "lat_max", "lon_min", "lon_max", "accidents"]
+    if COL_CARRER not in geo.df.columns or geo.df.empty:
+        return pd.DataFrame(columns=columnes)
+    grups = geo.df.groupby(COL_CARRER, observed=True)[["Latitud", "Longitud"]]
+    taula = grups.mean()
+    # Quantils en lloc de min/max: una sola coordenada errònia no estira la bbox
+    baix, alt = grups.quantile(QUANTIL_BBOX), grups.quantile(1 - QUANTIL_BBOX)
+    taula["lat_min"], taula["lat_max"] = baix["Latitud"], alt["Latitud"]
+    taula["lon_min"], taula["lon_max"] = baix["Longitud"], alt["Longitud"]
+    taula["accidents"] = grups.size()
+    taula.index = taula.index.astype(str)
+    return taula[columnes]
+
+
+_GENERACIONS = itertools.count(1)
+
+
+@dataclass(frozen=True, eq=False)
+class Dataset:
+    """
+    Dades netes i combinades d'una versió de la carpeta `data/`.
+
+    És compartit per tot el procés: els consumidors NO han de modificar `df`
+    (filtrar o agregar genera objectes nous i és segur).
+    """
+    versio: str
+    particions: tuple
+    df: pd.DataFrame
+    gazetteer: dict   # nom de carrer normalitzat -> nom original
+    _cache: dict = field(default_factory=dict, repr=False)
+    # ordre de creació dins del procés: `versio` és un hash i no es pot comparar
+    generacio: int = field(default_factory=lambda: next(_GENERACIONS))
+
+    @property
+    def buit(self):
+        return self.df.empty
+
+    @property
+    def arxius(self):
+        return tuple(p.nom for p in self.particions)
+
+    @property
+    def anys(self):
+        """Anys disponibles ordenats (enters)."""
+        if COL_ANY not in self.df.columns:
+            return []
+        return sorted(int(a) for a in self.df[COL_ANY].dropna().unique())
+
+    @property
+    def coordenades(self):
+        """Comptes de la reprojecció UTM -> WGS84 sumats per a totes les particions."""
+        total = {}
+        for p in self.particions:
+            for clau, valor in p.coordenades.items():
+                total[clau] = total.get(clau, 0) + valor
+        return total
+
+    @property
+    def geo(self):
+        """Taula geogràfica neta i indexada (es calcula un cop per versió)."""
+        if "geo" not in self._cache:
+            self._cache["geo"] = construir_taula_geo(self.df)
+        return self._cache["geo"]
+
+    @property
+    def carrers(self):
+        """Geometria per carrer (centroide, bbox, accidents), un cop per versió."""
+        if "carrers" not in self._cache:
+            self._cache["carrers"] = construir_geometria_carrers(self.geo)
+        return self._cache["carrers"]
+
+    def ubicacio_carrer(self, nom):
+        """
+        Centre, bbox i accidents d'un carrer pel nom original o, si no hi és
+        tal qual, pel nom normalitzat / més semblant del gazetteer. None si no
+        es troba o no té cap accident amb coordenades.
+        """
+        carrers = self.carrers
+        if nom not in carrers.index:
+            nom = self.gazetteer.get(normalize_text_advanced(nom)) or buscar_carrer(self, nom)
+            if nom is None or nom not in carrers.index:
+                return None
+        fila = carrers.loc[nom]
+        return {
+            "carrer": nom,
+            "centre": [round(float(fila["Latitud"]), 6), round(float(fila["Longitud"]), 6)],
+            "bbox": [round(float(fila[c]), 6) for c in ("lat_min", "lat_max", "lon_min", "lon_max")],
+            "accidents": int(fila["accidents"]),
+        }
+
+    def comptes(self, col, nk_any=None):
+        """
+        Nombre d'accidents per valor de `col` (opcionalment d'un sol any),
+        ordenat de més a menys. Suma els agregats de les particions.
+        """
+        clau = ("comptes", col, nk_any)
+        if clau not in self._cache:
+            parts = [p.comptes[col] for p in self.particions if col in p.comptes]
+            if not parts:
+                total = pd.Series(dtype="int64")
+            else:
+                total = _comptes_per_valor(pd.concat(parts), nk_any).sort_values(ascending=False)
+            self._cache[clau] = total
+        return self._cache[clau]
+
+    def amb_particio(self, particio, versio):
+        """
+        Nou `Dataset` amb la partició afegida (o substituïda si ja n'hi havia
+        una amb el mateix nom). Les altres particions no es tornen a llegir.
+
+        Si s'afegeix, les estructures derivades que es poden ampliar passen al
+        dataset nou: comptes per (any, valor), taula geogràfica (índexs per any
+        i districte) i les entrades de la cache amb un mètode `ampliar` (l'índex
+        de hotspots). La resta (carrers, taula columnar, matrius temporals,
+        consultes) depèn del conjunt sencer i es calcula quan es demana.
+        """
+        if particio.nom in self.arxius:
+            particions = tuple(particio if p.nom == particio.nom else p for p in self.particions)
+            df = pd.concat([p.df for p in particions], ignore_index=True)
+            gazetteer = {}
+            for p in particions:
+                gazetteer = _ampliar_gazetteer(gazetteer, p)
+            return Dataset(versio=versio, particions=particions, df=df, gazetteer=gazetteer)
+
+        df = pd.concat([self.df, particio.df], ignore_index=True)
+        nou = Dataset(versio=versio, particions=self.particions + (particio,), df=df,
+                      gazetteer=_ampliar_gazetteer(self.gazetteer, particio))
+        nou._cache.update(self._cache_ampliada(particio, versio))
+        return nou
+
+    def _cache_ampliada(self, particio, versio):
+        """Entrades de la cache d'aquest dataset ampliades amb `particio`."""
+        # expedients que ja tenen un punt (amb coordenades) a les particions anteriors:
+        # la taula geo i els hotspots compten cada expedient un sol cop
+        expedient = "Numero_expedient"
+        vistos = np.zeros(len(particio.df), dtype=bool)
+        if {expedient, "Latitud", "Longitud"} <= set(self.df.columns) and expedient in particio.df.columns:
+            lat, lon = self.df["Latitud"], self.df["Longitud"]
+            amb_coords = lat.notna() & lon.notna() & (lat != 0) & (lon != 0)
+            vistos = particio.df[expedient].isin(self.df.loc[amb_coords, expedient]).to_numpy()
+
+        cache = {}
+        for clau, valor in list(self._cache.items()):
+            if isinstance(clau, tuple) and clau[0] == "comptes":
+                _, col, nk_any = clau
+                if col in particio.comptes:
+                    nous = _comptes_per_valor(particio.comptes[col], nk_any)
+                    valor = valor.add(nous, fill_value=0).astype("int64").sort_index().sort_values(ascending=False)
+                cache[clau] = valor
+            elif clau == "geo":
+                geo = ampliar_taula_geo(valor, particio.df, vistos)
+                if geo is not None:
+                    cache[clau] = geo
+            elif hasattr(valor, "ampliar"):
+                ampliat = valor.ampliar(particio.df, versio, vistos)
+                if ampliat is not None:
+                    # es modifica al seu lloc: passa al dataset nou i el vell el reconstruiria
+                    self._cache.pop(clau, None)
+                    cache[clau] = ampliat
+        return cache
+
+
+def _comptes_per_valor(comptes, nk_any=None):
+    """Suma per valor dels comptes per (any, valor), opcionalment d'un sol any (ordenat per valor)."""
+    if nk_any is not None:
+        comptes = comptes[comptes.index.get_level_values(0) == int(nk_any)]
+    return comptes.groupby(level=1).sum()
+
+
+# Resum del contingut de cada CSV per (ruta, mida, mtime): només es torna a
+# llegir un fitxer quan canvia el seu stat, i si només s'ha tocat o copiat
+# el resum (i per tant l'empremta) és el mateix
+_RESUMS = {}
+_LOCK_RESUMS = threading.Lock()
+
+
+def resum_contingut(ruta, st=None):
+    """Hash del contingut d'un fitxer, memoritzat mentre no canviï el seu stat."""
+    st = st or os.stat(ruta)
+    clau = (os.path.abspath(ruta), st.st_size, st.st_mtime_ns)
+    resum = _RESUMS.get(clau)
+    if resum is None:
+        h = hashlib.blake2b(digest_size=16)
+        with open(ruta, "rb") as f:
+            for bloc in iter(lambda: f.read(1 << 20), b""):
+                h.update(bloc)
+        resum = h.hexdigest()
+        with _LOCK_RESUMS:
+            for antiga in [c for c in _RESUMS if c[0] == clau[0]]:
+                del _RESUMS[antiga]
+            _RESUMS[clau] = resum
+    return resum
+
+
+def empremta_carpeta(carpeta=DATA_FOLDER):
+    """Hash curt de (nom, mida, hash del contingut) de tots els CSV de la carpeta."""
+    h = hashlib.sha1(f"normalitzacio:{VERSIO_NORMALITZACIO};".encode())
+    for entrada in sorted(os.scandir(carpeta), key=lambda e: e.name):
+        if entrada.name.endswith(".csv") and entrada.is_file():
+            st = entrada.stat()
+            h.update(f"{entrada.name}:{st.st_size}:{resum_contingut(entrada.path, st)};".encode())
+    return h.hexdigest()[:12]
+
+
+def construir_dataset(carpeta=DATA_FOLDER, versio=None):
+    """Llegeix i normalitza tots els CSV de la carpeta en un únic `Dataset`."""
+    carpeta = Path(carpeta)
+    versio = versio or empremta_carpeta(carpeta)
+    particions = tuple(crear_particio(r.name, r.read_bytes()) for r in sorted(carpeta.glob("*.csv")))
+    df = pd.concat([p.df for p in particions], ignore_index=True) if particions else pd.DataFrame()
+    gazetteer = {}
+    for p in particions:
+        gazetteer = _ampliar_gazetteer(gazetteer, p)
+    return Dataset(versio=versio, particions=particions, df=df, gazetteer=gazetteer)
+
+
+# Un únic dataset viu per carpeta i procés (equivalent a `st.cache_resource`)
+_DATASETS = {}
+_LOCK = threading.Lock()
+
+
+def obtenir_dataset(carpeta=DATA_FOLDER):
+    """
+    Retorna el `Dataset` compartit de la carpeta. Només es reconstrueix si
+    l'empremta dels CSV ha canviat; la versió anterior es descarta.
+    """
+    carpeta = Path(carpeta)
+    carpeta.mkdir(exist_ok=True)
+    clau = str(carpeta.resolve())
+
+    actual = _DATASETS.get(clau)
+    if actual is not None and actual.versio == empremta_carpeta(carpeta):
+        return actual
+
+    with _LOCK:
+        versio = empremta_carpeta(carpeta)
+        actual = _DATASETS.get(clau)
+        if actual is None or actual.versio != versio:
+            actual = construir_dataset(carpeta, versio)
+            _DATASETS[clau] = actual
+        return actual
+
+
+def afegir_particio(nom, contingut, carpeta=DATA_FOLDER):
+    """
+    Ingesta incremental d'un CSV pujat: el valida i normalitza, el desa a la
+    carpeta i publica una nova versió del dataset amb només aquesta partició
+    afegida. Si el mateix arxiu ja hi és (mateix nom i contingut) no fa res.
+
+    Llança ValueError si l'arxiu no té l'esquema mínim.
+    """
+    carpeta = Path(carpeta)
+    nom = Path(nom).name
+    actual = obtenir_dataset(carpeta)
+    hash_nou = hashlib.sha1(contingut).hexdigest()
+    if any(p.nom == nom and p.hash == hash_nou for p in actual.particions):
+        return actual
+
+    particio = crear_particio(nom, contingut)
+    validar(particio.df, nom)
+
+    with _LOCK:
+        (carpeta / nom).write_bytes(contingut)
+        base = _DATASETS.get(str(carpeta.resolve()), actual)
+        nou = base.amb_particio(particio, empremta_carpeta(carpeta))
+        _DATASETS[str(carpeta.resolve())] = nou
+        return nou
+
+
+def buscar_carrer(dataset, text, cutoff=0.7):
+    """Retorna el nom original del carrer més semblant a `text` (o None)."""
+    text_norm = normalize_text_advanced(text)
+    if not text_norm:
+        return None
+    noms_norm = list(dataset.gazetteer)
+    match = get_close_matches(text_norm, noms_norm, n=1, cutoff=cutoff)
+    return dataset.gazetteer[match[0]] if match else None
+
+
+# =======================================================
+# Agregació temporal (dia de la setmana x hora)
+# =======================================================
+
+def matriu_temporal(dataset, nk_any=None, per_any=False, per_causa=False):
+    """
+    Comptes d'accidents per (dia de la setmana, hora) calculats en una sola
+    passada amb `np.bincount` sobre els codis enters precalculats.
+
+    Retorna `(matriu, eixos)`: la matriu té forma ([anys], [causes], 7, 24) i
+    `eixos` conté les etiquetes de cada dimensió ('anys', 'causes', 'dies',
+    'hores'). Les files amb dia o hora desconeguts s'ignoren.
+    Es memoritza per versió del dataset.
+    """
+    clau = ("temporal", nk_any, per_any, per_causa)
+    if clau in dataset._cache:
+        return dataset._cache[clau]
+
+    df = dataset.df
+    eixos = {"dies": list(DIES_SETMANA), "hores": list(range(24))}
+    if df.empty or COL_DIA_CODI not in df.columns or COL_HORA not in df.columns:
+        forma = ((0,) if per_any else ()) + ((0,) if per_causa else ()) + (7, 24)
+        eixos.update({"anys": [], "causes": []})
+        return np.zeros(forma, dtype=np.int64), eixos
+
+    index = df[COL_DIA_CODI].to_numpy(np.int64) * 24 + df[COL_HORA].to_numpy(np.int64)
+    valid = (df[COL_DIA_CODI].to_numpy() >= 0) & (df[COL_HORA].to_numpy() >= 0)
+    anys = df[COL_ANY].to_numpy(dtype=np.int64, na_value=-1) if COL_ANY in df.columns else np.full(len(df), -1)
+    if nk_any is not None:
+        valid &= anys == int(nk_any)
+
+    forma = [7, 24]
+    if per_causa:
+        codis, causes = pd.factorize(df[COL_CAUSA], sort=True)
+        valid &= codis >= 0
+        index = codis.astype(np.int64) * (7 * 24) + index
+        forma.insert(0, len(causes))
+        eixos["causes"] = list(causes)
+    if per_any:
+        valors, codis = np.unique(anys, return_inverse=True)
+        valid &= anys >= 0
+        index = codis.astype(np.int64) * int(np.prod(forma)) + index
+        forma.insert(0, len(valors))
+        eixos["anys"] = [int(a) for a in valors]
+
+    mida = int(np.prod(forma))
+    matriu = np.bincount(index[valid], minlength=mida)[:mida].reshape(forma)
+    if per_any:
+        # Traiem l'entrada dels anys desconeguts (-1), si n'hi ha
+        conservar = [i for i, a in enumerate(eixos["anys"]) if a >= 0]
+        matriu = matriu[conservar]
+        eixos["anys"] = [eixos["anys"][i] for i in conservar]
+
+    dataset._cache[clau] = (matriu, eixos)
+    return matriu, eixos
+
+
+# =======================================================
+# Consultes declaratives (filtres + agrupació + top-k)
+# =======================================================
+#
+# Una consulta és un dict petit:
+#   {"filtres": {"any": [2022, 2023], "hora": [7, 8, 9]},
+#    "excloure": {"districte": ["Desconegut"]},
+#    "agrupar": ["districte", "causa"], "top": 10, "comptar": "files"}
+# S'executa sobre una taula columnar tipada (codis enters per dimensió,
+# una per versió del dataset). Els filtres es tradueixen a codis un sol cop
+# i s'apliquen del més selectiu al menys: cada predicat només mira les files
+# que han superat els anteriors. El resultat es memoritza per (versió,
+# consulta canònica).
+
+DIMENSIONS_CONSULTA = {
+    "any": COL_ANY,
+    "districte": COL_DISTRICTE,
+    "carrer": COL_CARRER,
+    "causa": COL_CAUSA,
+    "dia": COL_DIA_CODI,
+    "hora": COL_HORA,
+}
+MAX_GRUPS_CONSULTA = 1000
+MAX_CACHE_CONSULTES = 256
+_LOCK_CONSULTES = threading.Lock()
+
+
+@dataclass(frozen=True, eq=False)
+class TaulaColumnar:
+    """Codis enters (-1 = desconegut) i etiquetes de cada dimensió consultable."""
+    n: int
+    codis: dict            # dimensió -> np.ndarray (int8/int16/int32)
+    etiquetes: dict        # dimensió -> llista de valors (el codi és la posició)
+    freq: dict             # dimensió -> comptes per codi (per estimar la selectivitat)
+    expedient: np.ndarray  # int32: codi de l'expedient de cada fila (sense número = un de propi)
+
+
+def _tipus_codis(n_valors):
+    return np.int8 if n_valors < 127 else np.int16 if n_valors < 32767 else np.int32
+
+
+def construir_taula_columnar(df):
+    codis, etiquetes, freq = {}, {}, {}
+    for dim, col in DIMENSIONS_CONSULTA.items():
+        if col not in df.columns:
+            continue
+        if dim == "dia":
+            codi, valors = df[col].to_numpy(np.int8), list(DIES_SETMANA)
+        elif dim == "hora":
+            codi, valors = df[col].to_numpy(np.int8), list(range(24))
+        else:
+            codi, valors = pd.factorize(df[col], sort=True)
+            valors = [int(v) for v in valors] if dim == "any" else [str(v) for v in valors]
+            codi = codi.astype(_tipus_codis(len(valors)))
+        codis[dim], etiquetes[dim] = codi, valors
+        freq[dim] = np.bincount(codi[codi >= 0].astype(np.int64), minlength=len(valors))
+    return TaulaColumnar(n=len(df), codis=codis, etiquetes=etiquetes, freq=freq, expedient=codis_expedient(df))
+
+
+def codis_expedient(df):
+    """Codi enter de l'expedient de cada fila; les files sense número compten com un expedient cadascuna."""
+    if "Numero_expedient" not in df.columns:
+        return np.arange(len(df), dtype=np.int32)
+    codi, valors = pd.factorize(df["Numero_expedient"])
+    sense = codi < 0
+    codi[sense] = len(valors) + np.arange(int(sense.sum()))
+    return codi.astype(np.int32)
+
+
+def _enter(valor, camp):
+    # bool és un int per a Python però no és un valor vàlid de la consulta
+    if isinstance(valor, bool) or not isinstance(valor, (int, float, str)):
+        raise ValueError(f"'{camp}': s'esperava un enter, no {json.dumps(valor)}.")
+    try:
+        return int(valor)
+    except (TypeError, ValueError):
+        raise ValueError(f"'{camp}': s'esperava un enter, no {json.dumps(valor)}.") from None
+
+
+def _dimensio(dim):
+    if not isinstance(dim, str) or dim not in DIMENSIONS_CONSULTA:
+        raise ValueError(f"Dimensió desconeguda: {json.dumps(dim)}. Disponibles: {', '.join(DIMENSIONS_CONSULTA)}")
+    return dim
+
+
+def consulta_canonica(consulta):
+    """Valida la consulta i la retorna en forma canònica (ordenada, llistes)."""
+    if not isinstance(consulta, dict):
+        raise ValueError("La consulta ha de ser un objecte JSON.")
+    desconegudes = set(consulta) - {"filtres", "excloure", "agrupar", "top", "comptar"}
+    if desconegudes:
+        raise ValueError(f"Camps desconeguts a la consulta: {', '.join(sorted(desconegudes))}")
+
+    canonica = {}
+    for camp in ("filtres", "excloure"):
+        predicats = consulta.get(camp) or {}
+        if not isinstance(predicats, dict):
+            raise ValueError(f"'{camp}' ha de ser un objecte {{dimensió: valor(s)}}.")
+        for dim, valors in predicats.items():
+            _dimensio(dim)
+            valors = valors if isinstance(valors, (list, tuple)) else [valors]
+            if any(isinstance(v, bool) or not isinstance(v, (int, float, str)) for v in valors):
+                raise ValueError(f"'{camp}.{dim}': els valors han de ser enters o textos.")
+            if dim in ("any", "hora"):
+                valors = [_enter(v, f"{camp}.{dim}") for v in valors]
+            elif dim == "dia":
+                valors = [DIES_SETMANA[int(v)] if str(v).isdigit() and int(v) < 7 else str(v) for v in valors]
+            else:
+                valors = [str(v) for v in valors]
+            canonica.setdefault(camp, {})[dim] = sorted(set(valors), key=str)
+
+    agrupar = consulta.get("agrupar") or []
+    if not isinstance(agrupar, (list, tuple)):
+        raise ValueError("'agrupar' ha de ser una llista de dimensions.")
+    canonica["agrupar"] = [_dimensio(dim) for dim in agrupar]
+
+    top = consulta.get("top")
+    if top is not None:
+        if isinstance(top, bool) or not isinstance(top, int) or top <= 0:
+            raise ValueError("'top' ha de ser un enter positiu.")
+        top = min(top, MAX_GRUPS_CONSULTA)
+    canonica["top"] = top
+
+    comptar = consulta.get("comptar", "files")
+    if comptar not in ("files", "expedients"):
+        raise ValueError("'comptar' ha de ser 'files' (conductors) o 'expedients' (accidents).")
+    canonica["comptar"] = comptar
+    return canonica
+
+
+def executar_consulta(taula, consulta):
+    """Executa una consulta canònica sobre una `TaulaColumnar` -> (total, grups). Sense cache."""
+    # Predicats com (dimensió, codis, inclou), del més selectiu al menys
+    predicats = []
+    for camp, inclou in (("filtres", True), ("excloure", False)):
+        for dim, valors in consulta.get(camp, {}).items():
+            if dim not in taula.codis:
+                if inclou:
+                    return 0, []
+                continue
+            posicio = {v: i for i, v in enumerate(taula.etiquetes[dim])}
+            codis = np.array([posicio[v] for v in valors if v in posicio], dtype=np.int64)
+            fraccio = taula.freq[dim][codis].sum() / max(taula.n, 1)
+            predicats.append((fraccio if inclou else 1 - fraccio, dim, codis, inclou))
+    predicats.sort(key=lambda p: p[0])
+
+    # Els filtres s'apliquen a totes les files (conductors): un accident entra
+    # si alguna de les seves files compleix la consulta, encara que no sigui la primera
+    files = None
+    for _, dim, codis, inclou in predicats:
+        columna = taula.codis[dim] if files is None else taula.codis[dim][files]
+        mascara = np.isin(columna, codis) if inclou else ~np.isin(columna, codis)
+        files = np.flatnonzero(mascara) if files is None else files[mascara]
+        if len(files) == 0:
+            break
+    if files is None:
+        files = np.arange(taula.n)
+
+    expedients = consulta["comptar"] == "expedients"
+    total = len(np.unique(taula.expedient[files])) if expedients else len(files)
+    agrupar = consulta["agrupar"]
+    if not agrupar:
+        return int(total), []
+    if any(dim not in taula.codis for dim in agrupar):
+        return int(total), []
+
+    # Clau combinada de grup (descarta files amb algun valor desconegut)
+    clau = np.zeros(len(files), dtype=np.int64)
+    valides = np.ones(len(files), dtype=bool)
+    for dim in agrupar:
+        codi = taula.codis[dim][files].astype(np.int64)
+        valides &= codi >= 0
+        clau = clau * len(taula.etiquetes[dim]) + codi
+    if expedients:
+        # parelles (grup, expedient) diferents: cada accident compta un cop per grup
+        clau, expedient = clau[valides], taula.expedient[files][valides].astype(np.int64)
+        n_expedients = int(taula.expedient.max()) + 1 if taula.n else 1
+        n_grups = int(np.prod([len(taula.etiquetes[dim]) for dim in agrupar], dtype=float))
+        if n_grups * n_expedients < 2 ** 62:
+            # parella combinada en un sol enter (molt més ràpid que np.unique per files)
+            grups, comptes = np.unique(np.unique(clau * n_expedients + expedient) // n_expedients, return_counts=True)
+        else:
+            parelles = np.unique(np.stack([clau, expedient], axis=1), axis=0)
+            grups, comptes = np.unique(parelles[:, 0], return_counts=True)
+    else:
+        grups, comptes = np.unique(clau[valides], return_counts=True)
+
+    limit = consulta["top"] or MAX_GRUPS_CONSULTA
+    if len(comptes) > limit:
+        seleccio = np.argpartition(-comptes, limit - 1)[:limit]
+        grups, comptes = grups[seleccio], comptes[seleccio]
+    ordre = np.lexsort((grups, -comptes))
+
+    resultat = []
+    for grup, compte in zip(grups[ordre].tolist(), comptes[ordre].tolist()):
+        fila = {}
+        for dim in reversed(agrupar):
+            grup, codi = divmod(grup, len(taula.etiquetes[dim]))
+            fila[dim] = taula.etiquetes[dim][codi]
+        resultat.append({**{dim: fila[dim] for dim in agrupar}, "total": compte})
+    return int(total), resultat
+
+
+def consultar(dataset, consulta):
+    """
+    Executa una consulta declarativa sobre el dataset. Retorna
+    {"versio", "consulta" (canònica), "total", "grups", "cache"}.
+    Llança ValueError si la consulta no és vàlida.
+    """
+    canonica = consulta_canonica(consulta)
+    clau = json.dumps(canonica, sort_keys=True, ensure_ascii=False)
+
+    with _LOCK_CONSULTES:
+        cache = dataset._cache.setdefault("consultes", OrderedDict())
+        if clau in cache:
+            cache.move_to_end(clau)
+            return {**cache[clau], "cache": True}
+        if "columnar" not in dataset._cache:
+            dataset._cache["columnar"] = construir_taula_columnar(dataset.df)
+        taula = dataset._cache["columnar"]
+
+    total, grups = executar_consulta(taula, canonica)
+    resultat = {"versio": dataset.versio, "consulta": canonica, "total": total, "grups": grups}
+    with _LOCK_CONSULTES:
+        cache[clau] = resultat
+        while len(cache) > MAX_CACHE_CONSULTES:
+            cache.popitem(last=False)
+    return {**resultat, "cache": False}
@@ -1,10 +1,54 @@
 # ================================
 # ENTRENAR Y GUARDAR EL MODELO ML
 # ================================
+#
+# python entrenar_modelo.py                                 -> entrenament amb el dataset en memòria
+# python entrenar_modelo.py --per-trossos --accepto-perdua  -> entrenament per trossos (memòria acotada)
+#
+# L'entrenament per trossos perd precisió (model/informe_trossos.json,
+# benchmark_trossos.py): només s'ha de fer servir si el dataset no cap en
+# memòria, i per això cal confirmar-ho explícitament.
+
+import argparse
+import json
+from pathlib import Path
+
+from ml_service import TAMANO_TROZO, entrenar_modelo, entrenar_modelo_por_trozos
+
+INFORME_TROSSOS = Path("model/informe_trossos.json")
+
+
+def perdua_per_trossos():
+    """Precisió en memòria vs per trossos a l'escenari sense files repetides del benchmark (o None)."""
+    if not INFORME_TROSSOS.exists():
+        return None
+    resultats = json.loads(INFORME_TROSSOS.read_text(encoding="utf-8")).get("escenaris", {}).get("agrupat")
+    if not resultats:
+        return None
+    memoria = next(r["precision"] for r in resultats if r["mode"] == "memoria")
+    trossos = ", ".join(f"{r['precision']:.3f} ({r['mode']})" for r in resultats if r["mode"] != "memoria")
+    return f"{memoria:.3f} en memòria vs {trossos}"
 
-from ml_service import entrenar_modelo
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Entrena i desa el model de causes.")
+    parser.add_argument("--per-trossos", action="store_true",
+                        help="llegeix els CSV per trossos sense carregar-los sencers (menys precís)")
+    parser.add_argument("--accepto-perdua", action="store_true",
+                        help="confirma l'entrenament per trossos tot i la pèrdua de precisió")
+    parser.add_argument("--tros", type=int, default=TAMANO_TROZO, help="files per tros (per defecte %(default)s)")
+    args = parser.parse_args()
+
+    if args.per_trossos:
+        perdua = perdua_per_trossos()
+        print("⚠️ L'entrenament per trossos dona un model menys precís que el de memòria"
+              + (f" (benchmark sense files repetides: {perdua})." if perdua else "."))
+        if not args.accepto_perdua:
+            parser.error("--per-trossos només si el dataset no cap en memòria; confirma-ho amb --accepto-perdua")
+
     print("🔧 Entrenant el model IA... (pot tardar uns segons)")
-    entrenar_modelo()
+    if args.per_trossos:
+        entrenar_modelo_por_trozos(tamano=args.tros)
+    else:
+        entrenar_modelo()
     print("✔ Model entrenat i guardat correctament a la carpeta /model")
@@ -1,22 +1,51 @@
 # =======================================================
-# FITXER: api.py (API Unificada: ML Predictiu + Dades Unity)
+# FITXER: fastAPIserver.py (API Unificada: ML Predictiu + Dades Unity)
 # =======================================================
 
-from fastapi import FastAPI, HTTPException, File, UploadFile, APIRouter
+import time
+ARRENCADA = time.perf_counter()      # referència del registre d'arrencada en fred
+
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, APIRouter, Depends, Header, Query, Request, Response, WebSocket
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from difflib import get_close_matches
-from ml_service import cargar_csvs, cargar_modelo, filtrar_calle, codificar_df
-from typing import List, Dict, Any, Optional
-import unicodedata
+from ml_service import (activar_paquete, cargar_csvs, cargar_paquete, etiqueta_franja, filas_calle, franja_hora,
+                        listar_paquetes, predecir_contexto, version_activa)
+from data_service import DIES_SETMANA, buscar_carrer, matriu_temporal
+from repositori_service import obtenir_repositori
+from risk_service import MAX_PUNTS_RUTA, carregar_raster_risc, carregar_taula_risc, dins_bbox
+from push_service import difusor, llegir_viewport
+from hotspot_service import MAX_HOTSPOTS, obtenir_hotspots
+from magatzem_service import MagatzemAccidents
+from resposta_service import cache_respostes
+from cache_service import CacheLRU
+from pujada_service import MIDA_MAX_PUJADA, PUJADES_PATH, PujadaInvalida, PujadaMassaGran, rebre_fitxer
+from typing import List, Dict, Any, Optional, Union
+import numpy as np
 import pandas as pd
+import asyncio
+import hmac
+import itertools
 import os
-import time
+import threading
+IMPORTS_S = time.perf_counter() - ARRENCADA
+
+@asynccontextmanager
+async def cicle_de_vida(app):
+    # El port s'obre quan acaba aquest bloc: la càrrega va en un fil a part
+    arrencada.port_obert = round(time.perf_counter() - ARRENCADA, 3)
+    if CARREGA_EN_SEGON_PLA:
+        threading.Thread(target=carregar_artefactes, name="carrega-artefactes", daemon=True).start()
+    else:
+        carregar_artefactes()
+    yield
 
 # --- Configuració de l'API ---
 app = FastAPI(
     title="API Unificada: ML i Dades per a Unity",
-    version="1.1.0"
+    version="1.1.0",
+    lifespan=cicle_de_vida,
 )
 
 # === CORS ===
@@ -29,7 +58,7 @@ app.add_middleware(
 
 # --- Configuració de Directoris ---
 DATA_FOLDER = "data"
-UPLOAD_DIR = "uploaded_files"
+UPLOAD_DIR = PUJADES_PATH
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
 # =======================================================
@@ -53,53 +82,203 @@ class NouAccident(BaseModel):
 class CalleInput(BaseModel):
     nombre: str
 
+class PrediccioInput(BaseModel):
+    carrer: str
+    dia: Union[int, str]              # 0 = Dilluns ... 6 = Diumenge, o el nom ('Divendres')
+    hora: int                         # 0-23
+    districte: Optional[str] = None
+
+class ConsultaInput(BaseModel):
+    filtres: Dict[str, Union[List[Union[int, str]], int, str]] = {}    # dimensió -> valor(s)
+    excloure: Dict[str, Union[List[Union[int, str]], int, str]] = {}
+    agrupar: List[str] = []      # any, districte, carrer, causa, dia, hora
+    top: Optional[int] = None
+    comptar: str = "files"       # 'files' (conductors) o 'expedients' (accidents)
+
+class RutaInput(BaseModel):
+    punts: List[List[float]]   # [[longitud, latitud], ...] (ordre GeoJSON)
+
 # =======================================================
-# PART 2: Càrrega Global del Model i Dades
+# PART 2: Càrrega del Model i Dades (en segon pla)
 # =======================================================
+#
+# Importar aquest mòdul no llegeix cap fitxer: el port s'obre de seguida i
+# els artefactes es carreguen per etapes en un fil quan arrenca l'aplicació
+# (RAIA_CARREGA=sincrona per carregar-los abans d'obrir el port). Una etapa
+# que falla (p. ex. falta un fitxer) queda marcada amb l'error i el procés
+# continua. /healthz diu si el procés és viu; /readyz respon 200 quan les
+# etapes obligatòries estan carregades i l'escalfament ha acabat. Els
+# endpoints que necessiten una etapa pendent responen 503 amb Retry-After.
 
-# Cargamos los datos y el modelo una sola vez al iniciar el servidor
-df = cargar_csvs()
-model, codificadores, columns = cargar_modelo()
+CARREGA_EN_SEGON_PLA = os.environ.get("RAIA_CARREGA", "segon_pla") != "sincrona"
+ETAPES_OBLIGATORIES = ("dades", "model", "magatzem")
 
-def carregar_dades_accidents_per_api(df_total_ml):
-    """ Prepara los datos de coordenadas para Unity """
-    if df_total_ml.empty:
-        return []
-    
-    # Unificar nombres de columnas de coordenadas
-    if 'Latitud_WGS84' in df_total_ml.columns and 'Longitud_WGS84' in df_total_ml.columns:
-        df_servei = df_total_ml.reindex(columns=['Nk_Any', 'Nom_districte', 'Nom_carrer', 'Latitud_WGS84', 'Longitud_WGS84']).dropna()
-        df_servei.rename(columns={'Latitud_WGS84': 'Latitud', 'Longitud_WGS84': 'Longitud'}, inplace=True)
-    elif 'Latitud' in df_total_ml.columns and 'Longitud' in df_total_ml.columns:
-         df_servei = df_total_ml.reindex(columns=['Nk_Any', 'Nom_districte', 'Nom_carrer', 'Latitud', 'Longitud']).dropna()
-    else:
-        return []
-    
-    df_servei['id'] = range(1, len(df_servei) + 1)
-    return df_servei.head(1000).to_dict('records')
+# Artefactes (None fins que la seva etapa acaba)
+df = None
+paquet = None               # PaqueteModelo actiu: model + pipeline + cub d'una mateixa versió
+taula_risc = None           # None si no s'ha executat construir_risc.py
+raster_risc = None          # ídem (mapejat en memòria)
+magatzem = None             # coordenades per a Unity (instantànies immutables)
+
+
+class EstatArrencada:
+    def __init__(self):
+        self.etapes = {}            # nom -> {"estat": "ok" | "error", "segons": s, "error": text}
+        self.port_obert = None      # segons des de l'inici del procés
+        self.llest_als = None
+        self.acabat = False
+
+    def executar(self, nom, funcio):
+        inici = time.perf_counter()
+        try:
+            funcio()
+            etapa = {"estat": "ok"}
+        except Exception as e:      # un artefacte que falla no fa caure el procés
+            etapa = {"estat": "error", "error": f"{type(e).__name__}: {e}"}
+        etapa["segons"] = round(time.perf_counter() - inici, 3)
+        self.etapes[nom] = etapa
+
+    def carregada(self, nom):
+        return self.etapes.get(nom, {}).get("estat") == "ok"
+
+    @property
+    def llest(self):
+        return self.acabat and all(self.carregada(nom) for nom in ETAPES_OBLIGATORIES)
+
+
+arrencada = EstatArrencada()
+
+
+def _carregar_dades():
+    # Los datos se leen a través del repositorio (RAIA_BACKEND=pandas|sqlite, ver repositori_service)
+    global df
+    df = cargar_csvs()
+
+def _carregar_model():
+    global paquet
+    paquet = cargar_paquete()       # el paquet actiu de model/paquetes (es publica si encara no n'hi ha)
+
+def _carregar_magatzem():
+    global magatzem
+    magatzem = MagatzemAccidents(obtenir_repositori().accidents_mapa(1000))
+
+def accidents_afegits():
+    """Accidents afegits per l'API: els índexs reconstruïts (nova versió dels CSV) els tornen a incloure."""
+    return magatzem.afegits() if magatzem is not None else []
+
+# ids únics i creixents encara que arribin dos accidents el mateix mil·lisegon
+ids_accidents = itertools.count(int(time.time() * 1000))
 
-db_accidents_llista = carregar_dades_accidents_per_api(df)
+def _carregar_risc():
+    global taula_risc, raster_risc
+    taula_risc = carregar_taula_risc()
+    raster_risc = carregar_raster_risc()
+
+def _escalfar():
+    """Primeres crides costoses fora del camí de les peticions."""
+    repositori = obtenir_repositori()
+    repositori.consultar({"agrupar": ["any"]})    # taula columnar / connexió SQLite
+    dataset = repositori.dataset                  # amb SQLite, les columnes derivades llegides de la BD
+    obtenir_hotspots(dataset, accidents_afegits)
+    dataset.carrers
+    if arrencada.carregada("model"):
+        _escalfar_model(paquet)
+
+def _escalfar_model(paquet_nou):
+    # imports de sklearn i pàgines del model abans de servir-lo
+    paquet_nou.model.predict_proba(paquet_nou.pipeline.transformar(df.head(1)))
+
+ETAPES = [
+    ("dades", _carregar_dades),
+    ("model", _carregar_model),
+    ("magatzem", _carregar_magatzem),
+    ("risc", _carregar_risc),
+    ("escalfament", _escalfar),
+]
+
+def carregar_artefactes():
+    for nom, funcio in ETAPES:
+        arrencada.executar(nom, funcio)
+    arrencada.acabat = True
+    arrencada.llest_als = round(time.perf_counter() - ARRENCADA, 3)
+
+    etapes = " · ".join(f"{nom} {e['segons']:.2f} s" + (" ❌" if e["estat"] == "error" else "")
+                        for nom, e in arrencada.etapes.items())
+    print(f"⏱️ Arrencada en fred: imports {IMPORTS_S:.2f} s · port obert als {arrencada.port_obert:.2f} s · "
+          f"{etapes} · {'llest' if arrencada.llest else 'NO llest'} als {arrencada.llest_als:.2f} s", flush=True)
+    for nom, e in arrencada.etapes.items():
+        if e["estat"] == "error":
+            print(f"❌ Etapa '{nom}': {e['error']}", flush=True)
+    if VIGILANCIA_MODEL_S > 0:
+        threading.Thread(target=vigilar_model, name="vigilancia-model", daemon=True).start()
+
+# --- Recàrrega en calent del model ---
+#
+# Un paquet nou es carrega i s'escalfa en un fil a part i se substitueix
+# canviant només la referència `paquet`. Cada petició agafa la referència
+# un sol cop al principi, així que les que ja estan en curs acaben amb el
+# paquet anterior, que s'allibera quan deixen d'usar-lo. El fil de
+# vigilància mira model/paquetes/ACTIVO cada VIGILANCIA_MODEL_S segons
+# (RAIA_VIGILAR_MODEL, 0 = desactivat); /admin/model/recarregar ho força.
+
+VIGILANCIA_MODEL_S = float(os.environ.get("RAIA_VIGILAR_MODEL", "5"))
+_lock_recarrega = threading.Lock()
+darrera_recarrega = {}      # {"versio", "estat", "segons", "error"}
+
+def recarregar_model(versio=None):
+    """Carrega el paquet `versio` (per defecte l'actiu) i el posa en servei. Retorna True si ha canviat."""
+    global paquet
+    with _lock_recarrega:
+        versio = versio or version_activa()
+        if versio is None or (paquet is not None and paquet.version == versio):
+            return False
+        inici = time.perf_counter()
+        try:
+            nou = cargar_paquete(versio)
+            if arrencada.carregada("dades"):
+                _escalfar_model(nou)
+        except Exception as e:
+            darrera_recarrega.update(versio=versio, estat="error", segons=round(time.perf_counter() - inici, 3),
+                                     error=f"{type(e).__name__}: {e}")
+            print(f"❌ Recàrrega del model {versio}: {darrera_recarrega['error']}", flush=True)
+            return False
+
+        anterior, paquet = paquet, nou
+        darrera_recarrega.update(versio=versio, estat="ok", segons=round(time.perf_counter() - inici, 3), error=None)
+        if not arrencada.carregada("model"):
+            arrencada.etapes["model"] = {"estat": "ok", "segons": darrera_recarrega["segons"]}
+        print(f"🔄 Model en servei: {versio} (abans {anterior.version if anterior else '-'}, "
+              f"{darrera_recarrega['segons']:.2f} s)", flush=True)
+        return True
+
+def vigilar_model():
+    while True:
+        time.sleep(VIGILANCIA_MODEL_S)
+        try:
+            versio = version_activa()
+        except OSError:
+            continue
+        fallida = darrera_recarrega.get("estat") == "error" and darrera_recarrega.get("versio") == versio
+        if versio and not fallida and (paquet is None or paquet.version != versio):
+            recarregar_model(versio)
+
+def requerir(*etapes):
+    """503 si alguna de les etapes encara es carrega (amb Retry-After) o ha fallat."""
+    for nom in etapes:
+        etapa = arrencada.etapes.get(nom)
+        if etapa is None:
+            raise HTTPException(status_code=503, detail=f"Servei arrencant: '{nom}' encara es carrega.",
+                                headers={"Retry-After": "2"})
+        if etapa["estat"] == "error":
+            raise HTTPException(status_code=503, detail=f"'{nom}' no disponible: {etapa['error']}")
 
 # =======================================================
 # PART 3: Funcions de Suport ML
 # =======================================================
 
-def normalize_text_advanced(text):
-    if not isinstance(text, str): return ""
-    text = text.lower().strip()
-    text = ''.join(c for c in unicodedata.normalize('NFD', text) if unicodedata.category(c) != 'Mn')
-    text = text.replace('.', ' ').replace('-', ' ').replace("'", ' ')
-    tokens_a_ignorar = ["carrer", "c", "avinguda", "av", "passeig", "pg", "ronda", "placa", "pl", "via", "rambla", "travessera", "ctra", "de les", "del", "de la", "de l", "dels", "de", "la", "el", "els", "les", "i"]
-    return ' '.join([t for t in text.split() if t not in tokens_a_ignorar]).strip()
-
-def fuzzy_find_street(df, calle):
-    if "Nom_carrer" not in df.columns: return None
-    calle_norm = normalize_text_advanced(calle)
-    if not calle_norm: return None
-    carrers_originals = df["Nom_carrer"].dropna().unique().tolist()
-    carrers_norm = [normalize_text_advanced(c) for c in carrers_originals]
-    match = get_close_matches(calle_norm, carrers_norm, n=1, cutoff=0.7)
-    return carrers_originals[carrers_norm.index(match[0])] if match else None
+def fuzzy_find_street(calle):
+    """Busca el carrer més semblant al gazetteer del dataset del repositori."""
+    return buscar_carrer(obtenir_repositori().dataset, calle)
 
 # =======================================================
 # PART 4: Endpoints de Dades de Unity (Router 'data')
@@ -107,71 +286,309 @@ def fuzzy_find_street(df, calle):
 
 data_router = APIRouter(prefix="/data", tags=["Unity-Data"])
 
-@data_router.get("/accidents", response_model=List[Accident])
-def obtenir_accidents():
-    return db_accidents_llista
+@data_router.get("/accidents", response_class=Response, responses={
+    200: {"model": List[Accident], "description": "Llista d'accidents (JSON, opcionalment gzip)"},
+    304: {"description": "No ha canviat des de l'ETag de If-None-Match"},
+})
+def obtenir_accidents(request: Request):
+    """ Bytes JSON pre-serialitzats per versió del magatzem (ETag / 304 / gzip) """
+    requerir("magatzem")
+    instantania = magatzem.instantania()
+    resposta = cache_respostes.obtenir("accidents", instantania.versio, instantania.registres)
+    return resposta.resposta(request, {"X-Versio-Accidents": str(instantania.versio)})
 
 @data_router.post("/afegirAccident", status_code=201)
 def afegir_accident(nou_accident: NouAccident):
-    global db_accidents_llista
+    requerir("magatzem", "dades")
     registre = {
-        "id": int(time.time() * 1000),
+        "id": next(ids_accidents),
         "Nk_Any": pd.Timestamp.now().year, 
         "Nom_districte": nou_accident.Nom_districte,
         "Nom_carrer": nou_accident.Nom_carrer,
         "Latitud": nou_accident.Latitud,
         "Longitud": nou_accident.Longitud,
     }
-    db_accidents_llista.append(registre)
-    return {"missatge": "Accident afegit", "accident": registre}
+    instantania = magatzem.afegir(registre)
+    # després d'afegir-lo al magatzem: si l'índex es reconstrueix ara, ja el reprodueix (i l'id no es repeteix)
+    hotspot = obtenir_hotspots(obtenir_repositori().dataset, accidents_afegits).afegir(
+        registre["Latitud"], registre["Longitud"], carrer=registre["Nom_carrer"], id=registre["id"])
+    difusor.publicar("nou", registre)
+    return {"missatge": "Accident afegit", "accident": registre, "hotspot": hotspot, "versio": instantania.versio}
+
+@data_router.get("/hotspots")
+def obtenir_punts_calents(request: Request, viewport: Optional[str] = None,
+                          limit: int = Query(50, ge=1, le=MAX_HOTSPOTS)):
+    """ Punts calents (grups de cel·les denses) amb les causes dominants. viewport = 'lat_min,lat_max,lon_min,lon_max' """
+    try:
+        bbox = llegir_viewport(viewport)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    requerir("dades")
+    dataset = obtenir_repositori().dataset
+    index = obtenir_hotspots(dataset, accidents_afegits)
+
+    def generar():
+        hotspots = index.hotspots(bbox, limit)
+        return {"versio": index.versio, "accidents_afegits": index.canvis, "total": len(hotspots), "hotspots": hotspots}
+
+    return cache_respostes.obtenir(("hotspots", bbox, limit), (dataset.generacio, index.canvis), generar).resposta(request)
+
+@app.post("/query", tags=["Unity-Data"])
+def query(data: ConsultaInput):
+    """ Comptes amb filtres i agrupació, p. ex. {"filtres": {"any": [2023]}, "agrupar": ["districte"], "top": 5} """
+    requerir("dades")
+    try:
+        return obtenir_repositori().consultar(data.model_dump())
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@data_router.websocket("/ws/accidents")
+async def ws_accidents(websocket: WebSocket, viewport: Optional[str] = None):
+    """ Push d'accidents nous. El client pot enviar {"viewport": [lat_min, lat_max, lon_min, lon_max]} """
+    await websocket.accept()
+    try:
+        subscriptor = difusor.subscriure(llegir_viewport(viewport))
+    except ValueError:
+        await websocket.close(code=1008)
+        return
+
+    async def enviar():
+        while True:
+            missatge = await subscriptor.cua.get()
+            if missatge is None:
+                await websocket.close(code=1013)   # client massa lent
+                return
+            await websocket.send_text(missatge.text)
+
+    async def rebre():
+        while True:
+            dades = await websocket.receive_json()
+            try:
+                subscriptor.viewport = llegir_viewport(dades.get("viewport"))
+            except (ValueError, TypeError, AttributeError):
+                await websocket.send_json({"error": "Viewport no vàlid"})
+
+    tasques = [asyncio.create_task(enviar()), asyncio.create_task(rebre())]
+    try:
+        await asyncio.wait(tasques, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for tasca in tasques:
+            tasca.cancel()
+        difusor.donar_de_baixa(subscriptor)
 
-@data_router.post("/upload_imatge")
-async def upload_imatge(file: UploadFile = File(...)):
+@data_router.get("/stream/accidents")
+async def stream_accidents(request: Request, viewport: Optional[str] = None):
+    """ Alternativa Server-Sent Events al WebSocket (mateixos missatges) """
     try:
-        file_location = os.path.join(UPLOAD_DIR, file.filename)
-        content = await file.read()
-        if len(content) == 0:
-             raise HTTPException(status_code=400, detail="L'arxiu rebut és buit.")
-        with open(file_location, "wb") as buffer:
-            buffer.write(content) 
-        return {"missatge": f"Arxiu '{file.filename}' carregat.", "mida": len(content)}
-    except Exception as e:
+        subscriptor = difusor.subscriure(llegir_viewport(viewport))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    async def esdeveniments():
+        try:
+            yield b": connectat\n\n"
+            while not await request.is_disconnected():
+                try:
+                    missatge = await asyncio.wait_for(subscriptor.cua.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    yield b": keep-alive\n\n"
+                    continue
+                if missatge is None:
+                    break
+                yield missatge.sse
+        finally:
+            difusor.donar_de_baixa(subscriptor)
+
+    return StreamingResponse(esdeveniments(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@data_router.get("/temporal")
+def obtenir_matriu_temporal(request: Request, nk_any: Optional[int] = None, per_any: bool = False,
+                            per_causa: bool = False):
+    """ Comptes d'accidents per dia de la setmana x hora (opcionalment x any i x causa) """
+    requerir("dades")
+    dataset = obtenir_repositori().dataset
+
+    def generar():
+        matriu, eixos = matriu_temporal(dataset, nk_any, per_any, per_causa)
+        return {**eixos, "comptes": matriu}
+
+    clau = ("temporal", nk_any, per_any, per_causa)
+    return cache_respostes.obtenir(clau, dataset.generacio, generar).resposta(request)
+
+# Documentació OpenAPI del formulari: el cos es llegeix en streaming, no amb UploadFile
+FORMULARI_PUJADA = {"requestBody": {"required": True, "content": {"multipart/form-data": {"schema": {
+    "type": "object", "required": ["file"],
+    "properties": {"file": {"type": "string", "format": "binary"}},
+}}}}}
+
+@data_router.post("/upload_imatge", openapi_extra=FORMULARI_PUJADA)
+async def upload_imatge(request: Request):
+    """ Desa el fitxer per contingut (SHA-256); si ja existia no es torna a escriure """
+    try:
+        desat = await rebre_fitxer(request, "file", UPLOAD_DIR, MIDA_MAX_PUJADA)
+    except PujadaMassaGran as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except PujadaInvalida as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except OSError as e:
         raise HTTPException(status_code=500, detail=str(e))
+    estat = "ja existia" if desat["duplicat"] else "carregat"
+    return {"missatge": f"Arxiu '{desat['nom']}' {estat}.", **desat}
 
 # =======================================================
 # PART 5: Endpoint Machine Learning (TOP 3 CAUSES)
 # =======================================================
 
+# Resultats de /predict_calle per (versió del model, versió de les dades, carrer
+# sense majúscules): els carrers populars no repeteixen filtre, fuzzy matching,
+# codificació ni predict_proba, i N peticions simultànies del mateix carrer
+# fan un sol càlcul. Els "no trobat" també es guarden (com a None).
+cache_prediccions = CacheLRU(max_entrades=2048, max_bytes=8 * 1024 * 1024, ttl_s=900)
+
 @app.post("/predict_calle", tags=["Machine Learning"])
-def predict_calle(data: CalleInput):
-    calle_final = data.nombre
-    df_calle = filtrar_calle(df, calle_final)
+def predict_calle(data: CalleInput, request: Request):
+    requerir("model")
+    p = usar_paquet(request)
+    nombre = " ".join(data.nombre.split())
+    clau = (p.version, obtenir_repositori().versio, nombre.casefold())
+    resultat = cache_prediccions.obtenir(clau, lambda: predecir_calle(p, nombre))
+    if resultat is None:
+        raise HTTPException(status_code=404, detail=f"No hay datos para '{data.nombre}'")
+    return resultat
+
+def predecir_calle(p, nombre):
+    calle_final = nombre
+    df_calle = filas_calle(calle_final)
 
     # Fuzzy Matching si no hay registros exactos
     if df_calle.empty:
-        calle_encontrada = fuzzy_find_street(df, data.nombre)
+        calle_encontrada = fuzzy_find_street(nombre)
         if not calle_encontrada:
-            raise HTTPException(status_code=404, detail=f"No hay datos para '{data.nombre}'")
+            return None
         calle_final = calle_encontrada
-        df_calle = filtrar_calle(df, calle_final)
+        df_calle = filas_calle(calle_final)
     
     # Proceso de predicción
-    df_encoded = codificar_df(df_calle, codificadores)
-    X_input = df_encoded[columns]
-    probas = model.predict_proba(X_input)
-
-    # Cálculo de Top 3
-    etiquetas = codificadores["Descripcio_causa_mediata"]
-    proba_media = probas.mean(axis=0)
-    proba_dict = {etiquetas[i]: float(round(proba_media[i] * 100, 2)) for i in range(len(etiquetas))}
-    
+    X_input = p.pipeline.transformar(df_calle)
+    probas = p.model.predict_proba(X_input)
+
+    proba_media = np.zeros(len(p.pipeline.etiquetas))
+    proba_media[p.model.classes_] = probas.mean(axis=0)
+    return {"calle": calle_final, "ubicacio": obtenir_repositori().dataset.ubicacio_carrer(calle_final),
+            "versio_model": p.version, **top_causes(proba_media, p.pipeline.etiquetas)}
+
+def usar_paquet(request):
+    """Paquet amb què es respon aquesta petició (fix encara que es recarregui a mig camí)."""
+    p = paquet
+    request.state.versio_model = p.version
+    return p
+
+def top_causes(proba, etiquetas):
+    """Top 3 i diccionari complet de probabilitats (%) per causa."""
+    proba_dict = {etiquetas[i]: float(round(proba[i] * 100, 2)) for i in range(len(etiquetas))}
+
     top_3_list = sorted(proba_dict.items(), key=lambda x: x[1], reverse=True)[:3]
     top_3_formatted = [{"causa": c, "probabilitat": p} for c, p in top_3_list]
+    return {"top_3": top_3_formatted, "probabilitats_completes": proba_dict}
+
+def llegir_dia(dia):
+    """0-6 o nom del dia en català -> 0-6 (ValueError si no és vàlid)."""
+    if isinstance(dia, str) and not dia.strip().isdigit():
+        noms = [d.lower() for d in DIES_SETMANA]
+        return noms.index(dia.strip().lower())
+    dia = int(dia)
+    if not 0 <= dia <= 6:
+        raise ValueError(dia)
+    return dia
+
+@app.post("/predict", tags=["Machine Learning"])
+def predict(data: PrediccioInput, request: Request):
+    """Causes probables en un carrer, dia i hora (cub precalculat; inferència si no hi és)."""
+    requerir("dades", "model")
+    try:
+        dia = llegir_dia(data.dia)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Dia no vàlid: '{data.dia}'. Usa 0-6 o {', '.join(DIES_SETMANA)}.")
+    if not 0 <= data.hora <= 23:
+        raise HTTPException(status_code=400, detail="L'hora ha d'estar entre 0 i 23.")
 
+    p = usar_paquet(request)
+    resultat = predecir_contexto(p.model, p.pipeline, p.cubo, df, data.carrer, dia, data.hora, data.districte)
+    if resultat is None:
+        carrer = fuzzy_find_street(data.carrer)
+        resultat = carrer and predecir_contexto(p.model, p.pipeline, p.cubo, df, carrer, dia, data.hora, data.districte)
+    if not resultat:
+        raise HTTPException(status_code=404, detail=f"No hi ha dades per a '{data.carrer}'")
+
+    carrer, probas, origen = resultat
     return {
-        "calle": calle_final,
-        "top_3": top_3_formatted,
-        "probabilitats_completes": proba_dict
+        "carrer": carrer,
+        "dia": DIES_SETMANA[dia],
+        "hora": data.hora,
+        "franja": etiqueta_franja(franja_hora(data.hora)),
+        "districte": data.districte,
+        "origen": origen,
+        "ubicacio": obtenir_repositori().dataset.ubicacio_carrer(carrer),
+        "versio_model": p.version,
+        **top_causes(probas, p.pipeline.etiquetas),
+    }
+
+# =======================================================
+# PART 5b: Risc d'una ruta (taula precalculada, sense inferència)
+# =======================================================
+
+@app.post("/ruta_predicha", tags=["Machine Learning"])
+def ruta_predicha(data: RutaInput):
+    requerir("risc")
+    if taula_risc is None:
+        raise HTTPException(status_code=503, detail="Taula de risc no generada. Executa 'python construir_risc.py'.")
+    if len(data.punts) < 2 or any(len(p) < 2 for p in data.punts):
+        raise HTTPException(status_code=400, detail="La ruta necessita almenys dos punts [longitud, latitud].")
+    if len(data.punts) > MAX_PUNTS_RUTA:
+        raise HTTPException(status_code=400, detail=f"La ruta té més de {MAX_PUNTS_RUTA} punts.")
+    fora = [i for i, p in enumerate(data.punts) if not dins_bbox(p[0], p[1])]
+    if fora:
+        raise HTTPException(status_code=400, detail=f"Punts no finits o fora de Barcelona (índexs {fora[:10]}).")
+
+    trams = taula_risc.risc_ruta([(p[0], p[1]) for p in data.punts])
+    return {
+        "trams": trams,
+        "risc_maxim": max(t["risc"] for t in trams),
+    }
+
+@app.get("/risc/raster", tags=["Machine Learning"])
+def risc_raster(lat_min: float, lat_max: float, lon_min: float, lon_max: float,
+                banda: str = "risc", dia: Optional[int] = Query(None, ge=0, le=6),
+                hora: Optional[int] = Query(None, ge=0, le=23), binari: bool = False):
+    """ Finestra del ràster de risc ('risc' o el nom d'una causa), opcionalment per dia i hora """
+    requerir("risc")
+    if raster_risc is None:
+        raise HTTPException(status_code=503, detail="Ràster de risc no generat. Executa 'python construir_risc.py'.")
+    try:
+        valors, bbox = raster_risc.finestra(lat_min, lat_max, lon_min, lon_max, banda, dia, hora)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Banda desconeguda: '{banda}'")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if binari:
+        return Response(
+            content=valors.tobytes(),
+            media_type="application/octet-stream",
+            headers={
+                "X-Forma": ",".join(map(str, valors.shape)),
+                "X-Dtype": str(valors.dtype),
+                "X-Bbox": ",".join(map(str, bbox)),
+            },
+        )
+    return {
+        "banda": banda,
+        "bbox": bbox,
+        "forma": list(valors.shape),
+        "dtype": str(valors.dtype),
+        "escala": 1 if banda == "risc" else raster_risc.meta["escala_causes"],
+        "nodata": None if banda == "risc" else raster_risc.meta["nodata"],
+        "valors": valors.tolist(),
     }
 
 # =======================================================
@@ -182,4 +599,83 @@ app.include_router(data_router)
 
 @app.get("/")
 def root():
-    return {"status": "API Unificada ONLINE", "mode": "ML + Unity Data"}
\ No newline at end of file
+    return {"status": "API Unificada ONLINE", "mode": "ML + Unity Data", "model": paquet and paquet.nombre,
+            "versio_model": paquet and paquet.version, "llest": arrencada.llest, "backend": obtenir_repositori().nom,
+            "coordenades": obtenir_repositori().dataset.coordenades if arrencada.carregada("dades") else None}
+
+@app.get("/healthz", tags=["Estat"])
+def healthz():
+    """ Viu: el procés respon (encara que s'estigui carregant) """
+    return {"estat": "viu", "segons": round(time.perf_counter() - ARRENCADA, 1)}
+
+@app.get("/readyz", tags=["Estat"])
+def readyz():
+    """ A punt: etapes obligatòries carregades i escalfament acabat (503 mentrestant) """
+    cos = {"llest": arrencada.llest, "imports_s": round(IMPORTS_S, 3), "port_obert_s": arrencada.port_obert,
+           "llest_s": arrencada.llest_als, "etapes": arrencada.etapes,
+           "pendents": [nom for nom, _ in ETAPES if nom not in arrencada.etapes]}
+    return JSONResponse(cos, status_code=200 if arrencada.llest else 503)
+
+# === Administració ===
+# /admin canvia el model en producció: només amb el secret compartit
+# RAIA_ADMIN_TOKEN (Authorization: Bearer <token>). Sense token configurat les
+# rutes no existeixen (404) i no surten mai a l'esquema OpenAPI públic.
+ADMIN_TOKEN = os.environ.get("RAIA_ADMIN_TOKEN", "")
+
+def verificar_admin(authorization: Optional[str] = Header(None)):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    esquema, _, token = (authorization or "").partition(" ")
+    if esquema.lower() != "bearer" or not hmac.compare_digest(token.strip().encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=401, detail="Cal el token d'administració.",
+                            headers={"WWW-Authenticate": "Bearer"})
+
+admin_router = APIRouter(prefix="/admin", tags=["Admin"], dependencies=[Depends(verificar_admin)],
+                         include_in_schema=False)
+
+@admin_router.get("/model")
+def estat_model():
+    """ Paquet en servei, paquet marcat com a actiu i versions disponibles """
+    return {"en_servei": paquet and paquet.manifiesto, "actiu": version_activa(), "disponibles": listar_paquetes(),
+            "darrera_recarrega": darrera_recarrega or None}
+
+@admin_router.post("/model/recarregar", status_code=202)
+def forcar_recarrega(versio: Optional[str] = None):
+    """ Activa `versio` (o torna a llegir ACTIVO) i la carrega en segon pla; el canvi és atòmic """
+    if versio is not None:
+        try:
+            activar_paquete(versio)
+        except ValueError as e:
+            raise HTTPException(status_code=404, detail=str(e))
+    versio = versio or version_activa()
+    threading.Thread(target=recarregar_model, args=(versio,), name="recarrega-model", daemon=True).start()
+    return {"carregant": versio, "en_servei": paquet and paquet.version}
+
+@admin_router.get("/cache")
+def estat_caches():
+    """ Mètriques de la cache de prediccions (encerts, agrupades, expulsions...) """
+    return {"predict_calle": cache_prediccions.metriques()}
+
+app.include_router(admin_router)
+
+
+class CapcaleraVersioModel:
+    """ Afegeix X-Versio-Model a totes les respostes: la del paquet usat o, si no n'hi ha, la del paquet en servei """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        async def enviar(missatge):
+            if missatge["type"] == "http.response.start":
+                versio = scope.get("state", {}).get("versio_model") or (paquet and paquet.version)
+                if versio:
+                    missatge["headers"] = [*missatge.get("headers", []), (b"x-versio-model", versio.encode())]
+            await send(missatge)
+
+        await self.app(scope, receive, enviar)
+
+app.add_middleware(CapcaleraVersioModel)
@@ -0,0 +1,260 @@
+# hotspot_service.py
+# =======================================================
+# Punts calents: graella + components connexes
+# =======================================================
+#
+# Cada accident cau en una cel·la d'uns 50 m (clau enter de la graella). Una
+# cel·la és "densa" quan hi ha com a mínim MIN_ACCIDENTS_CELLA accidents, i un
+# punt calent és un grup de cel·les denses veïnes (8-veïnatge), trobat amb
+# union-find. Tot és lineal en el nombre d'accidents.
+#
+# Afegir accidents (un a un o una partició sencera amb `ampliar`) només pot
+# fer créixer la densitat: una cel·la que passa a ser densa s'uneix amb les
+# seves veïnes denses i prou (no cal recalcular res). Els resums dels punts
+# calents es calculen quan es consulten, només sobre les cel·les denses, i es
+# memoritzen fins al següent canvi.
+#
+# L'índex es construeix per versió del dataset (CSV); quan la versió nova
+# només afegeix una partició, l'índex passa al dataset nou ampliat (vegeu
+# `Dataset.amb_particio`) en lloc de reconstruir-se. Els accidents afegits
+# per l'API viuen al magatzem, no als CSV: quan es reconstrueix l'índex (nova
+# versió) es tornen a afegir des del magatzem (`afegits`). Cada accident porta
+# el seu id i no es compta dues vegades.
+
+import threading
+from collections import Counter
+
+import numpy as np
+
+from data_service import COL_CARRER, COL_CAUSA
+
+MIDA_LAT = 0.00045     # ~50 m
+MIDA_LON = 0.0006      # ~50 m a la latitud de Barcelona
+MIN_ACCIDENTS_CELLA = 25
+MIN_ACCIDENTS_HOTSPOT = 40
+MAX_HOTSPOTS = 500       # límit d'una consulta de l'API
+VEINS = [(df, dc) for df in (-1, 0, 1) for dc in (-1, 0, 1) if (df, dc) != (0, 0)]
+
+
+def cella(lat, lon):
+    """(fila, columna) de la graella per a arrays o escalars."""
+    return np.floor(np.asarray(lat) / MIDA_LAT).astype(np.int64), np.floor(np.asarray(lon) / MIDA_LON).astype(np.int64)
+
+
+class Cella:
+    __slots__ = ("accidents", "suma_lat", "suma_lon", "causes", "carrers")
+
+    def __init__(self, n_causes):
+        self.accidents = 0
+        self.suma_lat = 0.0
+        self.suma_lon = 0.0
+        self.causes = np.zeros(n_causes, dtype=np.int32)
+        self.carrers = Counter()
+
+
+class IndexHotspots:
+    """Cel·les amb els seus comptes i union-find de les cel·les denses."""
+
+    def __init__(self, causes, versio=None):
+        self.causes = list(causes)
+        self._codi_causa = {c: i for i, c in enumerate(self.causes)}
+        self.versio = versio          # versió del dataset de partida
+        self.canvis = 0               # accidents afegits després
+        self._ids = set()             # ids dels accidents afegits (per no repetir-ne cap)
+        self.celles = {}              # (fila, columna) -> Cella
+        self._pare = {}               # només cel·les denses
+        self._resum = None
+        self._lock = threading.Lock()
+
+    # --- union-find ---
+    def _arrel(self, clau):
+        pare = self._pare
+        while pare[clau] != clau:
+            pare[clau] = pare[pare[clau]]
+            clau = pare[clau]
+        return clau
+
+    def _marcar_densa(self, clau):
+        self._pare[clau] = clau
+        fila, columna = clau
+        for df, dc in VEINS:
+            vei = (fila + df, columna + dc)
+            if vei in self._pare:
+                a, b = self._arrel(clau), self._arrel(vei)
+                if a != b:
+                    # l'arrel (i l'id del punt calent) és la cel·la mínima del grup: no depèn
+                    # de l'ordre d'unió, així un índex ampliat i un de reconstruït coincideixen
+                    self._pare[max(a, b)] = min(a, b)
+
+    # --- construcció i actualització ---
+    @classmethod
+    def des_de_df(cls, df, causes, versio=None):
+        """
+        Índex a partir del dataframe normalitzat. La densitat compta
+        expedients (un accident amb diversos conductors és un sol punt); les
+        causes compten tots els conductors.
+        """
+        index = cls(causes, versio)
+        index._acumular(df)
+        return index
+
+    def ampliar(self, df, versio, vistos=None):
+        """
+        Suma les files d'una partició nova (dataset ampliat) i retorna l'índex,
+        o None si porta causes que l'índex no coneix (cal reconstruir-lo).
+        `vistos`: files d'expedients que ja hi eren (compten causes, no densitat).
+        """
+        if COL_CAUSA in df.columns and not set(df[COL_CAUSA].dropna().unique()) <= self._codi_causa.keys():
+            return None
+        with self._lock:
+            self._acumular(df, vistos)
+            self.versio = versio
+            self._resum = None
+        return self
+
+    def _acumular(self, df, vistos=None):
+        """Suma les files a les cel·les (noves o existents) i marca les que passen a ser denses."""
+        lat, lon = df["Latitud"], df["Longitud"]
+        coords = (lat.notna() & lon.notna() & (lat != 0) & (lon != 0)).to_numpy()
+        if vistos is not None:
+            vistos = np.asarray(vistos)[coords]
+        df = df[coords]
+        if df.empty:
+            return
+
+        fila, columna = cella(df["Latitud"].to_numpy(), df["Longitud"].to_numpy())
+        claus = (fila << 32) + (columna & 0xFFFFFFFF)
+        uniques, inversa = np.unique(claus, return_inverse=True)
+        primera = ~df["Numero_expedient"].duplicated().to_numpy() if "Numero_expedient" in df.columns \
+            else np.ones(len(df), dtype=bool)
+        if vistos is not None:
+            primera &= ~vistos
+
+        n = len(uniques)
+        accidents = np.bincount(inversa, weights=primera, minlength=n).astype(np.int64)
+        suma_lat = np.bincount(inversa, weights=df["Latitud"].to_numpy() * primera, minlength=n)
+        suma_lon = np.bincount(inversa, weights=df["Longitud"].to_numpy() * primera, minlength=n)
+        codis = df[COL_CAUSA].map(self._codi_causa).fillna(-1).to_numpy(np.int64) if COL_CAUSA in df.columns \
+            else np.full(len(df), -1)
+        valides = codis >= 0
+        causes_cella = np.zeros((n, len(self.causes)), dtype=np.int32)
+        np.add.at(causes_cella, (inversa[valides], codis[valides]), 1)
+
+        files_u = (uniques >> 32).tolist()
+        columnes_u = (uniques & 0xFFFFFFFF).astype(np.uint32).astype(np.int32).tolist()
+        claus_celles = list(zip(files_u, columnes_u))
+        for i, clau in enumerate(claus_celles):
+            c = self.celles.get(clau)
+            if c is None:
+                c = self.celles[clau] = Cella(len(self.causes))
+            c.accidents += int(accidents[i])
+            c.suma_lat += float(suma_lat[i])
+            c.suma_lon += float(suma_lon[i])
+            c.causes += causes_cella[i]
+
+        if COL_CARRER in df.columns:
+            carrers = df[primera].assign(_i=inversa[primera]).groupby(["_i", COL_CARRER], observed=True).size()
+            for (i, carrer), compte in carrers.items():
+                self.celles[claus_celles[i]].carrers[carrer] += int(compte)
+
+        for clau in claus_celles:
+            if self.celles[clau].accidents >= MIN_ACCIDENTS_CELLA and clau not in self._pare:
+                self._marcar_densa(clau)
+
+    def afegir(self, lat, lon, causa=None, carrer=None, id=None):
+        """
+        Afegeix un accident; retorna l'identificador del punt calent on cau (o
+        None). Un `id` que ja s'ha afegit no torna a comptar.
+        """
+        if lat is None or lon is None:
+            return None
+        fila, columna = cella(lat, lon)
+        clau = (int(fila), int(columna))
+        with self._lock:
+            if id is not None:
+                if id in self._ids:
+                    return self._id_hotspot(self._arrel(clau)) if clau in self._pare else None
+                self._ids.add(id)
+            c = self.celles.get(clau)
+            if c is None:
+                c = self.celles[clau] = Cella(len(self.causes))
+            c.accidents += 1
+            c.suma_lat += lat
+            c.suma_lon += lon
+            if causa in self._codi_causa:
+                c.causes[self._codi_causa[causa]] += 1
+            if carrer:
+                c.carrers[carrer] += 1
+            if c.accidents >= MIN_ACCIDENTS_CELLA and clau not in self._pare:
+                self._marcar_densa(clau)
+            self.canvis += 1
+            self._resum = None
+            return self._id_hotspot(self._arrel(clau)) if clau in self._pare else None
+
+    # --- consulta ---
+    @staticmethod
+    def _id_hotspot(arrel):
+        return f"{arrel[0]}_{arrel[1]}"
+
+    def _resumir(self):
+        grups = {}
+        for clau in self._pare:
+            grups.setdefault(self._arrel(clau), []).append(clau)
+
+        hotspots = []
+        for arrel, claus in grups.items():
+            celles = [self.celles[k] for k in claus]
+            accidents = sum(c.accidents for c in celles)
+            if accidents < MIN_ACCIDENTS_HOTSPOT:
+                continue
+            causes = np.sum([c.causes for c in celles], axis=0)
+            carrers = sum((c.carrers for c in celles), Counter())
+            files = [k[0] for k in claus]
+            columnes = [k[1] for k in claus]
+            total_causes = max(int(causes.sum()), 1)
+            hotspots.append({
+                "id": self._id_hotspot(arrel),
+                "accidents": accidents,
+                "celles": len(claus),
+                "centre": [round(sum(c.suma_lat for c in celles) / accidents, 6),
+                           round(sum(c.suma_lon for c in celles) / accidents, 6)],
+                "bbox": [round(min(files) * MIDA_LAT, 6), round((max(files) + 1) * MIDA_LAT, 6),
+                         round(min(columnes) * MIDA_LON, 6), round((max(columnes) + 1) * MIDA_LON, 6)],
+                "carrers": [carrer for carrer, _ in sorted(carrers.items(), key=lambda kv: (-kv[1], kv[0]))[:3]],
+                "causes": [{"causa": self.causes[i], "percentatge": round(float(causes[i]) * 100 / total_causes, 1)}
+                           for i in sorted(np.flatnonzero(causes), key=lambda i: (-causes[i], self.causes[i]))[:3]],
+            })
+        # empats resolts per id i per nom: el resultat no depèn de l'ordre d'inserció
+        hotspots.sort(key=lambda h: (-h["accidents"], h["id"]))
+        return hotspots
+
+    def hotspots(self, bbox=None, limit=None):
+        """Punts calents ordenats per accidents, opcionalment dins d'una bbox (lat_min, lat_max, lon_min, lon_max)."""
+        with self._lock:
+            if self._resum is None:
+                self._resum = self._resumir()
+            resultat = self._resum
+        if bbox is not None:
+            lat_min, lat_max, lon_min, lon_max = bbox
+            resultat = [h for h in resultat
+                        if lat_min <= h["centre"][0] <= lat_max and lon_min <= h["centre"][1] <= lon_max]
+        return resultat[:limit] if limit else resultat
+
+
+def afegir_registres(index, registres):
+    """Afegeix accidents del magatzem (diccionaris amb id, Latitud, Longitud, Nom_carrer)."""
+    for r in registres:
+        index.afegir(r.get("Latitud"), r.get("Longitud"), carrer=r.get("Nom_carrer"), id=r.get("id"))
+
+
+# Un índex per versió del dataset (es guarda a la cache del `Dataset`).
+# `afegits`: funció que retorna els accidents afegits per l'API, que es
+# reprodueixen a l'índex nou perquè no es perdin en canviar de versió.
+def obtenir_hotspots(dataset, afegits=None):
+    if "hotspots" not in dataset._cache:
+        causes = dataset.comptes(COL_CAUSA).index if COL_CAUSA in dataset.df.columns else []
+        index = IndexHotspots.des_de_df(dataset.df, causes, dataset.versio)
+        if afegits is not None:
+            afegir_registres(index, afegits())
+        dataset._cache["hotspots"] = index
+    return dataset._cache["hotspots"]
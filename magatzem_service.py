@@ -0,0 +1,98 @@
+# magatzem_service.py
+# =======================================================
+# Magatzem d'accidents amb instantànies immutables
+# =======================================================
+#
+# Els accidents que serveix /data/accidents (els del dataset més els afegits
+# per l'API) es guarden en trossos columnars immutables. Cada escriptura
+# publica una `Instantania` nova (versió + tupla de trossos) substituint una
+# sola referència: els lectors agafen la instantània actual sense cap lock i
+# en tenen una vista coherent encara que s'hi afegeixin accidents mentre la
+# recorren.
+#
+# Copy-on-write: una instantània nova comparteix tots els trossos plens de
+# l'anterior i només copia l'últim (com a molt MIDA_TROS files), així que
+# afegir és O(MIDA_TROS) i no O(n). Els escriptors es serialitzen amb un
+# lock i poden afegir un lot sencer en una sola publicació.
+
+import threading
+
+COLUMNES_ACCIDENT = ("id", "Nk_Any", "Nom_districte", "Nom_carrer", "Latitud", "Longitud")
+MIDA_TROS = 512
+
+
+class Tros:
+    """Columnes (tuples) d'un bloc de com a molt MIDA_TROS accidents."""
+    __slots__ = ("columnes", "n")
+
+    def __init__(self, columnes):
+        self.columnes = columnes
+        self.n = len(columnes[COLUMNES_ACCIDENT[0]])
+
+    @classmethod
+    def des_de_registres(cls, registres):
+        return cls({col: tuple(r.get(col) for r in registres) for col in COLUMNES_ACCIDENT})
+
+    def amb(self, registres):
+        """Tros nou amb els registres afegits al final (aquest no es modifica)."""
+        return Tros({col: valors + tuple(r.get(col) for r in registres) for col, valors in self.columnes.items()})
+
+    def registres(self):
+        return [dict(zip(COLUMNES_ACCIDENT, fila)) for fila in zip(*(self.columnes[c] for c in COLUMNES_ACCIDENT))]
+
+
+class Instantania:
+    """Vista immutable del magatzem en una versió."""
+    __slots__ = ("versio", "trossos", "n")
+
+    def __init__(self, versio, trossos):
+        self.versio = versio
+        self.trossos = trossos
+        self.n = sum(t.n for t in trossos)
+
+    def __len__(self):
+        return self.n
+
+    def registres(self):
+        """Llista nova de diccionaris (el que en faci el cridador no afecta la instantània)."""
+        return [registre for tros in self.trossos for registre in tros.registres()]
+
+
+def _afegir_trossos(trossos, registres):
+    """Trossos resultants d'afegir `registres`: es reomple l'últim i se n'obren de nous."""
+    trossos = list(trossos)
+    if trossos and trossos[-1].n < MIDA_TROS:
+        espai = MIDA_TROS - trossos[-1].n
+        trossos[-1] = trossos[-1].amb(registres[:espai])
+        registres = registres[espai:]
+    for inici in range(0, len(registres), MIDA_TROS):
+        trossos.append(Tros.des_de_registres(registres[inici:inici + MIDA_TROS]))
+    return tuple(trossos)
+
+
+class MagatzemAccidents:
+    def __init__(self, registres=()):
+        self._lock = threading.Lock()
+        self._actual = Instantania(0, _afegir_trossos((), list(registres)))
+        self._inicials = self._actual.n
+
+    def instantania(self):
+        # Llegir una referència és atòmic: no cal lock
+        return self._actual
+
+    @property
+    def versio(self):
+        return self._actual.versio
+
+    def afegits(self):
+        """Registres afegits després de crear el magatzem (els que no surten dels CSV)."""
+        return self._actual.registres()[self._inicials:]
+
+    def afegir(self, *registres):
+        """Afegeix un lot d'accidents en una sola publicació; retorna la instantània nova."""
+        if not registres:
+            return self._actual
+        with self._lock:
+            actual = self._actual
+            self._actual = Instantania(actual.versio + 1, _afegir_trossos(actual.trossos, list(registres)))
+            return self._actual
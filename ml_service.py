@@ -1,73 +1,1017 @@
 # ml_service.py
+import copy
+import hashlib
+import json
+import os
 import pickle
+import shutil
+import tempfile
+import time
+import numpy as np
 import pandas as pd
 from pathlib import Path
 
-from sklearn.ensemble import RandomForestClassifier
-from sklearn.model_selection import train_test_split
+# sklearn se importa dentro de las funciones de entrenamiento y evaluación:
+# el servidor sólo necesita el modelo guardado (pickle) y arranca sin cargar
+# los módulos de entrenamiento.
+
+from data_service import (COL_DIA_CODI, COL_DISTRICTE, DATA_FOLDER, empremta_carpeta, llegir_csv_per_trossos,
+                          normalitzar, normalize_text_advanced, obtenir_dataset)
+from repositori_service import obtenir_repositori
 
 TARGET = "Descripcio_causa_mediata"
 COLUMNA_CALLE = "Nom_carrer"
+COLUMNA_EXPEDIENTE = "Numero_expedient"
 
 MODEL_PATH = Path("model/random_forest.pkl")
-CODIFICADORES_PATH = Path("model/codificadores.pkl")
-COLUMNS_PATH = Path("model/columns.pkl")
+PIPELINE_PATH = Path("model/pipeline.pkl")
+INFORME_COMPRESION_PATH = Path("model/informe_compresion.json")
+CANDIDATOS_PATH = Path("model/candidatos")
+CUBO_PATH = Path("model/cubo_probabilidades.npz")
+ALMACEN_PATH = Path("model/almacen")
+
+TAMANO_LOTE = 20000
+
+# Pérdida de precisión aceptada frente al bosque de referencia al elegir modelo
+TOLERANCIA_PRECISION = 0.005
+
+# =======================================================
+# Pipeline de features declarado
+# =======================================================
+#
+# El modelo sólo ve estas columnas. Quedan fuera los identificadores
+# (Numero_expedient, Codi_carrer; Num_postal sólo cuenta como dirección), los
+# duplicados de otra columna (nombres de distrito/barrio/mes, coordenadas UTM,
+# torno = f(hora)) y el propio objetivo.
+
+# columna -> dtype (los desconocidos se codifican como -1)
+FEATURES_NUMERICAS = {
+    "Codi_districte": "int16",
+    "Codi_barri": "int16",
+    "Nk_Any": "int16",
+    "Mes_any": "int8",
+    "Dia_mes": "int8",
+    COL_DIA_CODI: "int8",
+    "Hora_dia": "int8",
+    "Latitud": "float32",
+    "Longitud": "float32",
+}
+
+# Alta cardinalidad: frecuencia relativa de cada valor (o combinación de columnas)
+FEATURES_FRECUENCIA = {
+    f"{COLUMNA_CALLE}_freq": (COLUMNA_CALLE,),
+    "Direccion_freq": (COLUMNA_CALLE, "Num_postal"),
+}
+
+# ... y target encoding de la calle (una columna por causa)
+FEATURES_TARGET = (COLUMNA_CALLE,)
+
+SUAVIZADO_TARGET = 20    # peso (en accidentes) de la distribución global
+PLIEGUES_TARGET = 5      # target encoding fuera de pliegue al entrenar
+
+
+def _claves(df, columnas):
+    """Valor (o combinación 'a|b') de las columnas, '' si falta."""
+    claves = df[columnas[0]].fillna("") if columnas[0] in df.columns else pd.Series("", index=df.index)
+    for col in columnas[1:]:
+        claves = claves + "|" + (df[col].fillna("") if col in df.columns else "")
+    return claves.to_numpy()
+
+
+def _suavizar(cuenta, previa):
+    """Conteos valor x causa -> distribución suavizada hacia la global."""
+    n = cuenta.sum(axis=-1, keepdims=True)
+    return ((cuenta + SUAVIZADO_TARGET * previa) / (n + SUAVIZADO_TARGET)).astype(np.float32)
+
+
+def _tabla_target(claves, y, n_clases, previa):
+    """Distribución de causas suavizada por valor: (Index de valores, matriz)."""
+    codigos, valores = pd.factorize(claves)
+    cuenta = np.bincount(codigos * n_clases + y, minlength=len(valores) * n_clases)
+    return pd.Index(valores), _suavizar(cuenta.reshape(len(valores), n_clases), previa)
+
+
+class PipelineFeatures:
+    """Transforma las filas crudas (o normalizadas) en la matriz de features del modelo."""
+
+    def __init__(self):
+        self.etiquetas = None      # pd.Index de causas (código = posición)
+        self.previa = None         # distribución global de causas
+        self.frecuencias = {}      # feature -> pd.Series valor -> frecuencia relativa
+        self.target = {}           # col -> (pd.Index de valores, matriz valores x causas)
+        self.columnas = []
+
+    def _base(self, df):
+        if COL_DIA_CODI not in df.columns:
+            df = normalitzar(df)
+        X = pd.DataFrame(index=df.index)
+        for col, dtype in FEATURES_NUMERICAS.items():
+            valores = pd.to_numeric(df[col], errors="coerce") if col in df.columns else pd.Series(np.nan, index=df.index)
+            X[col] = valores.fillna(-1).astype(dtype)
+        return df, X
+
+    def _frecuencia(self, df, X):
+        for nombre, columnas in FEATURES_FRECUENCIA.items():
+            claves = pd.Series(_claves(df, columnas), index=df.index)
+            X[nombre] = claves.map(self.frecuencias[nombre]).fillna(0).astype(np.float32)
+
+    def _columnas_target(self, col):
+        return [f"{col}_te{i}" for i in range(len(self.etiquetas))]
+
+    def codificar_objetivo(self, serie):
+        """Código de cada causa (-1 si no está entre las etiquetas)."""
+        return self.etiquetas.get_indexer(serie)
+
+    def ajustar(self, df):
+        """
+        Aprende las codificaciones y devuelve (X, y) de entrenamiento. El target
+        encoding de cada fila se calcula sin la propia fila (fuera de pliegue).
+        """
+        df = df[df[TARGET].notna()]
+        df, X = self._base(df)
+        self.etiquetas = pd.Index(sorted(df[TARGET].unique()))
+        y = self.codificar_objetivo(df[TARGET])
+        n_clases = len(self.etiquetas)
+        self.previa = (np.bincount(y, minlength=n_clases) / len(y)).astype(np.float32)
+
+        for nombre, columnas in FEATURES_FRECUENCIA.items():
+            self.frecuencias[nombre] = pd.Series(_claves(df, columnas)).value_counts(normalize=True).astype(np.float32)
+        for col in FEATURES_TARGET:
+            self.target[col] = _tabla_target(_claves(df, (col,)), y, n_clases, self.previa)
+
+        self._frecuencia(df, X)
+        from sklearn.model_selection import KFold
+        for col in FEATURES_TARGET:
+            claves = _claves(df, (col,))
+            te = np.empty((len(df), n_clases), dtype=np.float32)
+            for entreno, fuera in KFold(PLIEGUES_TARGET, shuffle=True, random_state=42).split(claves):
+                valores, tabla = _tabla_target(claves[entreno], y[entreno], n_clases, self.previa)
+                te[fuera] = self._aplicar_target(claves[fuera], valores, tabla)
+            X[self._columnas_target(col)] = te
+
+        self.columnas = list(X.columns)
+        return X, pd.Series(y, index=X.index, name=TARGET)
+
+    def ajustar_conteos(self, clases, frecuencias, target):
+        """
+        Ajusta las codificaciones a partir de conteos ya acumulados (entrenamiento
+        por trozos): `clases` causa -> filas, `frecuencias` feature -> Serie
+        valor -> filas y `target` col -> (Index de valores, conteos valores x
+        causas en el orden de las etiquetas).
+        """
+        self.etiquetas = pd.Index(sorted(clases.index))
+        cuenta = clases.reindex(self.etiquetas).to_numpy(np.float64)
+        self.previa = (cuenta / cuenta.sum()).astype(np.float32)
+        self.frecuencias = {nombre: (c / c.sum()).astype(np.float32) for nombre, c in frecuencias.items()}
+        self.target = {col: (valores, _suavizar(conteos, self.previa)) for col, (valores, conteos) in target.items()}
+        self.columnas = list(FEATURES_NUMERICAS) + list(FEATURES_FRECUENCIA)
+        for col in FEATURES_TARGET:
+            self.columnas += self._columnas_target(col)
+
+    def _aplicar_target(self, claves, valores, tabla):
+        posiciones = valores.get_indexer(claves)
+        te = tabla[np.maximum(posiciones, 0)]
+        te[posiciones < 0] = self.previa
+        return te
+
+    def transformar(self, df):
+        """Matriz de features (mismas columnas y orden que en el entrenamiento)."""
+        df, X = self._base(df)
+        self._frecuencia(df, X)
+        for col in FEATURES_TARGET:
+            X[self._columnas_target(col)] = self._aplicar_target(_claves(df, (col,)), *self.target[col])
+        return X[self.columnas]
+
+
+# =======================================================
+# Datos, entrenamiento y carga
+# =======================================================
 
 def cargar_csvs():
-    carpeta = Path(__file__).parent / "data"
-    csv_files = list(carpeta.glob("*.csv"))
-    if not csv_files:
+    """Dataset normalizado, leído a través del repositorio (pandas o SQLite, ver repositori_service)."""
+    df = obtenir_repositori().accidents()
+    if df.empty:
         raise RuntimeError("No se encontraron CSV en /data")
-    return pd.concat((pd.read_csv(f) for f in csv_files), ignore_index=True)
+    return df
 
 def preparar_dataset(df):
-    df = df.fillna("NA")
-    codificadores = {}
-    df_encoded = df.copy()
-
-    for col in df.columns:
-        if df[col].dtype == "object":
-            df_encoded[col] = df[col].astype("category")
-            codificadores[col] = df_encoded[col].cat.categories
-            df_encoded[col] = df_encoded[col].cat.codes
-
-    X = df_encoded.drop(columns=[TARGET])
-    y = df_encoded[TARGET]
+    pipeline = PipelineFeatures()
+    X, y = pipeline.ajustar(df)
+    return X, y, pipeline
 
-    return X, y, codificadores
+def dividir_por_expediente(df, test_size=0.25):
+    """
+    Índices (train, test) sin repartir un mismo expediente entre los dos lados:
+    un accidente con varios conductores aparece en varias filas.
+    """
+    grupos = df[COLUMNA_EXPEDIENTE].fillna("").to_numpy() if COLUMNA_EXPEDIENTE in df.columns else np.arange(len(df))
+    from sklearn.model_selection import GroupShuffleSplit
+    separador = GroupShuffleSplit(n_splits=1, test_size=test_size, random_state=42)
+    return next(separador.split(df, groups=grupos))
 
 def entrenar_modelo():
-    df = cargar_csvs()
-    X, y, codificadores = preparar_dataset(df)
+    almacen = obtener_almacen()
+    from sklearn.ensemble import RandomForestClassifier
+    pipeline = almacen.pipeline
+    # min_samples_leaf=5: la mitad de nodos que con hojas de 1 fila y la misma precisión
+    # (model/informe_features.json); sin él el bosque crecía de 782 a 882 MB con el pipeline
+    model = RandomForestClassifier(n_estimators=300, max_depth=16, min_samples_leaf=5, random_state=42)
+    model.fit(almacen.como_df(almacen.X_entreno), almacen.y_entreno)
 
-    X_train, X_test, y_train, y_test = train_test_split(
-        X, y, test_size=0.25, random_state=42, stratify=y
-    )
-
-    model = RandomForestClassifier(n_estimators=300, max_depth=16, random_state=42)
-    model.fit(X_train, y_train)
+    precision = model.score(almacen.como_df(almacen.X_prueba), almacen.y_prueba)
+    print(f"Precisión en prueba: {precision:.3f}")
 
     # guardar
     MODEL_PATH.parent.mkdir(exist_ok=True)
     pickle.dump(model, open(MODEL_PATH, "wb"))
-    pickle.dump(codificadores, open(CODIFICADORES_PATH, "wb"))
-    pickle.dump(list(X.columns), open(COLUMNS_PATH, "wb"))
+    pickle.dump(pipeline, open(PIPELINE_PATH, "wb"))
+    construir_cubo(model, pipeline, cargar_csvs())
+    publicar_paquete(MODEL_PATH)
 
     print("Modelo guardado correctamente")
 
-def cargar_modelo():
-    model = pickle.load(open(MODEL_PATH, "rb"))
-    codificadores = pickle.load(open(CODIFICADORES_PATH, "rb"))
-    columns = pickle.load(open(COLUMNS_PATH, "rb"))
-    return model, codificadores, columns
+def ruta_modelo_seleccionado():
+    """Artefacto marcado como seleccionado en el informe de compresión (o el bosque original)."""
+    # Un bosque reentrenado después del informe deja obsoletos sus candidatos
+    vigente = INFORME_COMPRESION_PATH.exists() and (
+        not MODEL_PATH.exists() or INFORME_COMPRESION_PATH.stat().st_mtime >= MODEL_PATH.stat().st_mtime)
+    if vigente:
+        informe = json.loads(INFORME_COMPRESION_PATH.read_text(encoding="utf-8"))
+        for candidato in informe["candidatos"]:
+            if candidato["nombre"] == informe["seleccionado"] and Path(candidato["artefacto"]).exists():
+                return Path(candidato["artefacto"])
+    return MODEL_PATH
+
+def ruta_pipeline_de(ruta_modelo):
+    """Pipeline con el que se ajustó el modelo: el de la compresión para los candidatos."""
+    ruta_modelo = Path(ruta_modelo)
+    if ruta_modelo.parent == CANDIDATOS_PATH and (CANDIDATOS_PATH / "pipeline.pkl").exists():
+        return CANDIDATOS_PATH / "pipeline.pkl"
+    return PIPELINE_PATH
+
+def cargar_modelo(version=None):
+    """
+    Modelo y pipeline del paquete `version` (por defecto el activo): los
+    scripts offline usan el mismo modelo que sirve la API, también después de
+    activar otra versión o volver atrás.
+    """
+    paquete = cargar_paquete(version)
+    return paquete.model, paquete.pipeline
+
+def predecir_por_lotes(model, X):
+    """`predict_proba` por lotes para limitar la memoria."""
+    return np.vstack([model.predict_proba(X.iloc[i:i + TAMANO_LOTE]) for i in range(0, len(X), TAMANO_LOTE)])
 
 def filtrar_calle(df, calle):
     return df[df[COLUMNA_CALLE].str.contains(calle, case=False, na=False)]
 
-def codificar_df(df, codificadores):
-    df_encoded = df.copy()
-    for col in df.columns:
-        if col in codificadores:
-            cats = codificadores[col].tolist()
-            df_encoded[col] = df[col].apply(lambda x: cats.index(x) if x in cats else -1)
-    return df_encoded
+def filas_calle(calle):
+    """Como filtrar_calle, pero consultando el repositorio (con SQLite va por el índice de calles)."""
+    return obtenir_repositori().files_carrer(calle)
+
+
+# =======================================================
+# Almacén de features (memoria mapeada)
+# =======================================================
+#
+# La codificación del dataset se hace una sola vez por versión de la carpeta
+# de datos (empremta de data_service) y se guarda en model/almacen/<versión>/:
+#   X.npy (float32, filas de entrenamiento primero y después las de prueba),
+#   y.npy, calle.npy (código de la calle de cada fila), pipeline.pkl y
+#   meta.json. Entrenar, comparar modelos o evaluar sólo mapean los ficheros:
+#   empiezan en milisegundos y los procesos paralelos comparten las páginas.
+
+class AlmacenFeatures:
+    """Matriz codificada de una versión del dataset, mapeada en memoria."""
+
+    def __init__(self, carpeta):
+        carpeta = Path(carpeta)
+        self.meta = json.loads((carpeta / "meta.json").read_text(encoding="utf-8"))
+        self.X = np.load(carpeta / "X.npy", mmap_mode="r")
+        self.y = np.load(carpeta / "y.npy", mmap_mode="r")
+        self.calle = np.load(carpeta / "calle.npy", mmap_mode="r")
+        self.calles = self.meta["calles"]
+        self.pipeline = pickle.load(open(carpeta / "pipeline.pkl", "rb"))
+        self.pipeline.almacen = self.meta["versio"]     # viaja con el pipeline: empareja modelo y datos
+        self.columnas = self.meta["columnas"]
+        self.n_entreno = self.meta["filas_entreno"]
+
+    @property
+    def versio(self):
+        return self.meta["versio"]
+
+    # Vistas sobre el fichero mapeado (no copian)
+    @property
+    def X_entreno(self):
+        return self.X[:self.n_entreno]
+
+    @property
+    def y_entreno(self):
+        return self.y[:self.n_entreno]
+
+    @property
+    def X_prueba(self):
+        return self.X[self.n_entreno:]
+
+    @property
+    def y_prueba(self):
+        return self.y[self.n_entreno:]
+
+    def como_df(self, X):
+        """DataFrame sobre la misma memoria, con los nombres de las features."""
+        return pd.DataFrame(X, columns=self.columnas, copy=False)
+
+
+def construir_almacen(dataset, path=ALMACEN_PATH):
+    """Codifica el dataset y escribe los ficheros del almacén (escritura atómica)."""
+    df = dataset.df[dataset.df[TARGET].notna()].reset_index(drop=True)
+    entreno, prueba = dividir_por_expediente(df)
+    X_train, y_train, pipeline = preparar_dataset(df.iloc[entreno])
+    X_prueba = pipeline.transformar(df.iloc[prueba])
+
+    destino = path / dataset.versio
+    # Carpeta temporal propia: dos procesos pueden construir la misma versión a la vez
+    path.mkdir(parents=True, exist_ok=True)
+    temporal = Path(tempfile.mkdtemp(prefix=f".{dataset.versio}.", suffix=".tmp", dir=path))
+    np.save(temporal / "X.npy", np.vstack([X_train.to_numpy(np.float32), X_prueba.to_numpy(np.float32)]))
+    np.save(temporal / "y.npy", np.concatenate([y_train.to_numpy(), pipeline.codificar_objetivo(df[TARGET].iloc[prueba])]).astype(np.int16))
+    codigos, calles = pd.factorize(df[COLUMNA_CALLE].iloc[np.concatenate([entreno, prueba])])
+    np.save(temporal / "calle.npy", codigos.astype(np.int16))
+    pickle.dump(pipeline, open(temporal / "pipeline.pkl", "wb"))
+    meta = {
+        "versio": dataset.versio,
+        "columnas": pipeline.columnas,
+        "etiquetas": pipeline.etiquetas.tolist(),
+        "filas_entreno": int(len(entreno)),
+        "filas_prueba": int(len(prueba)),
+        "calles": calles.tolist(),
+        "creado": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+    (temporal / "meta.json").write_text(json.dumps(meta, ensure_ascii=False, indent=2), encoding="utf-8")
+    try:
+        temporal.rename(destino)
+    except OSError:
+        # otro proceso ha publicado la misma versión antes: se usa la suya
+        shutil.rmtree(temporal, ignore_errors=True)
+        if not (destino / "meta.json").exists():
+            raise
+
+    # Las versiones anteriores ya no se usan
+    for anterior in path.iterdir():
+        if anterior.is_dir() and anterior != destino and not anterior.name.startswith("."):
+            shutil.rmtree(anterior, ignore_errors=True)
+    return destino
+
+
+def obtener_almacen(path=ALMACEN_PATH):
+    """
+    Almacén de la versión actual de los datos. Si ya existe no se lee ningún
+    CSV (la versión es la empremta de la carpeta); si no, se construye.
+    """
+    carpeta = path / empremta_carpeta()
+    if not (carpeta / "meta.json").exists():
+        dataset = obtenir_dataset()
+        if dataset.buit:
+            raise RuntimeError("No se encontraron CSV en /data")
+        carpeta = construir_almacen(dataset, path)
+    return AlmacenFeatures(carpeta)
+
+
+# =======================================================
+# Entrenamiento por trozos (out-of-core)
+# =======================================================
+#
+# Para históricos que no caben en memoria (varias ciudades o décadas). Los
+# CSV se leen por trozos de `tamano` filas y nunca se concatenan:
+#   1.ª pasada: conteos (causas, frecuencias, calle x causa por pliegue) y una
+#               fila ancla por causa; ocupan según la cardinalidad, no las filas.
+#   2.ª pasada: cada trozo codificado añade al bosque (warm_start) una parte de
+#               los árboles proporcional a sus filas.
+#   3.ª pasada: precisión sobre los expedientes de prueba.
+# La partición entreno/prueba y los pliegues del target encoding salen de un
+# hash del expediente, así que no hace falta ver todas las filas a la vez.
+
+TAMANO_TROZO = 20000
+ARBOLES_TROZOS = 100
+
+def nuevo_bosque_trozos():
+    """Mismos hiperparámetros que el candidato comprimido rf_100_hoja20."""
+    from sklearn.ensemble import RandomForestClassifier
+    return RandomForestClassifier(n_estimators=0, max_depth=16, min_samples_leaf=20,
+                                  warm_start=True, random_state=42)
+
+def _iterar_trozos(carpeta, tamano):
+    """
+    Trozos de unas `tamano` filas con causa conocida. Cada trozo toma una parte
+    de cada CSV (por turnos), así cada lote de árboles ve todos los años y
+    fuentes y no sólo el fichero que toque.
+    """
+    rutas = sorted(Path(carpeta).glob("*.csv"))
+    if not rutas:
+        raise RuntimeError(f"No se encontraron CSV en {carpeta}")
+    lectores = [llegir_csv_per_trossos(ruta, max(1, tamano // len(rutas))) for ruta in rutas]
+    while lectores:
+        partes, activos = [], []
+        for lector in lectores:
+            parte = next(lector, None)
+            if parte is not None:
+                partes.append(parte[parte[TARGET].notna()])
+                activos.append(lector)
+        lectores = activos
+        if partes:
+            yield pd.concat(partes, ignore_index=True)
+
+def particion_hash(df):
+    """(es_prueba, pliegue) de cada fila según el hash del expediente (25 % prueba)."""
+    grupos = df[COLUMNA_EXPEDIENTE].fillna("") if COLUMNA_EXPEDIENTE in df.columns else df
+    h = pd.util.hash_pandas_object(grupos, index=False).to_numpy()
+    return h % 4 == 0, (h // 4 % PLIEGUES_TARGET).astype(np.intp)
+
+def _sumar(acumulado, nuevo):
+    return nuevo if acumulado is None else acumulado.add(nuevo, fill_value=0)
+
+def _contar_trozos(carpeta, tamano):
+    """1.ª pasada: conteos de las filas de entrenamiento y una fila ancla por causa."""
+    clases, frecuencias, target, anclas = None, dict.fromkeys(FEATURES_FRECUENCIA), dict.fromkeys(FEATURES_TARGET), {}
+    filas = filas_prueba = 0
+    for trozo in _iterar_trozos(carpeta, tamano):
+        es_prueba, pliegue = particion_hash(trozo)
+        filas += len(trozo)
+        filas_prueba += int(es_prueba.sum())
+        entreno, pliegue = trozo[~es_prueba], pliegue[~es_prueba]
+
+        clases = _sumar(clases, entreno[TARGET].value_counts())
+        for nombre, columnas in FEATURES_FRECUENCIA.items():
+            frecuencias[nombre] = _sumar(frecuencias[nombre], pd.Series(_claves(entreno, columnas)).value_counts())
+        for col in FEATURES_TARGET:
+            conteo = pd.DataFrame({"pliegue": pliegue, "clave": _claves(entreno, (col,)),
+                                   "causa": entreno[TARGET].to_numpy()}).value_counts()
+            target[col] = _sumar(target[col], conteo)
+        for causa, fila in entreno.groupby(TARGET).head(1).groupby(TARGET):
+            anclas.setdefault(causa, fila)
+    return clases, frecuencias, target, list(anclas.values()), filas, filas_prueba
+
+def _conteos_por_pliegue(conteo, etiquetas):
+    """Serie (pliegue, clave, causa) -> (Index de claves, matriz pliegues x claves x causas)."""
+    valores = pd.Index(conteo.index.get_level_values("clave").unique())
+    matriz = np.zeros((PLIEGUES_TARGET, len(valores), len(etiquetas)))
+    np.add.at(matriz, (conteo.index.get_level_values("pliegue").to_numpy(),
+                       valores.get_indexer(conteo.index.get_level_values("clave")),
+                       etiquetas.get_indexer(conteo.index.get_level_values("causa"))), conteo.to_numpy())
+    return valores, matriz
+
+def entrenar_por_trozos(carpeta=DATA_FOLDER, tamano=TAMANO_TROZO):
+    """
+    Entrena el bosque sin cargar nunca más de un trozo de filas. Devuelve
+    (model, pipeline, resumen) con filas, trozos, árboles y precisión.
+    """
+    inicio = time.perf_counter()
+    clases, frecuencias, target, anclas, filas, filas_prueba = _contar_trozos(carpeta, tamano)
+    if clases is None:
+        raise RuntimeError(f"No se encontraron CSV en {carpeta}")
+
+    etiquetas = pd.Index(sorted(clases.index))
+    por_pliegue = {col: _conteos_por_pliegue(target[col], etiquetas) for col in FEATURES_TARGET}
+    pipeline = PipelineFeatures()
+    pipeline.ajustar_conteos(clases, frecuencias, {col: (v, m.sum(axis=0)) for col, (v, m) in por_pliegue.items()})
+
+    # Las anclas (peso 0) garantizan que cada lote de árboles ve todas las causas
+    anclas = pd.concat(anclas)
+    X_anclas = pipeline.transformar(anclas)
+    y_anclas = pipeline.codificar_objetivo(anclas[TARGET])
+    peso_anclas = np.zeros(len(anclas))
+
+    model = nuevo_bosque_trozos()
+    filas_entreno = filas - filas_prueba
+    trozos = 0
+    for trozo in _iterar_trozos(carpeta, tamano):
+        es_prueba, pliegue = particion_hash(trozo)
+        entreno, pliegue = trozo[~es_prueba], pliegue[~es_prueba]
+        if entreno.empty:
+            continue
+        X = pipeline.transformar(entreno)
+        for col in FEATURES_TARGET:
+            # Target encoding fuera de pliegue: conteos totales menos los del propio pliegue
+            valores, matriz = por_pliegue[col]
+            i = valores.get_indexer(_claves(entreno, (col,)))
+            X[pipeline._columnas_target(col)] = _suavizar(matriz.sum(axis=0)[i] - matriz[pliegue, i], pipeline.previa)
+
+        model.n_estimators += max(1, round(ARBOLES_TROZOS * len(entreno) / filas_entreno))
+        model.fit(pd.concat([X, X_anclas]), np.concatenate([pipeline.codificar_objetivo(entreno[TARGET]), y_anclas]),
+                  sample_weight=np.concatenate([np.ones(len(X)), peso_anclas]))
+        trozos += 1
+
+    aciertos = 0
+    for trozo in _iterar_trozos(carpeta, tamano):
+        prueba = trozo[particion_hash(trozo)[0]]
+        if len(prueba):
+            aciertos += int((model.predict(pipeline.transformar(prueba)) == pipeline.codificar_objetivo(prueba[TARGET])).sum())
+
+    resumen = {
+        "filas": filas,
+        "filas_prueba": filas_prueba,
+        "trozos": trozos,
+        "arboles": model.n_estimators,
+        "precision": round(aciertos / max(filas_prueba, 1), 4),
+        "segundos": round(time.perf_counter() - inicio, 1),
+    }
+    return model, pipeline, resumen
+
+def entrenar_modelo_por_trozos(carpeta=DATA_FOLDER, tamano=TAMANO_TROZO):
+    model, pipeline, resumen = entrenar_por_trozos(carpeta, tamano)
+    print(f"Precisión en prueba: {resumen['precision']:.3f} ({resumen['trozos']} trozos, {resumen['arboles']} árboles)")
+
+    MODEL_PATH.parent.mkdir(exist_ok=True)
+    pickle.dump(model, open(MODEL_PATH, "wb"))
+    pickle.dump(pipeline, open(PIPELINE_PATH, "wb"))
+    # El cubo de /predict se calcula sobre el dataset en memoria (entrenar_modelo / comprimir_modelo)
+    print("Modelo guardado correctamente")
+    publicar_paquete(MODEL_PATH)
+
+
+# =======================================================
+# Compresión del modelo de servicio
+# =======================================================
+
+def _podar_arboles(model, n):
+    """Bosque con sólo los `n` primeros árboles (los árboles son independientes)."""
+    podado = copy.copy(model)
+    podado.estimators_ = model.estimators_[:n]
+    podado.n_estimators = n
+    return podado
+
+def _candidatos(referencia, X, y):
+    """(nombre, descripción, función que devuelve el modelo) de cada punto de la curva."""
+    from sklearn.ensemble import HistGradientBoostingClassifier, RandomForestClassifier
+    yield "rf_300_p16", "bosque de referencia (300 árboles, profundidad 16, min_samples_leaf=5)", lambda: referencia
+    for n in (100, 50, 25):
+        yield f"rf_{n}_p16", f"bosque de referencia podado a {n} árboles", lambda n=n: _podar_arboles(referencia, n)
+    yield "rf_100_hoja20", "100 árboles, profundidad 16, min_samples_leaf=20", lambda: RandomForestClassifier(
+        n_estimators=100, max_depth=16, min_samples_leaf=20, random_state=42).fit(X, y)
+    yield "rf_100_p10", "100 árboles, profundidad 10", lambda: RandomForestClassifier(
+        n_estimators=100, max_depth=10, random_state=42).fit(X, y)
+    yield "hgb", "HistGradientBoosting (31 hojas, early stopping)", lambda: HistGradientBoostingClassifier(
+        max_iter=300, learning_rate=0.1, max_leaf_nodes=31, early_stopping=True, random_state=42).fit(X, y)
+
+def _top3(model, X_calle):
+    return set(np.argsort(model.predict_proba(X_calle).mean(axis=0))[::-1][:3].tolist())
+
+def _evaluar(ruta, X_prueba, y_prueba, X_calle, top3_referencia, n_clases):
+    """Tamaño, carga, latencias y calidad de un artefacto guardado."""
+    from sklearn.metrics import accuracy_score, log_loss
+    inicio = time.perf_counter()
+    model = pickle.load(open(ruta, "rb"))
+    carga = time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    probas = model.predict_proba(X_prueba)
+    lote = time.perf_counter() - inicio
+
+    tiempos = []
+    for _ in range(20):
+        inicio = time.perf_counter()
+        model.predict_proba(X_calle)
+        tiempos.append(time.perf_counter() - inicio)
+
+    return {
+        "tamano_mb": round(ruta.stat().st_size / 1e6, 2),
+        "carga_s": round(carga, 2),
+        "inferencia_lote_ms_por_1000": round(lote * 1e6 / len(X_prueba), 2),
+        "inferencia_calle_ms": round(float(np.median(tiempos)) * 1000, 1),
+        "precision": round(accuracy_score(y_prueba, model.classes_[probas.argmax(axis=1)]), 4),
+        "log_loss": round(log_loss(y_prueba, probas, labels=range(n_clases)), 4),
+        # ¿/predict_calle devolvería las mismas 3 causas que el bosque de referencia?
+        "top3_igual_referencia": _top3(model, X_calle) == top3_referencia,
+    }
+
+def comprimir_modelo():
+    """
+    Genera los candidatos comprimidos a partir del bosque entrenado, los evalúa
+    sobre los mismos expedientes de prueba y escribe el informe. Se selecciona
+    el candidato más rápido (y después el más pequeño) que no pierde más de
+    TOLERANCIA_PRECISION de precisión y mantiene el top 3 de la referencia;
+    para elegir otro punto de la curva basta con cambiar "seleccionado".
+    """
+    almacen = obtener_almacen()
+    pipeline = almacen.pipeline
+    # Los candidatos se ajustan con el pipeline del almacén: el bosque de
+    # referencia (y su pipeline.pkl) tiene que venir del mismo almacén
+    if getattr(pickle.load(open(PIPELINE_PATH, "rb")), "almacen", None) != almacen.versio:
+        raise RuntimeError("El bosque de referencia es de otra versión de los datos: ejecuta entrenar_modelo.py")
+    referencia = pickle.load(open(MODEL_PATH, "rb"))
+    X_train, y_train = almacen.como_df(almacen.X_entreno), almacen.y_entreno
+    X_prueba, y_prueba = almacen.como_df(almacen.X_prueba), almacen.y_prueba
+
+    codigos = almacen.calle[almacen.n_entreno:]
+    codigo = np.bincount(codigos[codigos >= 0]).argmax()
+    calle = almacen.calles[codigo]
+    X_calle = X_prueba[codigos == codigo]
+
+    CANDIDATOS_PATH.mkdir(parents=True, exist_ok=True)
+    pickle.dump(pipeline, open(CANDIDATOS_PATH / "pipeline.pkl", "wb"))
+    resultados = []
+    top3_referencia = _top3(referencia, X_calle)
+    for nombre, descripcion, fabricar in _candidatos(referencia, X_train, y_train):
+        inicio = time.perf_counter()
+        model = fabricar()
+        entrenamiento = time.perf_counter() - inicio
+        ruta = MODEL_PATH if model is referencia else CANDIDATOS_PATH / f"{nombre}.pkl"
+        if model is not referencia:
+            pickle.dump(model, open(ruta, "wb"))
+
+        resultado = {"nombre": nombre, "descripcion": descripcion, "artefacto": str(ruta),
+                     "entrenamiento_s": round(entrenamiento, 1)}
+        resultado.update(_evaluar(ruta, X_prueba, y_prueba, X_calle, top3_referencia, len(pipeline.etiquetas)))
+        resultados.append(resultado)
+        print(f"{nombre:14s} {resultado['tamano_mb']:>9.2f} MB  precisión {resultado['precision']:.4f}  "
+              f"calle {resultado['inferencia_calle_ms']:>6.1f} ms")
+
+    minima = resultados[0]["precision"] - TOLERANCIA_PRECISION
+    aceptables = [r for r in resultados if r["precision"] >= minima and r["top3_igual_referencia"]]
+    seleccionado = min(aceptables, key=lambda r: (r["inferencia_calle_ms"], r["tamano_mb"]))
+
+    informe = {
+        "referencia": resultados[0]["nombre"],
+        "tolerancia_precision": TOLERANCIA_PRECISION,
+        "calle_latencia": calle,
+        "filas_calle": int(len(X_calle)),
+        "filas_prueba": int(len(X_prueba)),
+        "seleccionado": seleccionado["nombre"],
+        "almacen": almacen.versio,
+        "pipeline": str(CANDIDATOS_PATH / "pipeline.pkl"),
+        "candidatos": resultados,
+    }
+    INFORME_COMPRESION_PATH.write_text(json.dumps(informe, ensure_ascii=False, indent=2), encoding="utf-8")
+
+    # El cubo de /predict tiene que salir del modelo que se va a servir
+    construir_cubo(pickle.load(open(seleccionado["artefacto"], "rb")), pipeline, cargar_csvs())
+    publicar_paquete(seleccionado["artefacto"], ruta_pipeline=CANDIDATOS_PATH / "pipeline.pkl")
+    return informe
+
+
+# =======================================================
+# Informe de evaluación (sin pantalla)
+# =======================================================
+#
+# Se predice una sola vez sobre las filas de prueba del almacén; de esas
+# probabilidades salen la matriz de confusión, el classification report y la
+# precisión base de la importancia por permutación (una tarea por feature, en
+# hilos que comparten el modelo). Los gráficos usan el backend Agg, así que
+# funciona en nodos sin pantalla. Resultado en carpeta/: informe.json,
+# matriz_confusion.png, importancias.png e informe.html.
+
+EVALUACION_PATH = Path("model/evaluacion")
+REPETICIONES_PERMUTACION = 5
+MUESTRA_PERMUTACION = 5000
+
+def _precision_permutada(model, X, y, columna, repeticiones, semilla):
+    """Precisiones con la columna `columna` barajada (copia propia de X)."""
+    from sklearn.metrics import accuracy_score
+    rng = np.random.default_rng(semilla)
+    X = X.copy()
+    original = X[columna].to_numpy()
+    precisiones = []
+    for _ in range(repeticiones):
+        X[columna] = rng.permutation(original)
+        precisiones.append(accuracy_score(y, model.predict(X)))
+    return precisiones
+
+def _grafico_confusion(plt, sns, matriz, etiquetas, ruta):
+    figura = plt.figure(figsize=(16, 11))
+    sns.heatmap(matriz, annot=True, fmt="d", cmap="Blues",
+                xticklabels=etiquetas, yticklabels=etiquetas, annot_kws={"size": 9})
+    plt.ylabel("Etiqueta Real", fontsize=12, fontweight="bold")
+    plt.xlabel("Etiqueta Predicha", fontsize=12, fontweight="bold")
+    plt.title("Matriz de Confusión", fontsize=14, pad=20)
+    plt.xticks(rotation=45, ha="right", rotation_mode="anchor", fontsize=10)
+    plt.yticks(fontsize=10)
+    plt.subplots_adjust(bottom=0.30, left=0.20)
+    figura.savefig(ruta, dpi=100)
+    plt.close(figura)
+
+def _grafico_importancias(plt, importancias, ruta):
+    columnas = [c for c in ("impureza", "permutacion") if c in importancias.columns]
+    figura, ejes = plt.subplots(1, len(columnas), figsize=(7 * len(columnas), 8), squeeze=False)
+    for eje, columna in zip(ejes[0], columnas):
+        importancias[columna].sort_values().plot.barh(ax=eje, xerr=importancias.get(f"{columna}_std"))
+        eje.set_title(f"Importancia ({columna})")
+    figura.tight_layout()
+    figura.savefig(ruta, dpi=100)
+    plt.close(figura)
+
+def evaluar_modelo(model, almacen, carpeta=EVALUACION_PATH, nombre="modelo"):
+    """Escribe el informe de evaluación de `model` sobre la prueba del almacén."""
+    # Import tardío: el servidor importa ml_service y no necesita matplotlib
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+    from joblib import Parallel, delayed
+    from sklearn.metrics import accuracy_score, classification_report, confusion_matrix, log_loss
+
+    carpeta = Path(carpeta)
+    carpeta.mkdir(parents=True, exist_ok=True)
+    etiquetas = list(almacen.pipeline.etiquetas)
+    X_prueba, y_prueba = almacen.como_df(almacen.X_prueba), np.asarray(almacen.y_prueba)
+
+    inicio = time.perf_counter()
+    probas = np.zeros((len(X_prueba), len(etiquetas)))
+    probas[:, model.classes_] = predecir_por_lotes(model, X_prueba)
+    y_pred = probas.argmax(axis=1)
+    prediccion = time.perf_counter() - inicio
+
+    matriz = confusion_matrix(y_prueba, y_pred, labels=range(len(etiquetas)))
+    reporte = classification_report(y_prueba, y_pred, labels=range(len(etiquetas)), target_names=etiquetas,
+                                    output_dict=True, zero_division=0)
+
+    importancias = pd.DataFrame(index=almacen.columnas)
+    if hasattr(model, "feature_importances_"):
+        importancias["impureza"] = model.feature_importances_
+
+    # Permutación sobre una muestra fija; la precisión base sale de y_pred
+    inicio = time.perf_counter()
+    muestra = np.random.default_rng(42).permutation(len(X_prueba))[:MUESTRA_PERMUTACION]
+    muestra.sort()
+    X_muestra = X_prueba.iloc[muestra].copy()
+    base = accuracy_score(y_prueba[muestra], y_pred[muestra])
+    precisiones = Parallel(n_jobs=-1, prefer="threads")(
+        delayed(_precision_permutada)(model, X_muestra, y_prueba[muestra], columna, REPETICIONES_PERMUTACION, i)
+        for i, columna in enumerate(almacen.columnas))
+    caidas = base - np.array(precisiones)
+    importancias["permutacion"] = caidas.mean(axis=1)
+    importancias["permutacion_std"] = caidas.std(axis=1)
+    permutacion = time.perf_counter() - inicio
+
+    _grafico_confusion(plt, sns, matriz, etiquetas, carpeta / "matriz_confusion.png")
+    _grafico_importancias(plt, importancias, carpeta / "importancias.png")
+
+    informe = {
+        "modelo": nombre,
+        "versio_almacen": almacen.versio,
+        "filas_prueba": int(len(y_prueba)),
+        "precision": round(float(reporte["accuracy"]), 4),
+        "log_loss": round(log_loss(y_prueba, probas, labels=range(len(etiquetas))), 4),
+        "prediccion_s": round(prediccion, 2),
+        "permutacion_s": round(permutacion, 2),
+        "filas_permutacion": int(len(muestra)),
+        "etiquetas": etiquetas,
+        "matriz_confusion": matriz.tolist(),
+        "classification_report": reporte,
+        "importancias": importancias.round(5).to_dict(orient="index"),
+    }
+    (carpeta / "informe.json").write_text(json.dumps(informe, ensure_ascii=False, indent=2), encoding="utf-8")
+
+    tabla = pd.DataFrame(reporte).T.drop(index="accuracy").round(3)
+    (carpeta / "informe.html").write_text(f"""<!DOCTYPE html>
+<html lang="es"><head><meta charset="utf-8"><title>Evaluación – {nombre}</title></head>
+<body>
+<h1>Evaluación – {nombre}</h1>
+<p>Almacén {almacen.versio} · {len(y_prueba)} filas de prueba ·
+precisión {informe["precision"]} · log loss {informe["log_loss"]}</p>
+<h2>Classification report</h2>
+{tabla.to_html()}
+<h2>Matriz de confusión</h2>
+<img src="matriz_confusion.png" alt="Matriz de confusión">
+<h2>Importancia de variables</h2>
+<img src="importancias.png" alt="Importancia de variables">
+{importancias.sort_values("permutacion", ascending=False).round(4).to_html()}
+</body></html>
+""", encoding="utf-8")
+    return informe
+
+
+# =======================================================
+# Cubo de probabilidades (calle × día × franja horaria)
+# =======================================================
+#
+# /predict responde desde un cubo calculado al entrenar: para cada calle con
+# suficientes accidentes se toman hasta MUESTRAS_CALLE filas históricas (su
+# contexto: distrito, barrio, coordenadas...), se fijan el día y la hora
+# central de cada franja y se promedian las probabilidades del modelo.
+# Lo que no está en el cubo (calles con pocos accidentes, filtro por un
+# distrito que no es el de la calle) se calcula en el momento igual.
+
+HORAS_FRANJA = 3
+N_FRANJAS = 24 // HORAS_FRANJA
+MIN_ACCIDENTES_CUBO = 3
+MUESTRAS_CALLE = 10
+DISTRITO_DESCONOCIDO = "Desconegut"
+
+def franja_hora(hora):
+    return int(hora) // HORAS_FRANJA
+
+def etiqueta_franja(franja):
+    inicio = franja * HORAS_FRANJA
+    return f"{inicio:02d}-{inicio + HORAS_FRANJA - 1:02d}h"
+
+def _fijar_dia_franja(X, dia, franja):
+    X = X.copy()
+    X[COL_DIA_CODI] = np.int8(dia)
+    X["Hora_dia"] = np.int8(franja * HORAS_FRANJA + HORAS_FRANJA // 2)
+    return X
+
+def _muestras(df):
+    """Hasta MUESTRAS_CALLE filas por calle (siempre las mismas)."""
+    return df.sample(frac=1, random_state=42).groupby(COLUMNA_CALLE, sort=False).head(MUESTRAS_CALLE)
+
+def _distrito_unico(df):
+    """Calle -> su distrito si todos los accidentes conocidos caen en uno solo ('' si no)."""
+    conocidos = df[df[COL_DISTRICTE] != DISTRITO_DESCONOCIDO].groupby(COLUMNA_CALLE)[COL_DISTRICTE]
+    unicos = conocidos.agg(["nunique", "first"])
+    return unicos["first"].where(unicos["nunique"] == 1, "")
+
+def construir_cubo(model, pipeline, df, path=CUBO_PATH):
+    """Precalcula P(causa | calle, día, franja) con inferencia por lotes."""
+    cuenta = df[COLUMNA_CALLE].value_counts()
+    calles = cuenta.index[cuenta >= MIN_ACCIDENTES_CUBO]
+    df = df[df[COLUMNA_CALLE].isin(calles)]
+    muestras = _muestras(df)
+    fila = calles.get_indexer(muestras[COLUMNA_CALLE])
+    por_calle = np.bincount(fila, minlength=len(calles))
+
+    X_base = pipeline.transformar(muestras)
+    cubo = np.zeros((len(calles), 7, N_FRANJAS, len(pipeline.etiquetas)), dtype=np.float32)
+    for dia in range(7):
+        for franja in range(N_FRANJAS):
+            probas = predecir_por_lotes(model, _fijar_dia_franja(X_base, dia, franja))
+            for i, clase in enumerate(model.classes_):
+                cubo[:, dia, franja, clase] = np.bincount(fila, weights=probas[:, i], minlength=len(calles)) / por_calle
+
+    distritos = _distrito_unico(df).reindex(calles).fillna("")
+    path.parent.mkdir(exist_ok=True)
+    np.savez_compressed(
+        path,
+        calles=np.asarray(calles, dtype=str),
+        distritos=np.asarray(distritos, dtype=str),
+        accidentes=cuenta[calles].to_numpy(np.int32),
+        probas=cubo.astype(np.float16),
+        etiquetas=np.asarray(pipeline.etiquetas, dtype=str),
+    )
+    return path
+
+
+class CuboProbabilidades:
+    """Cubo cargado en memoria con índice por nombre exacto y normalizado."""
+
+    def __init__(self, path=CUBO_PATH):
+        datos = np.load(path)
+        self.calles = datos["calles"].tolist()
+        self.distritos = datos["distritos"].tolist()
+        self.accidentes = datos["accidentes"]
+        self.probas = datos["probas"]
+        self.etiquetas = datos["etiquetas"].tolist()
+        self.indice = {calle: i for i, calle in enumerate(self.calles)}
+        # Nombre normalizado -> la calle con más accidentes que lo comparte
+        self.indice_normalizado = {}
+        for i in np.argsort(-self.accidentes, kind="stable"):
+            self.indice_normalizado.setdefault(normalize_text_advanced(self.calles[i]), int(i))
+
+    def fila(self, calle, distrito=None):
+        """Fila del cubo para la calle (y distrito), None si hay que calcularla."""
+        i = self.indice.get(calle)
+        if i is None:
+            i = self.indice_normalizado.get(normalize_text_advanced(calle))
+        if i is None or (distrito and self.distritos[i] != distrito):
+            return None
+        return i
+
+
+def cargar_cubo(path=CUBO_PATH):
+    """Carga el cubo si se ha generado (None si no existe)."""
+    return CuboProbabilidades(path) if Path(path).exists() else None
+
+def predecir_contexto(model, pipeline, cubo, df, calle, dia, hora, distrito=None):
+    """
+    Probabilidad de cada causa en una calle, día (0 = Dilluns) y hora. Devuelve
+    (calle, probabilidades, origen) con origen 'cubo' o 'inferencia', o None
+    si no hay accidentes de esa calle (y distrito).
+    """
+    franja = franja_hora(hora)
+    i = cubo.fila(calle, distrito) if cubo is not None else None
+    if i is not None:
+        return cubo.calles[i], cubo.probas[i, dia, franja].astype(np.float64), "cubo"
+
+    filas = df[df[COLUMNA_CALLE].str.lower() == calle.lower()]
+    if distrito:
+        filas = filas[filas[COL_DISTRICTE] == distrito]
+    if filas.empty:
+        return None
+
+    X = _fijar_dia_franja(pipeline.transformar(_muestras(filas)), dia, franja)
+    probas = np.zeros(len(pipeline.etiquetas))
+    probas[model.classes_] = model.predict_proba(X).mean(axis=0)
+    return filas[COLUMNA_CALLE].iloc[0], probas, "inferencia"
+
+
+# =======================================================
+# Paquetes de modelo versionados
+# =======================================================
+#
+# El servidor no carga los ficheros sueltos de model/ sino un paquete
+# inmutable: model/paquetes/<versión>/ con model.pkl, pipeline.pkl, el cubo
+# (si corresponde a ese modelo) y manifest.json con el SHA-256 de cada
+# fichero. Publicar escribe el paquete en una carpeta temporal, la renombra
+# y después reescribe model/paquetes/ACTIVO (también con rename), así que
+# nadie puede leer una mezcla de ficheros de dos entrenamientos. Al cargar
+# se verifican los checksums antes de deserializar nada.
+
+PAQUETES_PATH = Path("model/paquetes")
+ACTIVO_PATH = PAQUETES_PATH / "ACTIVO"
+MAX_PAQUETES = 5            # versiones que se conservan (además de la activa)
+
+
+def _sha256(ruta):
+    resumen = hashlib.sha256()
+    with open(ruta, "rb") as f:
+        for bloque in iter(lambda: f.read(1 << 20), b""):
+            resumen.update(bloque)
+    return resumen.hexdigest()
+
+def _escribir_atomico(ruta, texto):
+    temporal = ruta.with_name(f".{ruta.name}.tmp")
+    temporal.write_text(texto, encoding="utf-8")
+    os.replace(temporal, ruta)
+
+def version_activa(path=PAQUETES_PATH):
+    activo = Path(path) / ACTIVO_PATH.name
+    return activo.read_text(encoding="utf-8").strip() if activo.exists() else None
+
+def activar_paquete(version, path=PAQUETES_PATH):
+    """Marca como activa una versión ya publicada (también sirve para volver atrás)."""
+    if not (Path(path) / version / "manifest.json").exists():
+        raise ValueError(f"No existe el paquete '{version}'")
+    _escribir_atomico(Path(path) / ACTIVO_PATH.name, version)
+
+def listar_paquetes(path=PAQUETES_PATH):
+    """Versiones publicadas, de la más antigua a la más reciente."""
+    path = Path(path)
+    if not path.exists():
+        return []
+    return sorted(p.name for p in path.iterdir() if (p / "manifest.json").exists())
+
+def publicar_paquete(ruta_modelo=None, activar=True, path=PAQUETES_PATH, ruta_pipeline=None):
+    """
+    Copia el modelo seleccionado, su pipeline y el cubo actuales a un paquete
+    nuevo y (por defecto) lo marca como activo. El cubo sólo se incluye si se
+    generó después del modelo (si no, sería de otro entrenamiento).
+    """
+    ruta_modelo = Path(ruta_modelo or ruta_modelo_seleccionado())
+    ruta_pipeline = Path(ruta_pipeline or ruta_pipeline_de(ruta_modelo))
+    ficheros = {"model.pkl": ruta_modelo, "pipeline.pkl": ruta_pipeline}
+    if CUBO_PATH.exists() and CUBO_PATH.stat().st_mtime >= ruta_modelo.stat().st_mtime:
+        ficheros["cubo.npz"] = CUBO_PATH
+
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+    sumas = {nombre: _sha256(origen) for nombre, origen in ficheros.items()}
+    version = time.strftime("%Y%m%d-%H%M%S") + "-" + hashlib.sha256("".join(sumas.values()).encode()).hexdigest()[:8]
+    temporal = path / f".{version}.tmp"
+    shutil.rmtree(temporal, ignore_errors=True)
+    temporal.mkdir()
+    for nombre, origen in ficheros.items():
+        shutil.copyfile(origen, temporal / nombre)
+    manifiesto = {
+        "version": version,
+        "creado": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "modelo": ruta_modelo.stem,
+        "dataset": empremta_carpeta(),
+        "almacen": getattr(pickle.load(open(ruta_pipeline, "rb")), "almacen", None),
+        "ficheros": {nombre: {"sha256": sumas[nombre], "bytes": (temporal / nombre).stat().st_size}
+                     for nombre in ficheros},
+    }
+    (temporal / "manifest.json").write_text(json.dumps(manifiesto, ensure_ascii=False, indent=2), encoding="utf-8")
+    os.replace(temporal, path / version)
+
+    if activar:
+        activar_paquete(version, path)
+    activa = version_activa(path)
+    for antigua in [v for v in listar_paquetes(path) if v not in (activa, version)][:-MAX_PAQUETES or None]:
+        shutil.rmtree(path / antigua, ignore_errors=True)
+    print(f"Paquete de modelo publicado: {version}" + (" (activo)" if activar else ""))
+    return version
+
+
+class PaqueteModelo:
+    """Modelo, pipeline y cubo de una misma versión (no se modifica una vez cargado)."""
+
+    def __init__(self, carpeta):
+        carpeta = Path(carpeta)
+        self.manifiesto = json.loads((carpeta / "manifest.json").read_text(encoding="utf-8"))
+        for nombre, info in self.manifiesto["ficheros"].items():
+            if _sha256(carpeta / nombre) != info["sha256"]:
+                raise ValueError(f"Checksum incorrecto en {carpeta / nombre}")
+        self.version = self.manifiesto["version"]
+        self.nombre = self.manifiesto["modelo"]
+        self.model = pickle.load(open(carpeta / "model.pkl", "rb"))
+        self.pipeline = pickle.load(open(carpeta / "pipeline.pkl", "rb"))
+        self.cubo = CuboProbabilidades(carpeta / "cubo.npz") if "cubo.npz" in self.manifiesto["ficheros"] else None
+
+def cargar_paquete(version=None, path=PAQUETES_PATH):
+    """
+    Carga la versión indicada (por defecto la activa). Si todavía no hay
+    ningún paquete se publica uno con los ficheros sueltos actuales.
+    """
+    version = version or version_activa(path)
+    if version is None:
+        version = publicar_paquete(path=path)
+    return PaqueteModelo(Path(path) / version)
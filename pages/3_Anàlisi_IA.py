@@ -4,47 +4,10 @@ import os
 import re
 from collections import Counter
 import requests
-from difflib import get_close_matches
-import unicodedata
 
-FASTAPI_URL = "http://localhost:8000"   # o la URL donde tengas FastAPI corriendo
-
-def normalize_text_advanced(text):
-    """
-    Normalitza i neteja el text d'entrada:
-    1. Minúscules i eliminació d'espais.
-    2. Eliminació d'accents (diacrítics).
-    3. Eliminació de signes de puntuació.
-    4. Eliminació de tipus de via i preposicions comunes.
-    """
-    if not isinstance(text, str):
-        return ""
+from data_service import buscar_carrer, consultar, normalize_text_advanced, obtenir_dataset
 
-    text = text.lower().strip()
-
-    # 1. Normalització d'Unicode (treu accents i diacrítics: 'aragó' -> 'arago')
-    text = ''.join(c for c in unicodedata.normalize('NFD', text) if unicodedata.category(c) != 'Mn')
-
-    # 2. Neteja de caràcters i signes
-    text = text.replace('.', ' ').replace('-', ' ').replace("'", ' ')
-    
-    # Llista de tokens de tipus de via i preposicions a ignorar
-    tokens_a_ignorar = [
-        "carrer", "c", "avinguda", "av", "passeig", "pg", "ronda", "placa", "pl",
-        "via", "rambla", "travessera", "ctra",
-        "de les", "del", "de la", "de l", "dels", "de", "la", "el", "els", "les", "i"
-    ]
-    
-    # 3. Eliminació de tokens
-    tokens = []
-    for token in text.split():
-        if token not in tokens_a_ignorar:
-            tokens.append(token)
-
-    return ' '.join(tokens).strip()
-
-# Exemple: 'Prediu la causa per Av. Aragó' -> 'prediu causa arago'
-# Exemple: 'AVINGUDA DE SARRIÀ' -> 'sarria'
+FASTAPI_URL = "http://localhost:8000"   # o la URL donde tengas FastAPI corriendo
 
 def predict_calle_via_api(calle: str):
     """Llama al endpoint FastAPI /predict_calle."""
@@ -115,38 +78,9 @@ st.markdown('<h1 class="analyst-title">🤖 Analista de Dades de Trànsit</h1>',
 st.markdown('<p class="analyst-subtitle">Fes preguntes concretes sobre els accidents de trànsit a Barcelona basades en les dades que has pujat.</p>', unsafe_allow_html=True)
 
 
-# --- 1. Càrrega i Pre-processament de Dades (Funció de Doble Codificació) ---
-DATA_FOLDER = "data"
-os.makedirs(DATA_FOLDER, exist_ok=True)
-
-@st.cache_data
-def carregar_csv_desde_carpeta():
-    """Carrega tots els CSV amb doble codificació (UTF-8 i Latin-1)."""
-    arxius = [f for f in os.listdir(DATA_FOLDER) if f.endswith(".csv")]
-    dfs = {}
-    for arxiu in arxius:
-        ruta_arxiu = os.path.join(DATA_FOLDER, arxiu)
-        try:
-            df = pd.read_csv(ruta_arxiu, sep=',', encoding='utf-8')
-            dfs[arxiu] = df
-            continue
-        except UnicodeDecodeError:
-            pass
-            
-        try:
-            df = pd.read_csv(ruta_arxiu, sep=',', encoding='latin-1')
-            dfs[arxiu] = df
-        except Exception as e:
-            st.error(f"❌ Error carregant {arxiu}: {e}")
-            
-    return dfs
-
-# Carregar i combinar les dades
-dfs = carregar_csv_desde_carpeta()
-if dfs:
-    df_accidents = pd.concat(dfs.values(), ignore_index=True)
-else:
-    df_accidents = pd.DataFrame()
+# --- 1. Càrrega de Dades (dataset compartit entre pàgines) ---
+dataset = obtenir_dataset()
+df_accidents = dataset.df
 
 
 # --- 2. Inicialitzar Historial de Conversa ---
@@ -160,14 +94,12 @@ if "messages" not in st.session_state:
 
 # --- 3. Funció de Lògica de Resposta ---
 
-def detectar_carrer_ontologic(text, df):
+def detectar_carrer_ontologic(text, dataset):
     """
-    Detecta noms de carrer usant la normalització avançada i fuzzy matching.
-    Ara aïlla el nom del carrer del soroll de la pregunta.
+    Detecta noms de carrer usant la normalització avançada i fuzzy matching
+    contra el gazetteer del dataset (carrers ja normalitzats a la ingesta).
+    Aïlla el nom del carrer del soroll de la pregunta.
     """
-    if "Nom_carrer" not in df.columns:
-        return None
-
     # 1. Normalitzem el text de l'usuari (retorna 'prediu causa problable a arago')
     text_normalitzat_complet = normalize_text_advanced(text)
 
@@ -177,30 +109,15 @@ def detectar_carrer_ontologic(text, df):
     # NOU PAS CLAU: Aïllem només la part final del text (els últims 4 mots) per a la comparació fuzzy.
     text_a_comparar = ' '.join(text_normalitzat_complet.split()[-4:])
 
-
-    # Obtenim la llista de noms ORIGINALS i NORMALITZATS del dataset
-    carrers_originals = df["Nom_carrer"].dropna().unique().tolist()
-    # Aquesta llista idealment només s'hauria de calcular una vegada, fora de la funció.
-    carrers_normalitzats = [normalize_text_advanced(c) for c in carrers_originals] 
-    
     # 1. Intent de Coincidència amb les últimes 4 paraules
-    match = get_close_matches(text_a_comparar, carrers_normalitzats, n=1, cutoff=0.7)
-
-    if match:
-        # Trobem l'índex del nom normalitzat que ha coincidit
-        index = carrers_normalitzats.index(match[0])
-        # Retornem el nom ORIGINAL i correcte del dataset
-        return carrers_originals[index]
+    carrer = buscar_carrer(dataset, text_a_comparar)
+    if carrer:
+        return carrer
 
     # 2. Intent de Coincidència de paraula única (per si només es diu "Diagonal")
     # Si la primera cerca falla, intentem buscar un match només amb el darrer mot
     if len(text_a_comparar.split()) > 1:
-        text_darrer_mot = text_a_comparar.split()[-1]
-        
-        match_ultim = get_close_matches(text_darrer_mot, carrers_normalitzats, n=1, cutoff=0.7)
-        if match_ultim:
-            index = carrers_normalitzats.index(match_ultim[0])
-            return carrers_originals[index]
+        return buscar_carrer(dataset, text_a_comparar.split()[-1])
 
     return None
 
@@ -241,40 +158,36 @@ def analitzar_pregunta(user_text, df):
     # 3.2 Preguntes sobre Districte
     elif any(keyword in user_text for keyword in ["districte amb més", "districte mes", "districte amb menys"]):
         if COL_DISTRICTE in df.columns:
-            # Neteja de dades: Ignorar valors buits o 'Desconegut'
-            data = df[df[COL_DISTRICTE].notna() & (df[COL_DISTRICTE].str.strip() != '') & (df[COL_DISTRICTE].str.strip() != 'Desconegut')]
+            # Consulta compartida amb l'API (/query): ignora valors buits o 'Desconegut'
+            comptatge = consultar(dataset, {"excloure": {"districte": ["", "Desconegut"]}, "agrupar": ["districte"]})["grups"]
             
-            if data.empty:
+            if not comptatge:
                 resposta = "No hi ha dades de districte vàlides per a l'anàlisi."
             else:
-                comptatge = data[COL_DISTRICTE].value_counts()
-                
                 if "menys" in user_text:
-                    districte_clau = comptatge.index[-1]
-                    total_clau = comptatge.iloc[-1]
+                    districte_clau = comptatge[-1]["districte"]
+                    total_clau = comptatge[-1]["total"]
                     resposta = f"El districte amb **menys** accidents és **{districte_clau}** amb un total de {total_clau:,} accidents."
                 else:
-                    districte_clau = comptatge.index[0]
-                    total_clau = comptatge.iloc[0]
+                    districte_clau = comptatge[0]["districte"]
+                    total_clau = comptatge[0]["total"]
                     resposta = f"El districte amb **més** accidents registrats és **{districte_clau}** amb un total de {total_clau:,} accidents."
         else:
             resposta = f"No s'ha trobat la columna '{COL_DISTRICTE}' per analitzar per districte."
 
  # 3.3 Preguntes sobre Causes
     elif any(keyword in user_text for keyword in ["causa més", "causa mes", "motiu principal", "causes mes frequents"]):
+        causes = consultar(dataset, {"excloure": {"causa": [""]}, "agrupar": ["causa"]})["grups"]
         if COL_CAUSA not in df.columns:
             resposta = f"No s'ha trobat la columna '{COL_CAUSA}' per analitzar les causes."
-        else:
-            data = df[df[COL_CAUSA].notna() & (df[COL_CAUSA].str.strip() != '')]
-
-        if data.empty:
+        elif not causes:
             resposta = "No hi ha dades de causes vàlides per a l'anàlisi."
         else:
-            comptatge = data[COL_CAUSA].value_counts().head(3)
-            total = len(data)
+            total = sum(g["total"] for g in causes)
 
             linies = []
-            for i, (causa, count) in enumerate(comptatge.items(), start=1):
+            for i, grup in enumerate(causes[:3], start=1):
+                causa, count = grup["causa"], grup["total"]
                 percentatge = (count / total) * 100
                 linies.append(
                     f"**{i}. {causa}** → {count:,} casos ({percentatge:.2f}%)"
@@ -291,8 +204,7 @@ def analitzar_pregunta(user_text, df):
         any_trobat = re.search(r'\b\d{4}\b', user_text).group(0)
         
         if COL_ANY in df.columns:
-            df_any = df[df[COL_ANY].astype(str) == any_trobat]
-            total_any = len(df_any)
+            total_any = consultar(dataset, {"filtres": {"any": [int(any_trobat)]}})["total"]
             
             if total_any > 0:
                 resposta = f"L'any **{any_trobat}** es van registrar **{total_any:,}** accidents. Pots comprovar la distribució de causes per a aquest any a la pàgina 'Distribució Causes'."
@@ -311,7 +223,7 @@ def analitzar_pregunta(user_text, df):
             carrer_detectat = match.group(0)
         else:
             # 2) Mètode robust: fuzzy matching contra tota la llista de carrers
-            carrer_detectat = detectar_carrer_ontologic(user_text, df)
+            carrer_detectat = detectar_carrer_ontologic(user_text, dataset)
         
         if not carrer_detectat:
             return "No he pogut identificar cap carrer a la teva pregunta. Prova amb: 'Prediu la causa probable a Avinguda Diagonal'."
@@ -336,6 +248,12 @@ def analitzar_pregunta(user_text, df):
         for i, item in enumerate(top_3, 1):
             resposta += f"{i}. **{item['causa']}** ({item['probabilitat']}%)\n"
 
+        ubicacio = result.get("ubicacio")
+        if ubicacio:
+            lat, lon = ubicacio["centre"]
+            resposta += (f"\n📍 **{ubicacio['carrer']}**: centre ({lat}, {lon}), "
+                         f"{ubicacio['accidents']:,} accidents amb ubicació. Es pot veure a la pàgina 'Mapa Accidents'.")
+
         return resposta
 
 
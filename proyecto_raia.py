@@ -5,101 +5,49 @@
 
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-import seaborn as sns
 
 from pathlib import Path
-from sklearn.model_selection import train_test_split
-from sklearn.preprocessing import LabelEncoder, StandardScaler
-from sklearn.cluster import KMeans
+from sklearn.preprocessing import LabelEncoder
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.metrics import (
     accuracy_score,
     classification_report,
-    confusion_matrix,
-    ConfusionMatrixDisplay
 )
 
 
 
 # ===============================================
-# 1. CARGAR DATASET (VARIOS CSV)
+# 1. CARGAR FEATURES (ALMACÉN EN MEMORIA MAPEADA)
 # ===============================================
 
-from pathlib import Path
-import pandas as pd
-
-# Carpeta donde están tus CSV
-carpeta = Path(__file__).parent.parent / "datasets"
-
-# Obtener todos los CSV
-csv_files = list(carpeta.glob("*.csv"))
-
-if len(csv_files) == 0:
-    print("❌ No se encontraron archivos CSV en:", carpeta)
-    exit()
-
-print("CSV encontrados:")
-for f in csv_files:
-    print(" -", f.name)
-
-# Unir todos los CSV
-df = pd.concat((pd.read_csv(f) for f in csv_files), ignore_index=True)
-
-print("\n✔ Dataset combinado correctamente.")
-print("Total de filas:", len(df))
-print("Columnas del dataset:")
-print(df.columns)
-
+from ml_service import EVALUACION_PATH, TARGET, evaluar_modelo, obtener_almacen
 
-# ===============================================
-# 2. DEFINIR TARGET
-# ===============================================
-
-target = "Descripcio_causa_mediata"
+# Se codifica una sola vez por versión de /data (ver ml_service.obtener_almacen)
+almacen = obtener_almacen()
 
-if target not in df.columns:
-    print("\n❌ ERROR: La columna objetivo no existe.")
-    print("Columnas disponibles:", list(df.columns))
-    exit()
-
-# ===============================================
-# 3. IMPUTAR NULOS
-# ===============================================
-
-df = df.fillna("NA")  # Reemplazar nulos por 'NA' (podría ser otra estrategia según el dataset)
-
-# ===============================================
-# 4. CODIFICAR VARIABLES
-# ===============================================
+print("✔ Almacén de features:", almacen.versio[:12])
+print("Total de filas:", len(almacen.y))
+print("Columnas del modelo:")
+print(almacen.columnas)
 
-df_encoded = df.copy()
-# Convertir variables categóricas a números para Random Forest
-df_encoded = df_encoded.apply(
-    lambda col: col.astype("category").cat.codes if col.dtype == "object" else col
-)
+target = TARGET
 
 # ===============================================
-# 5. SEPARAR X E Y
+# 2. SEPARAR X E Y (TRAIN/TEST POR EXPEDIENTE)
 # ===============================================
 
-X = df_encoded.drop(columns=[target])
-y = df_encoded[target]
+# Vistas sobre los ficheros mapeados: no se copia nada
+X = almacen.como_df(almacen.X)
+y = almacen.y
+X_train, y_train = almacen.como_df(almacen.X_entreno), almacen.y_entreno
+X_test, y_test = almacen.como_df(almacen.X_prueba), almacen.y_prueba
 
 print("\nDataset preparado correctamente")
 print("X shape:", X.shape)
 print("y shape:", y.shape)
 
 # ===============================================
-# 6. SPLIT TRAIN/TEST
-# ===============================================
-
-X_train, X_test, y_train, y_test = train_test_split(
-    X, y, test_size=0.25, random_state=42, stratify=y
-)
-
-# ===============================================
-# 7. ENTRENAR MODELO RANDOM FOREST
+# 3. ENTRENAR MODELO RANDOM FOREST
 # ===============================================
 
 model = RandomForestClassifier(
@@ -111,13 +59,13 @@ model = RandomForestClassifier(
 model.fit(X_train, y_train)
 
 # ===============================================
-# 8. PREDICCIÓN
+# 4. PREDICCIÓN
 # ===============================================
 
 y_pred = model.predict(X_test)
 
 # ===============================================
-# 9. MÉTRICAS
+# 5. MÉTRICAS
 # ===============================================
 
 print("\nAccuracy:", accuracy_score(y_test, y_pred))
@@ -125,71 +73,36 @@ print("\nClassification Report:")
 print(classification_report(y_test, y_pred))
 
 # ===============================================
-# 10. MATRIZ DE CONFUSIÓN – AJUSTE FINAL DE MÁRGENES
+# 6. MATRIZ DE CONFUSIÓN E IMPORTANCIA DE VARIABLES
 # ===============================================
 
-cm = confusion_matrix(y_test, y_pred)
-labels = df[target].astype("category").cat.categories 
-
-# Aumentamos el ancho a 16 para dar más aire a las etiquetas
-plt.figure(figsize=(16, 11)) 
-
-sns.heatmap(
-    cm, 
-    annot=True, 
-    fmt='d', 
-    cmap='Blues', 
-    xticklabels=labels, 
-    yticklabels=labels,
-    annot_kws={"size": 9}
-)
-
-plt.ylabel('Etiqueta Real', fontsize=12, fontweight='bold')
-plt.xlabel('Etiqueta Predicha', fontsize=12, fontweight='bold')
-plt.title("Matriz de Confusión – Random Forest", fontsize=14, pad=20)
-
-# Ajuste fino de las etiquetas del eje X
-plt.xticks(
-    rotation=45, 
-    ha='right', 
-    rotation_mode='anchor', 
-    fontsize=10
-)
-plt.yticks(fontsize=10)
-
-# El truco definitivo: Reservamos un 30% del espacio para el margen inferior
-plt.subplots_adjust(bottom=0.30, left=0.20) 
-
-# Si usas una versión moderna de Matplotlib, esto ayuda a que nada se solape
-# plt.tight_layout() # Opcional: puedes probar si mejora o empeora tras subplots_adjust
-
-plt.show()
-
+# Sin plt.show(): el informe (PNG + HTML + JSON) se escribe en disco y se
+# puede generar en nodos sin pantalla (ver ml_service.evaluar_modelo)
+informe = evaluar_modelo(model, almacen, EVALUACION_PATH / "proyecto_raia", "random_forest_200_p12")
+print("\n✔ Matriz de confusión e importancias en", EVALUACION_PATH / "proyecto_raia")
 
 # ===============================================
-# 11. IMPORTANCIA DE VARIABLES
+# 7. CLUSTERING: PUNTOS CALIENTES
 # ===============================================
 
-importances = model.feature_importances_
-features = X.columns
-feature_importance_df = pd.DataFrame({'feature': features, 'importance': importances})
-feature_importance_df = feature_importance_df.sort_values(by='importance', ascending=False)
+# Celdas de ~50 m + componentes conexas de las celdas densas (hotspot_service)
+from data_service import obtenir_dataset
+from hotspot_service import obtenir_hotspots
 
-plt.figure(figsize=(10, 6))
-sns.barplot(x='importance', y='feature', data=feature_importance_df)
-plt.title("Importancia de Variables – Random Forest")
-plt.tight_layout()
-plt.show()
+hotspots = obtenir_hotspots(obtenir_dataset()).hotspots()
+print(f"\n=== {len(hotspots)} PUNTOS CALIENTES (top 10) ===")
+for h in hotspots[:10]:
+    causa = h["causes"][0] if h["causes"] else {"causa": "-", "percentatge": 0}
+    print(f"{h['accidents']:>4} accidentes  {', '.join(h['carrers']):<50}  {causa['causa']} ({causa['percentatge']}%)")
 
 # ==========================================================
 # PROYECTO ML – PREDICCIÓN DE CAUSA SEGÚN NOMBRE DE CALLE
 # MODELO + INPUT + PROBABILIDADES + GRIDSEARCH OPCIONAL
 # ==========================================================
 
-import pandas as pd
-from pathlib import Path
+import numpy as np
 
-from sklearn.model_selection import train_test_split, GridSearchCV, cross_val_score
+from sklearn.model_selection import GridSearchCV, cross_val_score
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.neighbors import KNeighborsClassifier
 from sklearn.tree import DecisionTreeClassifier
@@ -203,55 +116,18 @@ from sklearn.metrics import accuracy_score, classification_report
 # CONFIGURACIÓN
 # ==========================================================
 
-TARGET = "Descripcio_causa_mediata"
-COLUMNA_CALLE = "Nom_carrer"   # Ajustar si tu dataset usa otra columna
-
-
-# ==========================================================
-# 1. CARGAR CSVs
-# ==========================================================
-
-def cargar_csvs():
-    carpeta = Path(__file__).parent.parent / "datasets"
-    csv_files = list(carpeta.glob("*.csv"))
-
-    if not csv_files:
-        raise FileNotFoundError("No se encontraron CSV en /datasets")
-
-    df = pd.concat((pd.read_csv(f) for f in csv_files), ignore_index=True)
-    return df
+# CSV, features codificadas y filtro de calle vienen de ml_service:
+# se leen y codifican una sola vez por versión de /data.
+from ml_service import cargar_csvs, filtrar_calle, obtener_almacen
 
 
 # ==========================================================
-# 2. IMPUTAR Y CODIFICAR
+# 1. ENTRENAR RANDOM FOREST
 # ==========================================================
 
-def preparar_dataset(df):
-    df = df.fillna("NA")
-
-    codificadores = {}
-    df_encoded = df.copy()
-
-    for col in df.columns:
-        if df[col].dtype == "object":
-            df_encoded[col] = df[col].astype("category")
-            codificadores[col] = df_encoded[col].cat.categories
-            df_encoded[col] = df_encoded[col].cat.codes
-
-    X = df_encoded.drop(columns=[TARGET])
-    y = df_encoded[TARGET]
-
-    return X, y, codificadores
-
-
-# ==========================================================
-# 3. ENTRENAR RANDOM FOREST
-# ==========================================================
-
-def entrenar_random_forest(X, y):
-    X_train, X_test, y_train, y_test = train_test_split(
-        X, y, test_size=0.25, random_state=42, stratify=y
-    )
+def entrenar_random_forest(almacen):
+    X_train, y_train = almacen.como_df(almacen.X_entreno), almacen.y_entreno
+    X_test, y_test = almacen.como_df(almacen.X_prueba), almacen.y_prueba
 
     model = RandomForestClassifier(
         n_estimators=300, max_depth=16, random_state=42
@@ -268,41 +144,18 @@ def entrenar_random_forest(X, y):
 
 
 # ==========================================================
-# 4. FILTRAR CALLE
+# 2. PREDICCIÓN + PROBABILIDAD
 # ==========================================================
 
-def filtrar_calle(df, calle):
-    return df[df[COLUMNA_CALLE].str.contains(calle, case=False, na=False)]
-
-
-# ==========================================================
-# 5. CODIFICAR SEGÚN CODIFICADORES ORIGINALES
-# ==========================================================
+def predecir_calle(modelo, df_calle, pipeline):
 
-def codificar_df(df, codificadores):
-    df_encoded = df.copy()
-
-    for col in df.columns:
-        if col in codificadores:
-            cats = codificadores[col].tolist()
-            df_encoded[col] = df[col].apply(lambda x: cats.index(x) if x in cats else -1)
-
-    return df_encoded
-
-
-# ==========================================================
-# 6. PREDICCIÓN + PROBABILIDAD
-# ==========================================================
-
-def predecir_calle(modelo, df_calle, X_columns, codificadores):
-
-    df_encoded = codificar_df(df_calle, codificadores)
-    X_input = df_encoded[X_columns]
+    X_input = pipeline.transformar(df_calle)
 
     y_pred = modelo.predict(X_input)
-    probas = modelo.predict_proba(X_input)
+    probas = np.zeros((len(X_input), len(pipeline.etiquetas)))
+    probas[:, modelo.classes_] = modelo.predict_proba(X_input)
 
-    etiquetas = codificadores[TARGET]
+    etiquetas = pipeline.etiquetas
     pred_texto = [etiquetas[p] for p in y_pred]
 
     print("\n=== PREDICCIONES PARA LA CALLE (primeros 15) ===")
@@ -330,12 +183,15 @@ def predecir_calle(modelo, df_calle, X_columns, codificadores):
 
 
 # ==========================================================
-# 7. GRIDSEARCH (OPCIONAL)
+# 3. GRIDSEARCH (OPCIONAL)
 # ==========================================================
 
-def ejecutar_gridsearch(X, y):
+def ejecutar_gridsearch(almacen):
     print("\nEjecutando GridSearchCV...")
 
+    # Arrays mapeados: los workers de n_jobs abren el mismo fichero, sin copias
+    X, y = almacen.X_entreno, almacen.y_entreno
+
     param_grid = {
         "n_estimators": [100, 200, 300],
         "max_depth": [8, 12, 16, None],
@@ -359,10 +215,13 @@ def ejecutar_gridsearch(X, y):
 
 
 # ==========================================================
-# 8. COMPARAR VARIOS MODELOS
+# 4. COMPARAR VARIOS MODELOS
 # ==========================================================
 
-def comparar_modelos(X_train, X_test, y_train, y_test, X, y):
+def comparar_modelos(almacen):
+
+    X_train, y_train = almacen.X_entreno, almacen.y_entreno
+    X_test, y_test = almacen.X_prueba, almacen.y_prueba
 
     modelos = {
         "KNN": KNeighborsClassifier(n_neighbors=5),
@@ -379,7 +238,7 @@ def comparar_modelos(X_train, X_test, y_train, y_test, X, y):
     for nombre, modelo in modelos.items():
         modelo.fit(X_train, y_train)
         acc = modelo.score(X_test, y_test)
-        cv = cross_val_score(modelo, X, y, cv=10).mean()
+        cv = cross_val_score(modelo, X_train, y_train, cv=10).mean()
 
         print(f"{nombre.ljust(15)}  Test Acc = {acc:.3f} | CV Acc = {cv:.3f}")
 
@@ -390,11 +249,11 @@ def comparar_modelos(X_train, X_test, y_train, y_test, X, y):
 
 def main():
 
-    df = cargar_csvs()
-    print(f"✔ Dataset cargado ({len(df)} filas)")
+    almacen = obtener_almacen()
+    print(f"✔ Almacén de features cargado ({len(almacen.y)} filas)")
 
-    X, y, codificadores = preparar_dataset(df)
-    modelo = entrenar_random_forest(X, y)
+    modelo = entrenar_random_forest(almacen)
+    df = cargar_csvs()
 
     calle = input("\nIngresa la calle a analizar: ").strip()
     df_calle = filtrar_calle(df, calle)
@@ -405,7 +264,7 @@ def main():
 
     print(f"✔ {len(df_calle)} registros encontrados en '{calle}'")
 
-    predecir_calle(modelo, df_calle, X.columns, codificadores)
+    predecir_calle(modelo, df_calle, almacen.pipeline)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,8 +1,9 @@
 import streamlit as st
 import pandas as pd
-import os
 import plotly.express as px
 
+from data_service import obtenir_dataset
+
 # --- 1. CONFIGURACIÓ DE LA PÀGINA (Sempre la primera línia) ---
 st.set_page_config(page_title="Accidents a Barcelona", layout="wide")
 
@@ -122,30 +123,9 @@ st.markdown("""
     </style>
 """, unsafe_allow_html=True)
 
-# --- Funcions de Càrrega ---
-DATA_FOLDER = "data"
-os.makedirs(DATA_FOLDER, exist_ok=True)
-@st.cache_data
-def carregar_csv_desde_carpeta():
-    arxius = [f for f in os.listdir(DATA_FOLDER) if f.endswith(".csv")]
-    dfs = {}
-    for arxiu in arxius:
-        ruta_arxiu = os.path.join(DATA_FOLDER, arxiu)
-        try:
-            df = pd.read_csv(ruta_arxiu, sep=',', encoding='utf-8')
-            dfs[arxiu] = df
-            continue
-        except UnicodeDecodeError:
-            pass
-        try:
-            df = pd.read_csv(ruta_arxiu, sep=',', encoding='latin-1')
-            dfs[arxiu] = df
-        except Exception:
-            pass
-    return dfs
-
-dfs = carregar_csv_desde_carpeta()
-df_total = pd.concat(dfs.values(), ignore_index=True) if dfs else pd.DataFrame()
+# --- Càrrega de Dades (dataset compartit entre pàgines) ---
+dataset = obtenir_dataset()
+df_total = dataset.df
 # --- FILTRES GLOBALS ---
 
 st.sidebar.title(f"👤 {st.session_state.usuari_nom}")
@@ -156,9 +136,9 @@ if st.sidebar.button("Tancar Sessió"):
 
     st.rerun()
 
-anys_seleccionats = df_total['Nk_Any'].unique().tolist() if not df_total.empty else []
+anys_seleccionats = dataset.anys
 
-df_filtrat = df_total.copy()
+df_filtrat = df_total
 
 
 
@@ -168,7 +148,7 @@ if 'Nk_Any' in df_total.columns and not df_total.empty:
 
     with st.sidebar.expander("Filtres:", expanded=True):
 
-        anys_disponibles = sorted(df_total['Nk_Any'].unique().tolist())
+        anys_disponibles = dataset.anys
 
         anys_seleccionats = st.multiselect(
 
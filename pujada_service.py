@@ -0,0 +1,190 @@
+# pujada_service.py
+# =======================================================
+# Pujada de fitxers en streaming, desats per contingut
+# =======================================================
+#
+# /data/upload_imatge llegia tot el fitxer a memòria i l'escrivia amb
+# open().write al bucle d'esdeveniments, fent servir `file.filename` com a
+# ruta. Ara:
+#   - el cos multipart es llegeix de request.stream() i es parseja a mesura
+#     que arriba (python-multipart): mai hi ha més d'un tros a memòria;
+#   - les dades s'escriuen a un fitxer temporal en blocs de MIDA_BLOC des
+#     d'un fil (anyio), i el SHA-256 es calcula en el mateix pas;
+#   - el límit de mida es comprova amb Content-Length (abans de llegir res) i
+#     byte a byte durant la pujada; si se supera es talla i s'esborra;
+#   - el fitxer es desa per contingut a <carpeta>/<sha[:2]>/<sha><ext>: dues
+#     pujades iguals ocupen un sol fitxer (deduplicació) i el nom del client
+#     només s'usa per a l'extensió.
+#
+# Configuració: RAIA_PUJADES (carpeta) i RAIA_PUJADA_MAX_MB (límit per fitxer).
+
+import hashlib
+import os
+import re
+import tempfile
+from pathlib import Path
+
+import anyio
+from python_multipart.multipart import MultipartParser, parse_options_header
+
+PUJADES_PATH = Path(os.environ.get("RAIA_PUJADES", "uploaded_files"))
+MIDA_MAX_PUJADA = int(float(os.environ.get("RAIA_PUJADA_MAX_MB", "20")) * 1024 * 1024)
+MIDA_BLOC = 1024 * 1024         # bytes acumulats abans d'escriure'ls (des d'un fil)
+MARGE_MULTIPART = 16 * 1024     # capçaleres i límits multipart que compta Content-Length
+
+_EXTENSIO = re.compile(r"^\.[a-z0-9]{1,10}$")
+
+
+class PujadaMassaGran(Exception):
+    pass
+
+
+class PujadaInvalida(Exception):
+    pass
+
+
+def extensio_segura(nom):
+    """Extensió del nom del client si és alfanumèrica i curta; altrament cap."""
+    extensio = Path((nom or "").replace("\\", "/")).suffix.lower()
+    return extensio if _EXTENSIO.match(extensio) else ""
+
+
+def ruta_contingut(sha, extensio="", carpeta=PUJADES_PATH):
+    return Path(carpeta) / sha[:2] / f"{sha}{extensio}"
+
+
+class EscriptorContingut:
+    """
+    Fitxer temporal que s'omple per blocs des d'un fil i en calcula el SHA-256
+    a mesura que s'hi escriu. `desar()` el mou a la seva ruta per contingut.
+    """
+
+    def __init__(self, carpeta=PUJADES_PATH, max_bytes=MIDA_MAX_PUJADA):
+        self.carpeta = Path(carpeta)
+        self.max_bytes = max_bytes
+        self.mida = 0
+        self._hash = hashlib.sha256()
+        self._pendent = bytearray()
+        # dins la mateixa carpeta: el rename final és atòmic (mateix sistema de fitxers)
+        temporals = self.carpeta / ".tmp"
+        temporals.mkdir(parents=True, exist_ok=True)
+        descriptor, nom = tempfile.mkstemp(dir=temporals, suffix=".part")
+        self._fitxer = os.fdopen(descriptor, "wb")
+        self.temporal = Path(nom)
+
+    async def escriure(self, dades):
+        self.mida += len(dades)
+        if self.mida > self.max_bytes:
+            raise PujadaMassaGran(f"El fitxer supera el límit de {self.max_bytes} bytes.")
+        self._pendent += dades
+        if len(self._pendent) >= MIDA_BLOC:
+            await self._buidar()
+
+    async def _buidar(self):
+        if self._pendent:
+            bloc, self._pendent = bytes(self._pendent), bytearray()
+            await anyio.to_thread.run_sync(self._escriure_bloc, bloc)
+
+    def _escriure_bloc(self, bloc):
+        # hashlib i write alliberen el GIL: el bucle continua atenent peticions
+        self._hash.update(bloc)
+        self._fitxer.write(bloc)
+
+    async def desar(self, extensio=""):
+        """Tanca el temporal i el desa per contingut. Retorna (sha, ruta, duplicat)."""
+        await self._buidar()
+        sha = self._hash.hexdigest()
+        desti = ruta_contingut(sha, extensio, self.carpeta)
+        duplicat = await anyio.to_thread.run_sync(self._moure, desti)
+        return sha, desti, duplicat
+
+    def _moure(self, desti):
+        self._fitxer.close()
+        if desti.exists():
+            self.temporal.unlink(missing_ok=True)
+            return True
+        desti.parent.mkdir(parents=True, exist_ok=True)
+        os.chmod(self.temporal, 0o644)      # mkstemp el crea 0600
+        os.replace(self.temporal, desti)
+        return False
+
+    def descartar(self):
+        self._fitxer.close()
+        self.temporal.unlink(missing_ok=True)
+
+
+async def rebre_fitxer(request, camp="file", carpeta=PUJADES_PATH, max_bytes=MIDA_MAX_PUJADA):
+    """
+    Llegeix un cos multipart/form-data en streaming i desa el primer fitxer del
+    camp `camp`. Retorna un diccionari amb sha256, mida, ruta, duplicat i nom.
+    """
+    tipus, opcions = parse_options_header(request.headers.get("content-type", ""))
+    if tipus != b"multipart/form-data" or b"boundary" not in opcions:
+        raise PujadaInvalida("Cal un cos multipart/form-data.")
+    longitud = request.headers.get("content-length", "")
+    if longitud.isdigit() and int(longitud) > max_bytes + MARGE_MULTIPART:
+        raise PujadaMassaGran(f"El fitxer supera el límit de {max_bytes} bytes.")
+
+    # Les callbacks del parser són síncrones: acumulen els trossos del fitxer
+    # a `pendents` i s'escriuen (amb await) després de cada parser.write()
+    estat = {"camp": b"", "valor": b"", "capcaleres": {}, "dins": False, "nom": None}
+    pendents = []
+
+    def on_part_begin():
+        estat["capcaleres"] = {}
+
+    def on_header_field(dades, inici, fi):
+        estat["camp"] += dades[inici:fi]
+
+    def on_header_value(dades, inici, fi):
+        estat["valor"] += dades[inici:fi]
+
+    def on_header_end():
+        estat["capcaleres"][estat["camp"].lower()] = estat["valor"]
+        estat["camp"] = estat["valor"] = b""
+
+    def on_headers_finished():
+        _, disposicio = parse_options_header(estat["capcaleres"].get(b"content-disposition", b""))
+        if estat["nom"] is None and disposicio.get(b"name") == camp.encode() and b"filename" in disposicio:
+            estat["dins"] = True
+            estat["nom"] = disposicio[b"filename"].decode("utf-8", errors="replace")
+
+    def on_part_data(dades, inici, fi):
+        if estat["dins"]:
+            pendents.append(bytes(dades[inici:fi]))
+
+    def on_part_end():
+        estat["dins"] = False
+
+    parser = MultipartParser(opcions[b"boundary"], {
+        "on_part_begin": on_part_begin,
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+        "on_part_data": on_part_data,
+        "on_part_end": on_part_end,
+    })
+
+    escriptor = await anyio.to_thread.run_sync(EscriptorContingut, carpeta, max_bytes)
+    try:
+        async for tros in request.stream():
+            try:
+                parser.write(tros)
+            except Exception as e:
+                raise PujadaInvalida(f"Cos multipart mal format: {e}") from e
+            for dades in pendents:
+                await escriptor.escriure(dades)
+            pendents.clear()
+        parser.finalize()
+        if estat["nom"] is None:
+            raise PujadaInvalida(f"Falta el camp de fitxer '{camp}'.")
+        if escriptor.mida == 0:
+            raise PujadaInvalida("L'arxiu rebut és buit.")
+        sha, ruta, duplicat = await escriptor.desar(extensio_segura(estat["nom"]))
+    except BaseException:
+        # inclou la desconnexió del client i la cancel·lació: no queden temporals
+        escriptor.descartar()
+        raise
+    return {"sha256": sha, "mida": escriptor.mida, "ruta": ruta.as_posix(), "duplicat": duplicat,
+            "nom": estat["nom"]}
@@ -0,0 +1,107 @@
+# push_service.py
+# =======================================================
+# Difusió d'accidents nous cap als clients (WebSocket / SSE)
+# =======================================================
+#
+# Cada accident nou o modificat es serialitza UNA sola vegada i el mateix
+# objecte (text JSON i trama SSE) es posa a la cua de cada subscriptor
+# interessat: no hi ha còpia del missatge per client. Cada subscriptor pot
+# tenir un "viewport" (bbox) i només rep els accidents que hi cauen.
+# Les cues són acotades: un client massa lent es desconnecta en lloc de
+# fer créixer la memòria del servidor.
+
+import asyncio
+import json
+import threading
+
+MIDA_CUA = 256
+
+
+class Missatge:
+    """Missatge pre-serialitzat compartit per tots els subscriptors."""
+    __slots__ = ("text", "sse", "lat", "lon")
+
+    def __init__(self, tipus, registre):
+        self.text = json.dumps({"tipus": tipus, "accident": registre}, ensure_ascii=False)
+        self.sse = f"event: {tipus}\ndata: {self.text}\n\n".encode("utf-8")
+        self.lat = registre.get("Latitud")
+        self.lon = registre.get("Longitud")
+
+
+class Subscriptor:
+    def __init__(self, viewport=None):
+        self.cua = asyncio.Queue(maxsize=MIDA_CUA)
+        self.viewport = viewport        # (lat_min, lat_max, lon_min, lon_max) o None
+        self.desbordat = False
+
+    def interessat(self, missatge):
+        if self.viewport is None or missatge.lat is None or missatge.lon is None:
+            return True
+        lat_min, lat_max, lon_min, lon_max = self.viewport
+        return lat_min <= missatge.lat <= lat_max and lon_min <= missatge.lon <= lon_max
+
+
+class Difusor:
+    """Registre de subscriptors i difusió (fan-out) dels missatges."""
+
+    def __init__(self):
+        self.subscriptors = set()
+        self.loop = None
+        self._lock = threading.Lock()
+
+    @property
+    def connectats(self):
+        return len(self.subscriptors)
+
+    def subscriure(self, viewport=None):
+        # Es crida des del bucle d'esdeveniments (endpoint async)
+        self.loop = asyncio.get_running_loop()
+        subscriptor = Subscriptor(viewport)
+        with self._lock:
+            self.subscriptors.add(subscriptor)
+        return subscriptor
+
+    def donar_de_baixa(self, subscriptor):
+        with self._lock:
+            self.subscriptors.discard(subscriptor)
+
+    def publicar(self, tipus, registre):
+        """Publica un accident ('nou' o 'modificat'). Segur des de qualsevol fil."""
+        if self.loop is None or not self.subscriptors:
+            return
+        missatge = Missatge(tipus, registre)
+        self.loop.call_soon_threadsafe(self._difondre, missatge)
+
+    def _difondre(self, missatge):
+        with self._lock:
+            subscriptors = list(self.subscriptors)
+        for subscriptor in subscriptors:
+            if not subscriptor.interessat(missatge):
+                continue
+            try:
+                subscriptor.cua.put_nowait(missatge)
+            except asyncio.QueueFull:
+                # Client massa lent: fem lloc per a la marca de final (None)
+                # perquè el seu endpoint tanqui la connexió
+                subscriptor.desbordat = True
+                self.donar_de_baixa(subscriptor)
+                subscriptor.cua.get_nowait()
+                subscriptor.cua.put_nowait(None)
+
+
+def llegir_viewport(valor):
+    """
+    'lat_min,lat_max,lon_min,lon_max' (o una llista de 4 números) -> tupla de
+    floats, None si no n'hi ha. Llança ValueError si el format no és vàlid.
+    """
+    if not valor:
+        return None
+    if isinstance(valor, str):
+        valor = valor.split(",")
+    valors = [float(v) for v in valor]
+    if len(valors) != 4:
+        raise ValueError("El viewport ha de ser 'lat_min,lat_max,lon_min,lon_max'.")
+    return tuple(valors)
+
+
+difusor = Difusor()
@@ -0,0 +1,315 @@
+# repositori_service.py
+# =======================================================
+# Repositori de dades: pandas en memòria o SQLite indexat
+# =======================================================
+#
+# ml_service i els endpoints de dades de l'API llegeixen a través d'un
+# repositori amb la mateixa interfície:
+#   versio, accidents(), files_carrer(text), accidents_mapa(limit),
+#   consultar(consulta) (amb cache), executar(consulta) (sense cache) i
+#   dataset (el `Dataset` de les vistes derivades: carrers, hotspots, temporal).
+#
+# - RepositoriPandas (per defecte): el `Dataset` compartit de data_service.
+# - RepositoriSQLite: els accidents normalitzats en un fitxer SQLite
+#   (model/accidents.sqlite) amb índexs per any, districte, carrer i causa.
+#   Les consultes de /query s'executen com a SQL indexat i cada procés obre
+#   el mateix fitxer en lloc de llegir i normalitzar tots els CSV. El
+#   `dataset` es construeix amb només les columnes de COLUMNES_DERIVADES
+#   llegides de la base de dades (més el gazetteer i les coordenades desats
+#   a meta), així que tampoc necessita els CSV.
+#
+# El backend es tria amb la variable d'entorn RAIA_BACKEND=pandas|sqlite.
+# Els codis de cada dimensió (columnes dim_*) són els de
+# `construir_taula_columnar`, així que els dos backends responen el mateix a
+# la mateixa consulta.
+
+import json
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from data_service import (COL_ANY, COL_CARRER, COL_CAUSA, COL_DIA_CODI, COL_DISTRICTE, COL_HORA,
+                          COLUMNES_AGREGADES, DATA_FOLDER, MAX_CACHE_CONSULTES, MAX_GRUPS_CONSULTA,
+                          Dataset, Particio, construir_taula_columnar, consulta_canonica, consultar,
+                          empremta_carpeta, executar_consulta, obtenir_dataset)
+
+BACKEND = os.environ.get("RAIA_BACKEND", "pandas")
+BD_PATH = Path("model/accidents.sqlite")
+TROS_BD = 100_000        # files per escriptura en construir la base de dades
+ESQUEMA_BD = 3           # 3: gazetteer i coordenades a meta; 2: codi d'expedient per fila
+
+COLUMNES_INDEXADES = ("any", "districte", "carrer", "causa")
+COLUMNES_MAPA = ["Nk_Any", "Nom_districte", "Nom_carrer", "Latitud", "Longitud"]
+# columnes que fan servir les vistes derivades del Dataset (geo, carrers, hotspots, temporal)
+COLUMNES_DERIVADES = ["Numero_expedient", COL_ANY, COL_DISTRICTE, COL_CARRER, COL_CAUSA, COL_DIA_CODI, COL_HORA,
+                      "Latitud", "Longitud"]
+
+
+def _columna_codi(dim):
+    # no "codi_*": xocaria amb Codi_districte, Codi_carrer... (SQLite no distingeix majúscules)
+    return f"dim_{dim}"
+
+
+def _registres_mapa(df, limit=None):
+    df = df.reindex(columns=COLUMNES_MAPA).dropna()
+    if limit is not None:
+        df = df.head(limit)      # abans de to_dict: només es converteixen les files servides
+    df.insert(0, "id", range(1, len(df) + 1))
+    return df.to_dict("records")
+
+
+# =======================================================
+# Backend pandas (Dataset en memòria)
+# =======================================================
+
+class RepositoriPandas:
+    nom = "pandas"
+
+    def __init__(self, dataset=None, carpeta=DATA_FOLDER):
+        self._dataset = dataset      # fix (benchmarks) o el compartit de la carpeta
+        self.carpeta = carpeta
+
+    @property
+    def dataset(self):
+        return self._dataset if self._dataset is not None else obtenir_dataset(self.carpeta)
+
+    @property
+    def versio(self):
+        return self.dataset.versio
+
+    def accidents(self):
+        return self.dataset.df
+
+    def files_carrer(self, text):
+        df = self.dataset.df
+        return df[df[COL_CARRER].str.contains(text, case=False, na=False)]
+
+    def accidents_mapa(self, limit=1000):
+        return _registres_mapa(self.dataset.df, limit)
+
+    def consultar(self, consulta):
+        return consultar(self.dataset, consulta)
+
+    def executar(self, consulta):
+        dataset = self.dataset
+        if "columnar" not in dataset._cache:
+            dataset._cache["columnar"] = construir_taula_columnar(dataset.df)
+        return executar_consulta(dataset._cache["columnar"], consulta_canonica(consulta))
+
+
+# =======================================================
+# Backend SQLite
+# =======================================================
+
+def construir_bd(df, path=BD_PATH, versio="", gazetteer=None, coordenades=None):
+    """
+    Escriu els accidents normalitzats (totes les columnes) més els codis de
+    cada dimensió i el codi d'expedient de cada fila, amb els índexs. El
+    gazetteer i els comptes de coordenades del dataset es desen a meta.
+    Escriptura atòmica: es construeix en un fitxer temporal i es reanomena.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temporal = path.with_suffix(".tmp")
+    temporal.unlink(missing_ok=True)
+
+    taula = construir_taula_columnar(df)
+    dades = df.copy(deep=False)
+    for dim, codis in taula.codis.items():
+        dades[_columna_codi(dim)] = codis
+    dades["expedient"] = taula.expedient
+
+    con = sqlite3.connect(temporal)
+    try:
+        con.execute("PRAGMA journal_mode=OFF")
+        con.execute("PRAGMA synchronous=OFF")
+        # per trossos: to_sql converteix tot el dataframe a objectes Python d'un cop
+        for inici in range(0, len(dades), TROS_BD):
+            dades.iloc[inici:inici + TROS_BD].to_sql("accidents", con, index=False, if_exists="append")
+        # Índexs "coberts": la dimensió primer i després la resta de codis, així
+        # els filtres i agrupacions es resolen llegint només l'índex (files
+        # estretes) sense tocar les files senceres de la taula
+        codis = [_columna_codi(dim) for dim in taula.codis] + ["expedient"]
+        for dim in COLUMNES_INDEXADES:
+            if dim in taula.codis:
+                columna = _columna_codi(dim)
+                resta = ", ".join(c for c in codis if c != columna)
+                con.execute(f"CREATE INDEX idx_{dim} ON accidents({columna}, {resta})")
+        meta = {
+            "versio": versio,
+            "esquema": ESQUEMA_BD,
+            "etiquetes": taula.etiquetes,
+            "tipus": {col: str(tipus) for col, tipus in df.dtypes.items()},
+            "gazetteer": gazetteer or {},
+            "coordenades": coordenades or {},
+        }
+        con.execute("CREATE TABLE meta (clau TEXT PRIMARY KEY, valor TEXT)")
+        con.executemany("INSERT INTO meta VALUES (?, ?)",
+                        [(k, json.dumps(v, ensure_ascii=False)) for k, v in meta.items()])
+        con.execute("ANALYZE")
+        con.commit()
+    finally:
+        con.close()
+    os.replace(temporal, path)
+    return path
+
+
+class RepositoriSQLite:
+    nom = "sqlite"
+
+    def __init__(self, path=BD_PATH):
+        self.path = Path(path)
+        self._local = threading.local()      # una connexió (només lectura) per fil
+        meta = dict(self._connexio().execute("SELECT clau, valor FROM meta").fetchall())
+        self.versio = json.loads(meta["versio"])
+        self.esquema = json.loads(meta.get("esquema", "1"))
+        self.etiquetes = json.loads(meta["etiquetes"])
+        self.tipus = json.loads(meta["tipus"])
+        self.gazetteer = json.loads(meta.get("gazetteer", "{}"))
+        self.coordenades = json.loads(meta.get("coordenades", "{}"))
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._dataset = None
+
+    def _connexio(self):
+        con = getattr(self._local, "con", None)
+        if con is None:
+            con = self._local.con = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+        return con
+
+    def _llegir(self, where="", params=(), columnes=None):
+        """Files de la taula amb les columnes (totes per defecte) i els tipus del dataframe original."""
+        tipus = {c: t for c, t in self.tipus.items() if columnes is None or c in columnes}
+        seleccio = ", ".join(f'"{c}"' for c in tipus)
+        df = pd.read_sql_query(f"SELECT {seleccio} FROM accidents {where} ORDER BY rowid", self._connexio(),
+                               params=params)
+        for col, t in tipus.items():
+            if t != "object" and str(df[col].dtype) != t:
+                df[col] = df[col].astype(t)
+        return df
+
+    @property
+    def dataset(self):
+        """
+        `Dataset` lleuger per a les vistes derivades: només COLUMNES_DERIVADES,
+        llegides un cop de la base de dades, com una sola partició.
+        """
+        if self._dataset is None:
+            with self._lock:
+                if self._dataset is None:
+                    df = self._llegir(columnes=COLUMNES_DERIVADES)
+                    comptes = {col: df.groupby([COL_ANY, col]).size()
+                               for col in COLUMNES_AGREGADES if COL_ANY in df.columns and col in df.columns}
+                    particio = Particio(nom=self.path.name, hash=self.versio, df=df, comptes=comptes,
+                                        coordenades=self.coordenades)
+                    self._dataset = Dataset(versio=self.versio, particions=(particio,), df=df,
+                                            gazetteer=self.gazetteer)
+        return self._dataset
+
+    def accidents(self):
+        return self._llegir()
+
+    def files_carrer(self, text):
+        # El patró es busca sobre els noms de carrer (pocs milers) i les files
+        # es llegeixen per l'índex del codi
+        noms = pd.Series(self.etiquetes.get("carrer", []), dtype=object)
+        codis = np.flatnonzero(noms.str.contains(text, case=False, na=False)).tolist()
+        return self._llegir(f"WHERE {_columna_codi('carrer')} IN ({','.join('?' * len(codis))})", codis)
+
+    def accidents_mapa(self, limit=1000):
+        columnes = ", ".join(f'"{c}"' for c in COLUMNES_MAPA)
+        no_nuls = " AND ".join(f'"{c}" IS NOT NULL' for c in COLUMNES_MAPA)
+        df = pd.read_sql_query(f"SELECT {columnes} FROM accidents WHERE {no_nuls} ORDER BY rowid LIMIT ?",
+                               self._connexio(), params=(limit,))
+        return _registres_mapa(df)
+
+    def executar(self, consulta):
+        """Consulta declarativa (mateix format que /query) traduïda a SQL. Sense cache."""
+        canonica = consulta_canonica(consulta)
+        condicions, params = [], []
+        # filtres sobre totes les files; "expedients" compta expedients diferents entre les que compleixen
+        compte = "COUNT(DISTINCT expedient)" if canonica["comptar"] == "expedients" else "COUNT(*)"
+        for camp, inclou in (("filtres", True), ("excloure", False)):
+            for dim, valors in canonica.get(camp, {}).items():
+                if dim not in self.etiquetes:
+                    if inclou:
+                        return 0, []
+                    continue
+                posicio = {v: i for i, v in enumerate(self.etiquetes[dim])}
+                codis = [posicio[v] for v in valors if v in posicio]
+                operador = "IN" if inclou else "NOT IN"
+                condicions.append(f"{_columna_codi(dim)} {operador} ({','.join('?' * len(codis))})")
+                params += codis
+
+        con = self._connexio()
+        where = f"WHERE {' AND '.join(condicions)}" if condicions else ""
+        total = con.execute(f"SELECT {compte} FROM accidents {where}", params).fetchone()[0]
+
+        agrupar = canonica["agrupar"]
+        if not agrupar or any(dim not in self.etiquetes for dim in agrupar):
+            return total, []
+        columnes = ", ".join(_columna_codi(dim) for dim in agrupar)
+        condicions += [f"{_columna_codi(dim)} >= 0" for dim in agrupar]
+        files = con.execute(
+            f"SELECT {columnes}, {compte} AS total FROM accidents WHERE {' AND '.join(condicions)} "
+            f"GROUP BY {columnes} ORDER BY total DESC, {columnes} LIMIT ?",
+            params + [canonica["top"] or MAX_GRUPS_CONSULTA],
+        ).fetchall()
+        grups = [{**{dim: self.etiquetes[dim][fila[i]] for i, dim in enumerate(agrupar)}, "total": fila[-1]}
+                 for fila in files]
+        return total, grups
+
+    def consultar(self, consulta):
+        canonica = consulta_canonica(consulta)
+        clau = json.dumps(canonica, sort_keys=True, ensure_ascii=False)
+        with self._lock:
+            if clau in self._cache:
+                self._cache.move_to_end(clau)
+                return {**self._cache[clau], "cache": True}
+
+        total, grups = self.executar(canonica)
+        resultat = {"versio": self.versio, "consulta": canonica, "total": total, "grups": grups}
+        with self._lock:
+            self._cache[clau] = resultat
+            while len(self._cache) > MAX_CACHE_CONSULTES:
+                self._cache.popitem(last=False)
+        return {**resultat, "cache": False}
+
+
+def obtenir_bd(path=BD_PATH, carpeta=DATA_FOLDER):
+    """Obre la base de dades de la versió actual de /data; la construeix si no existeix o és antiga."""
+    path = Path(path)
+    versio = empremta_carpeta(carpeta)
+    if path.exists():
+        repositori = RepositoriSQLite(path)
+        if repositori.versio == versio and repositori.esquema == ESQUEMA_BD:
+            return repositori
+    dataset = obtenir_dataset(carpeta)
+    construir_bd(dataset.df, path, dataset.versio, dataset.gazetteer, dataset.coordenades)
+    return RepositoriSQLite(path)
+
+
+# Un repositori per procés; el de SQLite es torna a obrir si canvia /data
+_REPOSITORIS = {}
+_LOCK = threading.Lock()
+
+
+def obtenir_repositori(backend=None):
+    backend = backend or BACKEND
+    if backend == "pandas":
+        return _REPOSITORIS.setdefault("pandas", RepositoriPandas())
+    if backend != "sqlite":
+        raise ValueError(f"Backend desconegut: '{backend}' (pandas o sqlite)")
+
+    actual = _REPOSITORIS.get("sqlite")
+    if actual is None or actual.versio != empremta_carpeta():
+        with _LOCK:
+            actual = _REPOSITORIS.get("sqlite")
+            if actual is None or actual.versio != empremta_carpeta():
+                actual = _REPOSITORIS["sqlite"] = obtenir_bd()
+    return actual
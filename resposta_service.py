@@ -0,0 +1,125 @@
+# resposta_service.py
+# =======================================================
+# Respostes JSON pre-serialitzades amb ETag i gzip
+# =======================================================
+#
+# Els endpoints de dades canvien poc (accidents afegits, versió del
+# dataset) i es consulten molt (polling des de Unity). Cada resposta es
+# serialitza UNA vegada per versió amb orjson (json si no hi és), se'n guarda
+# la variant gzip i un ETag, i:
+#   - If-None-Match coincident  -> 304 sense cos,
+#   - Accept-Encoding: gzip     -> els bytes comprimits tal qual,
+#   - altrament                 -> els bytes JSON tal qual.
+# No hi ha validació Pydantic ni codificació JSON per petició.
+
+import gzip
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+from fastapi import Request, Response
+
+try:
+    import orjson
+except ImportError:         # opcional: el mòdul json dona el mateix resultat, més lent
+    orjson = None
+
+MIN_GZIP = 1024             # per sota, comprimir no compensa
+NIVELL_GZIP = 6
+MAX_CACHE_RESPOSTES = 256
+
+
+def _per_defecte(valor):
+    # arrays i escalars numpy que orjson no serialitza directament (o json)
+    if hasattr(valor, "tolist"):
+        return valor.tolist()
+    raise TypeError(f"No serialitzable: {type(valor).__name__}")
+
+
+def _etags(capcalera):
+    """ETags d'un If-None-Match (llista separada per comes), sense el prefix feble W/."""
+    return {e.strip().removeprefix("W/") for e in capcalera.split(",") if e.strip()}
+
+
+def _accepta_gzip(capcalera):
+    """Cert si Accept-Encoding admet gzip amb q > 0 (explícitament o amb '*')."""
+    qualitats = {}
+    for entrada in capcalera.split(","):
+        codificacio, _, parametres = entrada.partition(";")
+        q = 1.0
+        for parametre in parametres.split(";"):
+            nom, _, valor = parametre.partition("=")
+            if nom.strip() == "q":
+                try:
+                    q = float(valor)
+                except ValueError:
+                    q = 0.0
+        qualitats[codificacio.strip().lower()] = q
+    return qualitats.get("gzip", qualitats.get("*", 0.0)) > 0
+
+
+def serialitzar(obj):
+    if orjson is not None:
+        return orjson.dumps(obj, default=_per_defecte, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), default=_per_defecte).encode("utf-8")
+
+
+class RespostaPrerenderitzada:
+    __slots__ = ("cos", "gzip", "etag")
+
+    def __init__(self, obj):
+        self.cos = serialitzar(obj)
+        self.gzip = gzip.compress(self.cos, NIVELL_GZIP) if len(self.cos) >= MIN_GZIP else None
+        self.etag = f'"{hashlib.blake2b(self.cos, digest_size=12).hexdigest()}"'
+
+    def resposta(self, request: Request, capcaleres=None):
+        capcaleres = {"ETag": self.etag, "Vary": "Accept-Encoding", "Cache-Control": "no-cache", **(capcaleres or {})}
+        no_canviat = _etags(request.headers.get("if-none-match", ""))
+        if self.etag in no_canviat or "*" in no_canviat:
+            return Response(status_code=304, headers=capcaleres)
+        if self.gzip is not None and _accepta_gzip(request.headers.get("accept-encoding", "")):
+            return Response(self.gzip, media_type="application/json", headers={**capcaleres, "Content-Encoding": "gzip"})
+        return Response(self.cos, media_type="application/json", headers=capcaleres)
+
+
+class CacheRespostes:
+    """
+    Respostes pre-serialitzades per clau (endpoint + paràmetres). Cada clau
+    només guarda la versió més recent: quan la versió canvia es torna a
+    generar. LRU acotada a MAX_CACHE_RESPOSTES claus.
+
+    Les versions han de ser comparables (enters o tuples d'enters) i créixer
+    amb el temps: una petició lenta d'una versió antiga no pot trepitjar
+    l'entrada d'una de més nova.
+    """
+
+    def __init__(self, maxim=MAX_CACHE_RESPOSTES):
+        self.maxim = maxim
+        self._entrades = OrderedDict()      # clau -> (versio, RespostaPrerenderitzada)
+        self._lock = threading.Lock()
+
+    def obtenir(self, clau, versio, generar):
+        with self._lock:
+            entrada = self._entrades.get(clau)
+            if entrada is not None and entrada[0] == versio:
+                self._entrades.move_to_end(clau)
+                return entrada[1]
+
+        # Fora del lock (generar pot ser lent): mentrestant una altra petició
+        # pot haver desat la mateixa versió o una de més nova
+        resposta = RespostaPrerenderitzada(generar())
+        with self._lock:
+            entrada = self._entrades.get(clau)
+            if entrada is not None and entrada[0] >= versio:
+                # la mateixa versió: es manté la desada (ETag estable);
+                # una de més nova: aquesta resposta només serveix per a aquesta petició
+                return entrada[1] if entrada[0] == versio else resposta
+            self._entrades[clau] = (versio, resposta)
+            self._entrades.move_to_end(clau)
+            while len(self._entrades) > self.maxim:
+                self._entrades.popitem(last=False)
+        return resposta
+
+
+cache_respostes = CacheRespostes()
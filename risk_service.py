@@ -0,0 +1,308 @@
+# risk_service.py
+# =======================================================
+# Risc precalculat per trams de carrer (graella espacial)
+# =======================================================
+#
+# La ciutat es divideix en cel·les d'uns 110 m. Per a cada cel·la amb
+# accidents es precalcula (offline, amb inferència per lots del model):
+#   - nombre d'accidents i un risc normalitzat [0, 1] segons la densitat,
+#   - la distribució de causes (freqüència observada + probabilitat del model).
+# Consultar una ruta només és buscar les cel·les que travessa a l'índex
+# (diccionari clau -> fila), sense executar el model.
+
+import json
+import time
+
+import numpy as np
+from pathlib import Path
+
+from data_service import COL_DIA_CODI, COL_HORA, DIES_SETMANA
+from ml_service import TARGET, predecir_por_lotes
+
+RISC_PATH = Path("model/risc_segments.npz")
+RASTER_PATH = Path("model/risc_raster")   # .json (metadades) + _risc.npy + _causes.npy
+
+# Mida de cel·la en graus (~110 m a la latitud de Barcelona)
+MIDA_LAT = 0.001
+MIDA_LON = 0.00135
+
+# Pes de la probabilitat del model davant la freqüència observada
+PES_MODEL = 0.5
+
+# Límits d'una consulta de ruta (una crida per frame ha de ser barata)
+MAX_PUNTS_RUTA = 500
+MAX_PASSOS_TRAM = 400      # la diagonal de BBOX_BCN són ~300 passos
+
+# Superfície de risc: graella regular sobre Barcelona
+BBOX_BCN = (41.32, 41.47, 2.05, 2.23)      # lat_min, lat_max, lon_min, lon_max
+RESOLUCIO_RASTER = (0.002, 0.0027)         # graus (~220 m)
+DIST_MAX_RASTER = 0.003                    # cel·les sense cap accident a prop = sense dades
+NODATA = 255
+ESCALA_CAUSES = 254                        # probabilitat -> uint8
+
+
+def coordenades(df):
+    """(lat, lon) en float64 (data_service ja ha unificat les columnes WGS84 a Latitud/Longitud)."""
+    if "Latitud" not in df.columns or "Longitud" not in df.columns:
+        return np.full(len(df), np.nan), np.full(len(df), np.nan)
+    return df["Latitud"].to_numpy(dtype=float, na_value=np.nan), df["Longitud"].to_numpy(dtype=float, na_value=np.nan)
+
+
+def claus_cella(lat, lon):
+    """Clau enter única de la cel·la que conté cada punt."""
+    fila = np.floor(np.asarray(lat) / MIDA_LAT).astype(np.int64)
+    columna = np.floor(np.asarray(lon) / MIDA_LON).astype(np.int64)
+    return (fila << 32) + (columna & 0xFFFFFFFF)
+
+
+# =======================================================
+# Construcció offline
+# =======================================================
+
+def construir_taula_risc(df, model, pipeline, path=RISC_PATH):
+    """Calcula el risc per cel·la a partir de les dades crues i el model entrenat."""
+    lat, lon = coordenades(df)
+    valid = ~np.isnan(lat) & ~np.isnan(lon) & (lat != 0) & (lon != 0)
+    df = df[valid]
+    claus, inv = np.unique(claus_cella(lat[valid], lon[valid]), return_inverse=True)
+
+    etiquetes = np.asarray(pipeline.etiquetas)
+    n_classes = len(etiquetes)
+
+    # Probabilitats del model (una sola passada per lots sobre tots els accidents)
+    X = pipeline.transformar(df)
+    probas = predecir_por_lotes(model, X)
+    proba_model = np.zeros((len(claus), n_classes))
+    for i, classe in enumerate(model.classes_):
+        proba_model[:, classe] = np.bincount(inv, weights=probas[:, i], minlength=len(claus))
+
+    # Causes observades
+    y = pipeline.codificar_objetivo(df[TARGET])
+    conegut = y >= 0
+    observat = np.bincount(inv[conegut] * n_classes + y[conegut], minlength=len(claus) * n_classes)
+    observat = observat.reshape(len(claus), n_classes).astype(float)
+
+    n = np.bincount(inv, minlength=len(claus))
+    causes = PES_MODEL * proba_model / n[:, None]
+    causes += (1 - PES_MODEL) * observat / np.maximum(observat.sum(axis=1, keepdims=True), 1)
+    risc = np.log1p(n) / np.log1p(n.max())
+
+    path.parent.mkdir(exist_ok=True)
+    np.savez_compressed(
+        path,
+        claus=claus,
+        accidents=n.astype(np.int32),
+        risc=risc.astype(np.float32),
+        causes=causes.astype(np.float16),
+        etiquetes=etiquetes.astype(str),
+        mida=np.array([MIDA_LAT, MIDA_LON]),
+    )
+    return path
+
+
+# =======================================================
+# Consulta en temps real
+# =======================================================
+
+class TaulaRisc:
+    """Taula de risc carregada en memòria amb l'índex espacial de cel·les."""
+
+    def __init__(self, path=RISC_PATH):
+        dades = np.load(path)
+        self.claus = dades["claus"]
+        self.accidents = dades["accidents"]
+        self.risc = dades["risc"]
+        self.causes = dades["causes"].astype(np.float32)
+        self.etiquetes = dades["etiquetes"].tolist()
+        self.index = dict(zip(self.claus.tolist(), range(len(self.claus))))
+
+    def files_tram(self, inici, fi, veins=1):
+        """Files de la taula de les cel·les que travessa un tram (lon, lat) -> (lon, lat)."""
+        (lon0, lat0), (lon1, lat1) = inici, fi
+        passos = min(int(max(abs(lat1 - lat0) / MIDA_LAT, abs(lon1 - lon0) / MIDA_LON) * 2) + 1, MAX_PASSOS_TRAM)
+        t = np.linspace(0.0, 1.0, passos + 1)
+        fila = np.floor((lat0 + t * (lat1 - lat0)) / MIDA_LAT).astype(np.int64)
+        columna = np.floor((lon0 + t * (lon1 - lon0)) / MIDA_LON).astype(np.int64)
+
+        # Marge de `veins` cel·les per absorbir l'error de posició
+        desp = np.arange(-veins, veins + 1)
+        fila = (fila[:, None, None] + desp[None, :, None]).repeat(len(desp), axis=2).ravel()
+        columna = (columna[:, None, None] + desp[None, None, :]).repeat(len(desp), axis=1).ravel()
+        claus = np.unique((fila << 32) + (columna & 0xFFFFFFFF))
+        return [self.index[c] for c in claus.tolist() if c in self.index]
+
+    def risc_tram(self, inici, fi, top=3):
+        files = self.files_tram(inici, fi)
+        if not files:
+            return {"inici": list(inici), "fi": list(fi), "risc": 0.0, "accidents": 0, "causes": []}
+
+        n = self.accidents[files]
+        causes = (self.causes[files] * n[:, None]).sum(axis=0) / n.sum()
+        millors = np.argsort(causes)[::-1][:top]
+        return {
+            "inici": list(inici),
+            "fi": list(fi),
+            "risc": round(float(self.risc[files].max()), 3),
+            "accidents": int(n.sum()),
+            "causes": [
+                {"causa": self.etiquetes[i], "probabilitat": round(float(causes[i]) * 100, 2)}
+                for i in millors
+            ],
+        }
+
+    def risc_ruta(self, punts, top=3):
+        """Risc per tram d'una polilínia de punts (lon, lat)."""
+        return [self.risc_tram(a, b, top) for a, b in zip(punts[:-1], punts[1:])]
+
+
+def dins_bbox(lon, lat, bbox=BBOX_BCN):
+    """Cert si el punt (lon, lat) és finit i dins de la ciutat."""
+    lat_min, lat_max, lon_min, lon_max = bbox
+    return bool(np.isfinite(lon) and np.isfinite(lat) and lat_min <= lat <= lat_max and lon_min <= lon <= lon_max)
+
+
+def carregar_taula_risc(path=RISC_PATH):
+    """Carrega la taula de risc si s'ha generat (None si no existeix)."""
+    return TaulaRisc(path) if Path(path).exists() else None
+
+
+# =======================================================
+# Superfície de risc (ràster) per a tota la ciutat
+# =======================================================
+
+def _fixar_context(X, dia, hora):
+    """Substitueix dia i hora a les files codificades d'una franja."""
+    X = X.copy()
+    X[COL_DIA_CODI] = np.int8(dia)
+    X[COL_HORA] = np.int8(hora)
+    return X
+
+
+def construir_raster_risc(df, model, pipeline, per_hora=False,
+                          bbox=BBOX_BCN, resolucio=RESOLUCIO_RASTER, path=RASTER_PATH):
+    """
+    Avalua el model sobre una graella regular de la ciutat i desa un ràster compacte:
+    - `risc` (float16): densitat d'accidents normalitzada [0, 1],
+    - `causes` (uint8): probabilitat de cada causa * 254 (255 = sense dades).
+
+    Cada cel·la pren el context (carrer, barri, ...) de l'accident més proper.
+    Amb `per_hora` s'afegeixen 7 x 24 franges (dia, hora) després de la franja 0,
+    que és la global.
+    """
+    lat_min, lat_max, lon_min, lon_max = bbox
+    res_lat, res_lon = resolucio
+    alt = int(np.ceil((lat_max - lat_min) / res_lat))
+    ample = int(np.ceil((lon_max - lon_min) / res_lon))
+    lat_c = lat_min + (np.arange(alt) + 0.5) * res_lat
+    lon_c = lon_min + (np.arange(ample) + 0.5) * res_lon
+    graella = np.stack(np.meshgrid(lat_c, lon_c, indexing="ij"), axis=-1).reshape(-1, 2)
+
+    lat, lon = coordenades(df)
+    valid = ~np.isnan(lat) & ~np.isnan(lon) & (lat != 0) & (lon != 0)
+    df = df[valid].reset_index(drop=True)
+    lat, lon = lat[valid], lon[valid]
+
+    # Accident més proper a cada centre de cel·la (distància en graus "planers")
+    from sklearn.neighbors import KDTree     # només per construir el ràster, no per servir-lo
+    escala_lon = np.cos(np.radians((lat_min + lat_max) / 2))
+    distancia, veins = KDTree(np.c_[lat, lon * escala_lon]).query(
+        np.c_[graella[:, 0], graella[:, 1] * escala_lon], k=1
+    )
+    amb_dades = distancia[:, 0] < DIST_MAX_RASTER
+    plantilla = df.iloc[veins[amb_dades, 0]].reset_index(drop=True)
+    X_base = pipeline.transformar(plantilla)
+
+    franges = [None] + ([(d, h) for d in range(7) for h in range(24)] if per_hora else [])
+    etiquetes = np.asarray(pipeline.etiquetas).astype(str)
+    causes = np.full((len(franges), len(etiquetes), alt * ample), NODATA, dtype=np.uint8)
+
+    # Densitat observada per cel·la (i per franja)
+    fila = np.floor((lat - lat_min) / res_lat).astype(np.int64)
+    columna = np.floor((lon - lon_min) / res_lon).astype(np.int64)
+    dins = (fila >= 0) & (fila < alt) & (columna >= 0) & (columna < ample)
+    cella = fila * ample + columna
+    comptes = np.zeros((len(franges), alt * ample))
+    comptes[0] = np.bincount(cella[dins], minlength=alt * ample)
+    if per_hora:
+        # codis ja normalitzats per data_service (-1 = desconegut)
+        dia = df[COL_DIA_CODI].to_numpy(np.int64)
+        hora = df[COL_HORA].to_numpy(np.int64)
+        ok = dins & (dia >= 0) & (hora >= 0) & (hora < 24)
+        index = (dia[ok] * 24 + hora[ok]) * alt * ample + cella[ok]
+        comptes[1:] = np.bincount(index, minlength=7 * 24 * alt * ample).reshape(7 * 24, alt * ample)
+
+    # Inferència per lots: una passada per franja sobre totes les cel·les amb dades
+    for k, franja in enumerate(franges):
+        X = X_base if franja is None else _fixar_context(X_base, *franja)
+        probas = predecir_por_lotes(model, X)
+        q = np.zeros((len(etiquetes), len(X)), dtype=np.uint8)
+        q[model.classes_] = np.round(probas.T * ESCALA_CAUSES).astype(np.uint8)
+        causes[k][:, amb_dades] = q
+
+    risc = comptes / np.maximum(comptes.max(axis=1, keepdims=True), 1)
+
+    path.parent.mkdir(exist_ok=True)
+    np.save(f"{path}_risc.npy", risc.reshape(len(franges), alt, ample).astype(np.float16))
+    np.save(f"{path}_causes.npy", causes.reshape(len(franges), len(etiquetes), alt, ample))
+    metadades = {
+        "bbox": [lat_min, lat_max, lon_min, lon_max],
+        "resolucio": [res_lat, res_lon],
+        "forma": [alt, ample],
+        "origen": "fila 0 = lat_min (sud), columna 0 = lon_min (oest)",
+        "per_hora": per_hora,
+        "franges": "0 = global" + (", 1 + dia * 24 + hora" if per_hora else ""),
+        "dies": DIES_SETMANA,
+        "etiquetes": etiquetes.tolist(),
+        "escala_causes": ESCALA_CAUSES,
+        "nodata": NODATA,
+        "creat": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+    Path(f"{path}.json").write_text(json.dumps(metadades, ensure_ascii=False, indent=2), encoding="utf-8")
+    return path
+
+
+class RasterRisc:
+    """Ràster de risc mapejat en memòria: llegir una finestra no carrega el fitxer sencer."""
+
+    def __init__(self, path=RASTER_PATH):
+        self.meta = json.loads(Path(f"{path}.json").read_text(encoding="utf-8"))
+        self.risc = np.load(f"{path}_risc.npy", mmap_mode="r")
+        self.causes = np.load(f"{path}_causes.npy", mmap_mode="r")
+        self.etiquetes = self.meta["etiquetes"]
+
+    def franja(self, dia=None, hora=None):
+        """Índex de la franja (0 = global). Llança ValueError si el dia o l'hora són fora de rang."""
+        if dia is None or hora is None or not self.meta["per_hora"]:
+            return 0
+        dia, hora = int(dia), int(hora)
+        if not 0 <= dia <= 6 or not 0 <= hora <= 23:
+            raise ValueError(f"Franja fora de rang: dia {dia} (0-6), hora {hora} (0-23)")
+        return 1 + dia * 24 + hora
+
+    def finestra(self, lat_min, lat_max, lon_min, lon_max, banda="risc", dia=None, hora=None):
+        """
+        Retorna (valors, bbox_real) de la finestra demanada. `banda` és 'risc'
+        o el nom d'una causa. Llança KeyError si la banda no existeix.
+        """
+        b_lat_min, _, b_lon_min, _ = self.meta["bbox"]
+        res_lat, res_lon = self.meta["resolucio"]
+        alt, ample = self.meta["forma"]
+        f0 = int(np.clip(np.floor((lat_min - b_lat_min) / res_lat), 0, alt))
+        f1 = int(np.clip(np.ceil((lat_max - b_lat_min) / res_lat), f0, alt))
+        c0 = int(np.clip(np.floor((lon_min - b_lon_min) / res_lon), 0, ample))
+        c1 = int(np.clip(np.ceil((lon_max - b_lon_min) / res_lon), c0, ample))
+
+        k = self.franja(dia, hora)
+        if banda == "risc":
+            valors = self.risc[k, f0:f1, c0:c1]
+        elif banda in self.etiquetes:
+            valors = self.causes[k, self.etiquetes.index(banda), f0:f1, c0:c1]
+        else:
+            raise KeyError(banda)
+        bbox = [b_lat_min + f0 * res_lat, b_lat_min + f1 * res_lat, b_lon_min + c0 * res_lon, b_lon_min + c1 * res_lon]
+        return np.ascontiguousarray(valors), bbox
+
+
+def carregar_raster_risc(path=RASTER_PATH):
+    """Carrega el ràster de risc si s'ha generat (None si no existeix)."""
+    return RasterRisc(path) if Path(f"{path}.json").exists() else None
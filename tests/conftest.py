@@ -0,0 +1,62 @@
+# conftest.py
+# =======================================================
+# Fixtures compartides de les proves
+# =======================================================
+#
+# Els mòduls del projecte viuen a l'arrel del repositori (no és un paquet):
+# s'afegeix al sys.path perquè `pytest` funcioni des de qualsevol carpeta.
+# Les dades són sintètiques i petites; cap prova llegeix data/ ni model/.
+
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from data_service import (COL_ANY, COL_CARRER, COL_CAUSA, COL_DIA_CODI, COL_DISTRICTE,  # noqa: E402
+                          COL_HORA, Dataset)
+
+DISTRICTES = ["Eixample", "Gràcia", "Sants-Montjuïc", "Sant Martí"]
+CARRERS = ["Aragó", "Balmes", "Diagonal", "Gran Via", "Sants", "Verdi"]
+CAUSES = ["Altres", "Desobeir semàfor", "Gir indegut", "Manca d'atenció", "Velocitat inadequada"]
+
+
+def accidents_sintetics(n_expedients=400, llavor=0):
+    """
+    Dataframe amb l'esquema normalitzat: diversos conductors (files) per
+    expedient, valors desconeguts (NaN, -1) i files sense número d'expedient.
+    """
+    rng = np.random.default_rng(llavor)
+    conductors = rng.integers(1, 4, n_expedients)
+    expedient = np.repeat([f"2024S{i:06d}" for i in range(n_expedients)], conductors).astype(object)
+    n = len(expedient)
+    expedient[rng.random(n) < 0.03] = None
+
+    def triar(valors, buits=0.0):
+        serie = pd.Series(np.array(valors, dtype=object)[rng.integers(0, len(valors), n)])
+        return serie.mask(rng.random(n) < buits)
+
+    return pd.DataFrame({
+        "Numero_expedient": expedient,
+        COL_ANY: rng.integers(2021, 2024, n),
+        COL_DISTRICTE: triar(DISTRICTES, 0.05),
+        COL_CARRER: triar(CARRERS),
+        COL_CAUSA: triar(CAUSES, 0.05),
+        COL_DIA_CODI: rng.integers(-1, 7, n).astype(np.int8),
+        COL_HORA: rng.integers(-1, 24, n).astype(np.int8),
+        "Latitud": 41.38 + rng.random(n) * 0.01,
+        "Longitud": 2.15 + rng.random(n) * 0.01,
+    })
+
+
+@pytest.fixture
+def df_accidents():
+    return accidents_sintetics()
+
+
+@pytest.fixture
+def dataset(df_accidents):
+    return Dataset(versio="proves", particions=(), df=df_accidents, gazetteer={})
@@ -0,0 +1,120 @@
+# CacheLRU: single-flight (un sol càlcul per clau absent), expulsió per
+# entrades i per bytes, caducitat i mètriques.
+
+import threading
+import time
+
+import pytest
+
+from cache_service import CacheLRU
+
+
+def esperar(condicio, segons=5):
+    limit = time.monotonic() + segons
+    while not condicio():
+        assert time.monotonic() < limit, "temps d'espera esgotat"
+        time.sleep(0.001)
+
+
+def test_single_flight_un_sol_calcul():
+    cache = CacheLRU()
+    calculs = []
+    dins = threading.Event()
+    allibera = threading.Event()
+
+    def calcular():
+        calculs.append(1)
+        dins.set()
+        allibera.wait(5)
+        return {"valor": 42}
+
+    resultats = []
+    fils = [threading.Thread(target=lambda: resultats.append(cache.obtenir("clau", calcular))) for _ in range(8)]
+    fils[0].start()
+    assert dins.wait(5)                  # el primer fil està calculant
+    for fil in fils[1:]:
+        fil.start()
+    esperar(lambda: cache.metriques()["agrupades"] == 7)      # la resta esperen el mateix càlcul
+    allibera.set()
+    for fil in fils:
+        fil.join(5)
+
+    assert len(calculs) == 1
+    assert resultats == [{"valor": 42}] * 8
+    metriques = cache.metriques()
+    assert (metriques["fallades"], metriques["agrupades"], metriques["en_curs"]) == (1, 7, 0)
+    assert cache.obtenir("clau", lambda: pytest.fail("no s'ha de recalcular")) == {"valor": 42}
+
+
+def test_single_flight_propaga_l_excepcio_i_no_la_desa():
+    cache = CacheLRU()
+    dins = threading.Event()
+    allibera = threading.Event()
+
+    def fallar():
+        dins.set()
+        allibera.wait(5)
+        raise RuntimeError("model no disponible")
+
+    errors = []
+
+    def demanar():
+        try:
+            cache.obtenir("clau", fallar)
+        except RuntimeError as e:
+            errors.append(e)
+
+    lider = threading.Thread(target=demanar)
+    lider.start()
+    assert dins.wait(5)
+    seguidor = threading.Thread(target=demanar)
+    seguidor.start()
+    esperar(lambda: cache.metriques()["agrupades"] == 1)
+    allibera.set()
+    lider.join(5)
+    seguidor.join(5)
+
+    assert len(errors) == 2 and errors[0] is errors[1]
+    assert cache.obtenir("clau", lambda: "ara sí") == "ara sí"
+
+
+def test_expulsio_lru_per_entrades():
+    cache = CacheLRU(max_entrades=2)
+    cache.obtenir("a", lambda: 1)
+    cache.obtenir("b", lambda: 2)
+    cache.obtenir("a", lambda: pytest.fail("hi és"))       # "a" passa a ser la més recent
+    cache.obtenir("c", lambda: 3)                          # expulsa "b"
+    assert cache.metriques()["expulsions"] == 1
+    assert cache.obtenir("a", lambda: "nou") == 1
+    assert cache.obtenir("b", lambda: "nou") == "nou"
+
+
+def test_expulsio_per_bytes():
+    cache = CacheLRU(max_bytes=400, mida=len)
+    for i in range(5):
+        cache.obtenir(i, lambda: "x" * 100)
+    metriques = cache.metriques()
+    assert metriques["bytes"] <= 400
+    assert metriques["entrades"] == 4
+    assert metriques["expulsions"] == 1
+
+
+def test_valor_massa_gran_no_es_desa():
+    cache = CacheLRU(max_bytes=400, mida=len)
+    assert cache.obtenir("gran", lambda: "x" * 200) == "x" * 200       # > max_bytes / 4
+    assert cache.metriques()["entrades"] == 0
+
+
+def test_caducitat():
+    cache = CacheLRU(ttl_s=0.01)
+    cache.obtenir("a", lambda: 1)
+    time.sleep(0.02)
+    assert cache.obtenir("a", lambda: 2) == 2
+    assert cache.metriques()["caducades"] == 1
+
+
+def test_buidar():
+    cache = CacheLRU()
+    cache.obtenir("a", lambda: [1, 2, 3])
+    cache.buidar()
+    assert cache.metriques()["entrades"] == cache.metriques()["bytes"] == 0
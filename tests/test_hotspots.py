@@ -0,0 +1,112 @@
+# Índex de punts calents: union-find de cel·les denses en afegir accidents,
+# ids que no es compten dues vegades i índexs ampliats = reconstruïts.
+
+import pandas as pd
+
+from data_service import COL_CARRER, COL_CAUSA, Dataset, Particio
+from hotspot_service import (MIDA_LAT, MIDA_LON, MIN_ACCIDENTS_CELLA, MIN_ACCIDENTS_HOTSPOT, IndexHotspots,
+                             afegir_registres, obtenir_hotspots)
+
+FILA, COLUMNA = 91950, 3600      # una cel·la qualsevol de Barcelona
+N = MIN_ACCIDENTS_HOTSPOT        # prou per ser densa i, sola, un punt calent
+
+
+def centre(fila, columna):
+    return (fila + 0.5) * MIDA_LAT, (columna + 0.5) * MIDA_LON
+
+
+def omplir(index, fila, columna, n, causa=None):
+    lat, lon = centre(fila, columna)
+    return [index.afegir(lat, lon, causa=causa, carrer="Aragó") for _ in range(n)]
+
+
+def test_cella_densa_crea_hotspot():
+    index = IndexHotspots(["Altres"])
+    ids = omplir(index, FILA, COLUMNA, MIN_ACCIDENTS_CELLA, causa="Altres")
+    assert ids[:-1] == [None] * (MIN_ACCIDENTS_CELLA - 1)
+    assert ids[-1] == f"{FILA}_{COLUMNA}"
+    assert index.hotspots() == []            # una sola cel·la no arriba a MIN_ACCIDENTS_HOTSPOT
+
+
+def test_cella_pont_uneix_dos_grups():
+    index = IndexHotspots([])
+    omplir(index, FILA, COLUMNA + 2, N)
+    omplir(index, FILA, COLUMNA, N)
+    assert len(index.hotspots()) == 2
+
+    # la cel·la del mig, en passar a densa, és veïna de les dues
+    ids = omplir(index, FILA, COLUMNA + 1, MIN_ACCIDENTS_CELLA)
+    hotspots = index.hotspots()
+    assert len(hotspots) == 1
+    assert hotspots[0]["celles"] == 3
+    assert hotspots[0]["accidents"] == 2 * N + MIN_ACCIDENTS_CELLA
+    # l'id és la cel·la mínima del grup, sigui quin sigui l'ordre d'unió
+    assert ids[-1] == hotspots[0]["id"] == f"{FILA}_{COLUMNA}"
+
+
+def test_veinatge_en_diagonal():
+    index = IndexHotspots([])
+    omplir(index, FILA, COLUMNA, N)
+    omplir(index, FILA + 1, COLUMNA + 1, N)
+    omplir(index, FILA + 3, COLUMNA + 3, N)
+    assert sorted(h["celles"] for h in index.hotspots()) == [1, 2]
+
+
+def test_id_repetit_no_compta_dues_vegades():
+    index = IndexHotspots([])
+    lat, lon = centre(FILA, COLUMNA)
+    for _ in range(3):
+        index.afegir(lat, lon, id=7)
+    assert index.canvis == 1
+    assert index.celles[(FILA, COLUMNA)].accidents == 1
+
+
+def test_index_nou_reprodueix_els_afegits():
+    lat, lon = centre(FILA, COLUMNA)
+    registres = [{"id": i, "Latitud": lat, "Longitud": lon, "Nom_carrer": "Aragó"} for i in range(30)]
+    dataset = Dataset(versio="v1", particions=(), df=pd.DataFrame({"Latitud": [41.0], "Longitud": [2.0]}),
+                      gazetteer={})
+    index = obtenir_hotspots(dataset, lambda: registres)
+    assert index.canvis == 30
+    afegir_registres(index, registres)       # ja hi són
+    assert index.canvis == 30
+    assert obtenir_hotspots(dataset, lambda: registres) is index
+
+
+def _files(n, fila, columna, expedient, causa):
+    lat, lon = centre(fila, columna)
+    return pd.DataFrame({"Numero_expedient": [f"{expedient}{i}" for i in range(n)], "Latitud": [lat] * n,
+                         "Longitud": [lon] * n, COL_CAUSA: [causa] * n, COL_CARRER: ["Aragó"] * n})
+
+
+def test_ampliar_equival_a_reconstruir():
+    base = pd.concat([_files(30, FILA, COLUMNA, "a", "Altres"), _files(10, FILA, COLUMNA + 1, "b", "Altres")])
+    # els expedients "a*" ja hi eren: compten causes però no densitat
+    nova = pd.concat([_files(20, FILA, COLUMNA + 1, "c", "Gir indegut"),
+                      _files(5, FILA, COLUMNA + 2, "a", "Altres")])
+    vistos = nova["Numero_expedient"].isin(base["Numero_expedient"]).to_numpy()
+    causes = ["Altres", "Gir indegut"]
+
+    ampliat = IndexHotspots.des_de_df(base, causes, "v1").ampliar(nova, "v2", vistos)
+    reconstruit = IndexHotspots.des_de_df(pd.concat([base, nova], ignore_index=True), causes, "v2")
+    assert ampliat.versio == "v2"
+    assert ampliat.hotspots() == reconstruit.hotspots()
+    assert ampliat.hotspots()[0]["celles"] == 2
+
+
+def test_ampliar_amb_causa_desconeguda_demana_reconstruir():
+    index = IndexHotspots.des_de_df(_files(30, FILA, COLUMNA, "a", "Altres"), ["Altres"], "v1")
+    assert index.ampliar(_files(1, FILA, COLUMNA, "b", "Nova"), "v2") is None
+    assert index.versio == "v1"
+
+
+def test_amb_particio_passa_l_index_al_dataset_nou():
+    df = _files(30, FILA, COLUMNA, "a", "Altres").drop(columns=COL_CAUSA)
+    particio = Particio(nom="a.csv", hash="a", df=df, comptes={})
+    anterior = Dataset(versio="v1", particions=(particio,), df=df, gazetteer={})
+    index = obtenir_hotspots(anterior)
+    nova = _files(5, FILA, COLUMNA, "b", "Altres").drop(columns=COL_CAUSA)
+    nou = anterior.amb_particio(Particio(nom="b.csv", hash="b", df=nova, comptes={}), "v2")
+    assert obtenir_hotspots(nou) is index
+    assert index.celles[(FILA, COLUMNA)].accidents == 35
+    assert "hotspots" not in anterior._cache
@@ -0,0 +1,96 @@
+# Paquets de model versionats: el manifest porta el SHA-256 de cada fitxer
+# i cargar_paquete el verifica abans de deserialitzar res.
+
+import json
+import pickle
+from types import SimpleNamespace
+
+import pytest
+
+import ml_service
+from ml_service import activar_paquete, cargar_paquete, listar_paquetes, publicar_paquete, version_activa
+
+
+@pytest.fixture
+def artefactes(tmp_path, monkeypatch):
+    # cwd temporal: ni el cubo de model/ ni l'empremta de data/ del repositori
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(ml_service, "empremta_carpeta", lambda: "dades-proves")
+    ruta_modelo, ruta_pipeline = tmp_path / "model.pkl", tmp_path / "pipeline.pkl"
+
+    def escriure(model, almacen="almacen-1"):
+        ruta_modelo.write_bytes(pickle.dumps(model))
+        ruta_pipeline.write_bytes(pickle.dumps(SimpleNamespace(almacen=almacen)))
+        return ruta_modelo, ruta_pipeline
+
+    return escriure
+
+
+@pytest.fixture
+def paquetes(tmp_path):
+    return tmp_path / "paquetes"
+
+
+def publicar(artefactes, paquetes, model, **kwargs):
+    ruta_modelo, ruta_pipeline = artefactes(model)
+    return publicar_paquete(ruta_modelo, path=paquetes, ruta_pipeline=ruta_pipeline, **kwargs)
+
+
+def test_publicar_i_carregar(artefactes, paquetes):
+    version = publicar(artefactes, paquetes, {"arbres": 3})
+    assert version_activa(paquetes) == version
+
+    paquete = cargar_paquete(path=paquetes)
+    assert paquete.version == version
+    assert paquete.model == {"arbres": 3}
+    assert paquete.pipeline.almacen == "almacen-1"
+    assert paquete.cubo is None
+    manifiesto = json.loads((paquetes / version / "manifest.json").read_text(encoding="utf-8"))
+    assert set(manifiesto["ficheros"]) == {"model.pkl", "pipeline.pkl"}
+    assert (manifiesto["dataset"], manifiesto["almacen"]) == ("dades-proves", "almacen-1")
+
+
+@pytest.mark.parametrize("fitxer", ["model.pkl", "pipeline.pkl"])
+def test_checksum_incorrecte_no_es_deserialitza(artefactes, paquetes, fitxer):
+    version = publicar(artefactes, paquetes, {"arbres": 3})
+    # si es fes pickle.load primer fallaria amb UnpicklingError, no amb el checksum
+    (paquetes / version / fitxer).write_bytes(b"no es un pickle")
+    with pytest.raises(ValueError, match="Checksum incorrecto"):
+        cargar_paquete(version, path=paquetes)
+
+
+def test_fitxer_del_manifest_absent(artefactes, paquetes):
+    version = publicar(artefactes, paquetes, {"arbres": 3})
+    (paquetes / version / "pipeline.pkl").unlink()
+    with pytest.raises(FileNotFoundError):
+        cargar_paquete(version, path=paquetes)
+
+
+def test_tornar_enrere(artefactes, paquetes):
+    primera = publicar(artefactes, paquetes, {"arbres": 1})
+    segona = publicar(artefactes, paquetes, {"arbres": 2})
+    assert primera != segona
+    assert cargar_paquete(path=paquetes).model == {"arbres": 2}
+
+    activar_paquete(primera, paquetes)
+    assert cargar_paquete(path=paquetes).model == {"arbres": 1}
+    with pytest.raises(ValueError):
+        activar_paquete("no-existeix", paquetes)
+
+
+def test_poda_conserva_l_activa(artefactes, paquetes, monkeypatch):
+    monkeypatch.setattr(ml_service, "MAX_PAQUETES", 2)
+    for i in range(5):
+        ultima = publicar(artefactes, paquetes, {"arbres": i})
+    assert version_activa(paquetes) == ultima
+    assert ultima in listar_paquetes(paquetes)
+    assert len(listar_paquetes(paquetes)) == 3            # l'activa + MAX_PAQUETES
+    assert not list(paquetes.glob(".*.tmp"))
+
+
+def test_publicar_sense_activar(artefactes, paquetes):
+    activa = publicar(artefactes, paquetes, {"arbres": 0})
+    nova = publicar(artefactes, paquetes, {"arbres": 1}, activar=False)
+    assert version_activa(paquetes) == activa
+    assert cargar_paquete(nova, path=paquetes).model == {"arbres": 1}
+    assert cargar_paquete(path=paquetes).model == {"arbres": 0}
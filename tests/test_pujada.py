@@ -0,0 +1,107 @@
+# Pujades en streaming: desades per contingut, deduplicades, i sense
+# temporals quan se supera el límit (per Content-Length o durant la lectura).
+
+import hashlib
+
+import pytest
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.testclient import TestClient
+
+from pujada_service import MIDA_BLOC, PujadaInvalida, PujadaMassaGran, rebre_fitxer, ruta_contingut
+
+LIMIT = 3 * MIDA_BLOC
+
+
+def multipart(contingut, nom="foto.PNG", camp="file", frontera="----frontera"):
+    return (
+        f"--{frontera}\r\n"
+        f'Content-Disposition: form-data; name="{camp}"; filename="{nom}"\r\n'
+        "Content-Type: application/octet-stream\r\n\r\n"
+    ).encode() + contingut + f"\r\n--{frontera}--\r\n".encode(), f"multipart/form-data; boundary={frontera}"
+
+
+def a_trossos(dades, mida=64 * 1024):
+    # sense Content-Length (transfer-encoding chunked): el límit es comprova llegint
+    for inici in range(0, len(dades), mida):
+        yield dades[inici:inici + mida]
+
+
+@pytest.fixture
+def carpeta(tmp_path):
+    return tmp_path / "pujades"
+
+
+@pytest.fixture
+def client(carpeta):
+    app = FastAPI()
+
+    @app.post("/pujar")
+    async def pujar(request: Request):
+        try:
+            return await rebre_fitxer(request, "file", carpeta, LIMIT)
+        except PujadaMassaGran as e:
+            raise HTTPException(status_code=413, detail=str(e))
+        except PujadaInvalida as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    return TestClient(app)
+
+
+def fitxers(carpeta):
+    return sorted(p.relative_to(carpeta).as_posix() for p in carpeta.rglob("*") if p.is_file())
+
+
+def test_desa_per_contingut_i_deduplica(client, carpeta):
+    contingut = b"\x89PNG" + bytes(range(256)) * 4096        # > MIDA_BLOC: s'escriu en diversos blocs
+    cos, tipus = multipart(contingut)
+    primera = client.post("/pujar", content=cos, headers={"Content-Type": tipus}).json()
+
+    sha = hashlib.sha256(contingut).hexdigest()
+    assert primera["sha256"] == sha
+    assert primera["mida"] == len(contingut)
+    assert primera["duplicat"] is False
+    assert ruta_contingut(sha, ".png", carpeta).read_bytes() == contingut
+
+    cos, tipus = multipart(contingut, nom="../../altre nom.png")
+    segona = client.post("/pujar", content=cos, headers={"Content-Type": tipus}).json()
+    assert segona["duplicat"] is True
+    assert fitxers(carpeta) == [f"{sha[:2]}/{sha}.png"]
+
+
+def test_extensio_insegura_es_descarta(client, carpeta):
+    cos, tipus = multipart(b"dades", nom="x.p/h\\p;rm -rf")
+    resposta = client.post("/pujar", content=cos, headers={"Content-Type": tipus}).json()
+    assert resposta["ruta"].endswith(resposta["sha256"])
+
+
+def test_massa_gran_en_streaming_no_deixa_temporals(client, carpeta):
+    cos, tipus = multipart(b"x" * (LIMIT + MIDA_BLOC))
+    resposta = client.post("/pujar", content=a_trossos(cos), headers={"Content-Type": tipus})
+    assert resposta.status_code == 413
+    assert fitxers(carpeta) == []
+
+
+def test_massa_gran_per_content_length(client, carpeta):
+    cos, tipus = multipart(b"x" * (LIMIT + MIDA_BLOC))
+    resposta = client.post("/pujar", content=cos, headers={"Content-Type": tipus})
+    assert resposta.status_code == 413
+    assert fitxers(carpeta) == []
+
+
+def test_just_al_limit_s_accepta(client, carpeta):
+    cos, tipus = multipart(b"y" * LIMIT)
+    resposta = client.post("/pujar", content=a_trossos(cos), headers={"Content-Type": tipus})
+    assert resposta.status_code == 200
+    assert resposta.json()["mida"] == LIMIT
+
+
+@pytest.mark.parametrize("cos, tipus", [
+    (b"{}", "application/json"),
+    (*multipart(b"dades", camp="altre"),),
+    (*multipart(b""),),
+    (b"--x\r\nbrossa", "multipart/form-data; boundary=x"),
+])
+def test_pujada_invalida(client, carpeta, cos, tipus):
+    resposta = client.post("/pujar", content=cos, headers={"Content-Type": tipus})
+    assert resposta.status_code == 400
+    assert fitxers(carpeta) == []
@@ -0,0 +1,97 @@
+# Els dos backends del repositori (pandas en memòria i SQLite) han de
+# respondre el mateix a la mateixa consulta i servir les mateixes vistes
+# derivades.
+
+import numpy as np
+import pytest
+
+from data_service import consulta_canonica, matriu_temporal
+from repositori_service import RepositoriPandas, RepositoriSQLite, construir_bd
+
+CONSULTES = [
+    {},
+    {"agrupar": ["any"]},
+    {"agrupar": ["districte", "causa"]},
+    {"agrupar": ["carrer"], "comptar": "expedients"},
+    {"filtres": {"any": [2022, "2023"]}, "agrupar": ["dia"]},
+    {"filtres": {"causa": "Gir indegut"}, "excloure": {"districte": ["Gràcia"]}, "agrupar": ["hora"]},
+    {"filtres": {"districte": ["Eixample"], "dia": [0, "Dimarts"]}, "comptar": "expedients"},
+    {"filtres": {"carrer": ["Diagonal"]}, "agrupar": ["any", "districte"], "comptar": "expedients"},
+    {"filtres": {"districte": ["No existeix"]}, "agrupar": ["any"]},
+    {"excloure": {"carrer": ["No existeix"]}, "agrupar": ["causa"]},
+]
+
+
+@pytest.fixture
+def repositoris(dataset, tmp_path):
+    path = construir_bd(dataset.df, tmp_path / "accidents.sqlite", versio=dataset.versio)
+    return RepositoriPandas(dataset), RepositoriSQLite(path)
+
+
+@pytest.mark.parametrize("consulta", CONSULTES)
+def test_backends_coincideixen(repositoris, consulta):
+    pandas, sqlite = repositoris
+    assert pandas.executar(consulta) == sqlite.executar(consulta)
+
+
+def test_top_retorna_els_mateixos_comptes(repositoris):
+    # amb empats a la frontera del top els grups poden variar; els comptes no
+    consulta = {"agrupar": ["carrer", "hora"], "top": 5}
+    (total_p, grups_p), (total_s, grups_s) = (r.executar(consulta) for r in repositoris)
+    assert total_p == total_s
+    assert [g["total"] for g in grups_p] == [g["total"] for g in grups_s]
+    assert len(grups_p) == 5
+
+
+def test_consultar_memoritza(repositoris):
+    for repositori in repositoris:
+        primera = repositori.consultar({"agrupar": ["any"]})
+        segona = repositori.consultar({"agrupar": ["any"]})
+        assert (primera["cache"], segona["cache"]) == (False, True)
+        assert primera["grups"] == segona["grups"]
+
+
+def test_expedients_compten_un_cop(df_accidents, repositoris):
+    # un expedient compta si alguna de les seves files compleix el filtre
+    files = df_accidents[df_accidents["Nom_carrer"] == "Diagonal"]
+    sense_numero = files["Numero_expedient"].isna().sum()
+    esperat = files["Numero_expedient"].nunique() + sense_numero
+    for repositori in repositoris:
+        total, _ = repositori.executar({"filtres": {"carrer": "Diagonal"}, "comptar": "expedients"})
+        assert total == esperat
+
+
+def test_dataset_derivat_de_sqlite(repositoris):
+    pandas, sqlite = repositoris
+    for args in ((None, False, False), (2022, False, True), (None, True, True)):
+        matriu_p, eixos_p = matriu_temporal(pandas.dataset, *args)
+        matriu_s, eixos_s = matriu_temporal(sqlite.dataset, *args)
+        assert eixos_p == eixos_s
+        assert np.array_equal(matriu_p, matriu_s)
+    assert pandas.dataset.carrers.equals(sqlite.dataset.carrers)
+
+
+@pytest.mark.parametrize("consulta", [
+    [],
+    {"desconegut": 1},
+    {"filtres": {"any": ["dos mil"]}},
+    {"filtres": {"any": [True]}},
+    {"filtres": {"hora": [{"a": 1}]}},
+    {"filtres": {"color": ["vermell"]}},
+    {"filtres": ["any"]},
+    {"agrupar": "any"},
+    {"agrupar": [["any"]]},
+    {"top": 0},
+    {"top": True},
+    {"top": "5"},
+    {"comptar": "conductors"},
+])
+def test_consulta_invalida(consulta):
+    with pytest.raises(ValueError):
+        consulta_canonica(consulta)
+
+
+def test_consulta_canonica_normalitza():
+    canonica = consulta_canonica({"filtres": {"any": ["2023", 2022, 2023], "dia": [0]}, "agrupar": ["any"]})
+    assert canonica == {"filtres": {"any": [2022, 2023], "dia": ["Dilluns"]}, "agrupar": ["any"], "top": None,
+                        "comptar": "files"}
@@ -0,0 +1,115 @@
+# Respostes pre-serialitzades: ETag/304 (llistes, W/, *), gzip segons
+# Accept-Encoding (q=0) i CacheRespostes amb versions ordenades.
+
+import gzip
+import json
+
+import numpy as np
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from resposta_service import CacheRespostes, RespostaPrerenderitzada, _accepta_gzip, _etags
+
+COS = {"hotspots": [{"id": i, "centre": [41.38, 2.17]} for i in range(200)], "comptes": np.arange(5)}
+
+
+@pytest.fixture
+def client():
+    app = FastAPI()
+    resposta = RespostaPrerenderitzada(COS)
+
+    @app.get("/dades")
+    def dades(request: Request):
+        return resposta.resposta(request)
+
+    return TestClient(app)
+
+
+def test_resposta_porta_etag(client):
+    resposta = client.get("/dades", headers={"Accept-Encoding": "identity"})
+    assert resposta.status_code == 200
+    assert resposta.headers["etag"].startswith('"')
+    assert resposta.headers["vary"] == "Accept-Encoding"
+    assert json.loads(resposta.content)["comptes"] == [0, 1, 2, 3, 4]
+
+
+@pytest.mark.parametrize("if_none_match", [
+    "{etag}",
+    'W/{etag}',
+    '"antic", {etag}',
+    '"antic",W/{etag} , "altre"',
+    "*",
+])
+def test_if_none_match_coincident_dona_304(client, if_none_match):
+    etag = client.get("/dades").headers["etag"]
+    resposta = client.get("/dades", headers={"If-None-Match": if_none_match.format(etag=etag)})
+    assert resposta.status_code == 304
+    assert resposta.content == b""
+    assert resposta.headers["etag"] == etag
+
+
+@pytest.mark.parametrize("if_none_match", ['"antic"', "{parcial}", "{etag}x", ""])
+def test_if_none_match_no_coincident_dona_200(client, if_none_match):
+    etag = client.get("/dades").headers["etag"]
+    capcalera = if_none_match.format(etag=etag, parcial=etag[:-3] + '"')
+    assert client.get("/dades", headers={"If-None-Match": capcalera}).status_code == 200
+
+
+@pytest.mark.parametrize("accept_encoding, comprimit", [
+    ("gzip", True),
+    ("br, gzip;q=0.5", True),
+    ("*", True),
+    ("gzip;q=0", False),
+    ("gzip;q=0.0, *;q=1", False),
+    ("identity", False),
+    ("", False),
+])
+def test_gzip_segons_accept_encoding(client, accept_encoding, comprimit):
+    resposta = client.get("/dades", headers={"Accept-Encoding": accept_encoding})
+    assert (resposta.headers.get("content-encoding") == "gzip") is comprimit
+    # httpx descomprimeix: el cos ha de ser el mateix JSON en tots dos casos
+    assert json.loads(resposta.content)["hotspots"][199]["id"] == 199
+
+
+def test_cos_petit_no_es_comprimeix():
+    assert RespostaPrerenderitzada({"a": 1}).gzip is None
+    gran = RespostaPrerenderitzada(COS)
+    assert gzip.decompress(gran.gzip) == gran.cos
+
+
+def test_parseig_de_capcaleres():
+    assert _etags('"a", W/"b",, "c" ') == {'"a"', '"b"', '"c"'}
+    assert not _accepta_gzip("gzip;q=abc")
+
+
+def test_cache_respostes_una_per_versio():
+    cache = CacheRespostes()
+    crides = []
+
+    def generar(valor):
+        return lambda: crides.append(valor) or {"valor": valor}
+
+    primera = cache.obtenir("clau", 1, generar(1))
+    assert cache.obtenir("clau", 1, generar(1)) is primera
+    segona = cache.obtenir("clau", 2, generar(2))
+    assert segona.etag != primera.etag
+    assert crides == [1, 2]
+
+
+def test_versio_antiga_no_trepitja_la_nova():
+    cache = CacheRespostes()
+    nova = cache.obtenir("clau", (2, 0), lambda: {"v": 2})
+    # una petició lenta que encara veia la versió anterior
+    antiga = cache.obtenir("clau", (1, 5), lambda: {"v": 1})
+    assert json.loads(antiga.cos) == {"v": 1}
+    assert cache.obtenir("clau", (2, 0), lambda: pytest.fail("s'ha perdut la versió nova")) is nova
+
+
+def test_lru_acotada():
+    cache = CacheRespostes(maxim=2)
+    for clau in "abc":
+        cache.obtenir(clau, 1, lambda: {})
+    crides = []
+    cache.obtenir("a", 1, lambda: crides.append("a") or {})
+    assert crides == ["a"]